@@ -0,0 +1,208 @@
+import time
+import urllib.parse
+from typing import TYPE_CHECKING, Optional, Dict, Any, List
+
+import aiohttp
+import hmac
+from yarl import URL
+
+from codec import json_dumps, json_loads
+from metrics import Metrics, endpoint_name
+from ratelimit import RateLimiter, request_priority
+
+if TYPE_CHECKING:
+    from recorder import Recorder
+
+
+class AsyncFtxClient:
+    """
+    asyncio counterpart of FtxClient with the same method surface, every call is a coroutine.
+    All requests go through one pooled keep-alive connector so concurrent calls
+    run side by side on warm connections instead of queueing behind each other
+    """
+    _ENDPOINT = 'https://ftx.com/api/'
+
+    def __init__(self, api_key=None, api_secret=None, subaccount_name=None, endpoint=None,
+                 pool_size: int = 20, rate_limiter: Optional[RateLimiter] = None,
+                 metrics: Optional[Metrics] = None, recorder: Optional['Recorder'] = None) -> None:
+        self._session = None
+        self._endpoint = endpoint or self._ENDPOINT
+        self._pool_size = pool_size
+        self._api_key = api_key
+        self._api_secret = api_secret
+        self._subaccount_name = subaccount_name
+        # path the endpoint adds in front of every request path, part of what gets signed
+        self._path_prefix = urllib.parse.urlsplit(self._endpoint).path
+        self._hmac = hmac.new(api_secret.encode(), digestmod='sha256') if api_secret else None
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = metrics or Metrics()
+        self.recorder = recorder
+
+    async def __aenter__(self) -> 'AsyncFtxClient':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # created lazily so the session binds to the loop that actually runs the requests
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, keepalive_timeout=30, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return await self._request('GET', path, params=params)
+
+    async def _post(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return await self._request('POST', path, json=params)
+
+    async def _delete(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return await self._request('DELETE', path, json=params)
+
+    async def _request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                       json: Optional[Dict[str, Any]] = None) -> Any:
+        start = time.perf_counter()
+        await self.rate_limiter.acquire_async(request_priority(method, path, json))
+        queued = time.perf_counter()
+        if params:
+            # same encoding as requests: None values are dropped, everything else str()'d
+            query = urllib.parse.urlencode({k: v for k, v in params.items() if v is not None})
+            if query:
+                path += '?' + query
+        url = self._endpoint + path
+        body = json_dumps(json) if json is not None else b''
+
+        headers = self._sign_request(method, self._path_prefix + path, body)
+        if body:
+            headers['Content-Type'] = 'application/json'
+        signed = time.perf_counter()
+
+        # encoded=True sends the query exactly as signed, aiohttp would otherwise unquote %2F in market names
+        async with self._get_session().request(method, URL(url, encoded=True), data=body or None,
+                                               headers=headers) as response:
+            content = await response.read()
+        received = time.perf_counter()
+        try:
+            result = self._process_response(response, content)
+        finally:
+            done = time.perf_counter()
+            self.metrics.record_request(endpoint_name(method, path), {
+                'queue': queued - start, 'sign': signed - queued, 'network': received - signed,
+                'decode': done - received, 'total': done - start})
+        if self.recorder is not None:
+            self.recorder.record_response(method, path, result)
+        return result
+
+    def _sign_request(self, method: str, path_url: str, body: bytes) -> Dict[str, str]:
+        ts = int(time.time() * 1000)
+        signature = self._hmac.copy()
+        signature.update(f'{ts}{method}{path_url}'.encode() + body)
+        headers = {
+            'FTX-KEY': self._api_key,
+            'FTX-SIGN': signature.hexdigest(),
+            'FTX-TS': str(ts),
+        }
+        if self._subaccount_name:
+            headers['FTX-SUBACCOUNT'] = urllib.parse.quote(self._subaccount_name)
+        return headers
+
+    def _process_response(self, response: aiohttp.ClientResponse, content: bytes) -> Any:
+        try:
+            data = json_loads(content)
+        except ValueError:
+            response.raise_for_status()
+            raise
+        else:
+            if not data['success']:
+                raise Exception(data['error'])
+            return data['result']
+
+    async def get_future(self, future_name: str = None) -> dict:
+        return await self._get(f'futures/{future_name}')
+
+    async def get_all_futures(self) -> List[dict]:
+        return await self._get('futures')
+
+    async def get_order_status(self, order_id: str = None) -> List[dict]:
+        return await self._get(f'orders', {'order_id': order_id})
+
+    async def get_order(self, order_id: str) -> dict:
+        return await self._get(f'orders/{order_id}')
+
+    async def modify_order(
+        self, existing_order_id: Optional[str] = None,
+        existing_client_order_id: Optional[str] = None, price: Optional[float] = None,
+        size: Optional[float] = None, client_order_id: Optional[str] = None,
+    ) -> dict:
+        assert (existing_order_id is None) ^ (existing_client_order_id is None), \
+            'Must supply exactly one ID for the order to modify'
+        assert (price is None) or (
+            size is None), 'Must modify price or size of order'
+        path = f'orders/{existing_order_id}/modify' if existing_order_id is not None else \
+            f'orders/by_client_id/{existing_client_order_id}/modify'
+        return await self._post(path, {
+            **({'size': size} if size is not None else {}),
+            **({'price': price} if price is not None else {}),
+            ** ({'clientId': client_order_id} if client_order_id is not None else {}),
+        })
+
+    async def place_order(self, market: str, side: str, price: float, size: float, type: str = 'limit',
+                          reduce_only: bool = False, ioc: bool = False, post_only: bool = False,
+                          client_id: str = None, reject_after_ts: float = None) -> dict:
+        return await self._post('orders', {
+            'market': market,
+            'side': side,
+            'price': price,
+            'size': size,
+            'type': type,
+            'reduceOnly': reduce_only,
+            'ioc': ioc,
+            'postOnly': post_only,
+            'clientId': client_id,
+            'rejectAfterTs': reject_after_ts
+        })
+
+    async def cancel_order(self, order_id: str) -> dict:
+        return await self._delete(f'orders/{order_id}')
+
+    async def cancel_orders(self, market_name: str = None, conditional_orders: bool = False,
+                            limit_orders: bool = False) -> dict:
+        return await self._delete('orders', {'market': market_name,
+                                             **({'conditionalOrdersOnly': True} if conditional_orders else {}),
+                                             **({'limitOrdersOnly': True} if limit_orders else {})})
+
+    async def get_fills(self, market: str = None, start_time: float = None,
+                        end_time: float = None, min_id: int = None, order_id: int = None
+                        ) -> List[dict]:
+        return await self._get('fills', {
+            'market': market,
+            'start_time': start_time,
+            'end_time': end_time,
+            'minId': min_id,
+            'orderId': order_id
+        })
+
+    async def get_borrow_rates(self) -> List[dict]:
+        return await self._get('spot_margin/borrow_rates')
+
+    async def get_lending_rates(self) -> List[dict]:
+        return await self._get('spot_margin/lending_rates')
+
+    async def get_future_stats(self, future_name: str) -> dict:
+        return await self._get(f'futures/{future_name}/stats')
+
+    async def get_single_market(self, market: str = None) -> Dict:
+        return await self._get(f'markets/{market}')
+
+    async def get_positions(self, show_avg_price: bool = False) -> List[dict]:
+        return await self._get('positions', {'showAvgPrice': show_avg_price})
+
+    async def get_balances(self) -> List[dict]:
+        return await self._get('wallet/balances')
+
@@ -0,0 +1,659 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from fills import SIZE_TOLERANCE, FillTimeoutError, filled_size, read_fills_async, wait_for_fills_async
+from main import DeltaNeutralTrade, LegRejectedError
+
+
+class AsyncDeltaNeutralTrade(DeltaNeutralTrade):
+    """
+    asyncio version of DeltaNeutralTrade, takes an AsyncFtxClient.
+    Requests that don't depend on each other are sent at the same time, so the
+    funding check and both quotes before the opening orders cost about one round trip
+    """
+
+    async def trade(self) -> float:
+        """Entry point to start the delta neutral trade strategy
+
+        Returns:
+            float: PnL of executed trades
+        """
+        self.fill_wait_times = []
+        self.fill_timeouts = []
+        self.fill_ledger.clear_legs()
+
+        # funding check and opening quotes in a single round trip, timed together as the funding check
+        print("Checking spot vs perp funding")
+        with self.metrics.stage('funding_check'):
+            quotes = await self.pre_trade()
+        self._journal_start(market_orders=False)
+
+        print("Initiating opening trade")
+        await self.initiate_trade(is_opening_trade=True, quotes=quotes)
+
+        print("Starting to monitor for fills")
+        with self.metrics.stage('monitor'):
+            await self.order_status_monitor(is_opening_trade=True)
+
+        print("Executing remaining opening order")
+        with self.metrics.stage('hedge'):
+            await self.execute_leftover_order()
+
+        print("Waiting for fills")
+        await self.await_fills()
+
+        print("Updating fills")
+        with self.metrics.stage('fill_update'):
+            await self.update_fills(is_opening_trade=True)
+
+        print("Long Open Fill:")
+        print(self.long_open_fill)
+
+        print("Short Open Fill:")
+        print(self.short_open_fill)
+
+        print("Waiting for exit condition")
+        with self.metrics.stage('exit'):
+            await self.wait_for_exit_condition()
+
+        print("Initiating close trade")
+        await self.initiate_trade(is_opening_trade=False)
+        print("Starting to monitor for fills")
+        with self.metrics.stage('monitor'):
+            await self.order_status_monitor(is_opening_trade=False)
+        print("Executing remaining closing order")
+        with self.metrics.stage('hedge'):
+            await self.execute_leftover_order()
+
+        print("Waiting for fills")
+        await self.await_fills()
+
+        print("Updating closing fills")
+        with self.metrics.stage('fill_update'):
+            await self.update_fills(is_opening_trade=False)
+
+        print("Long Close Fill:")
+        print(self.long_close_fill)
+        print("Short Close Fill:")
+        print(self.short_close_fill)
+
+        self._report_fill_wait_saved()
+
+        print("Calculating trade pnl")
+        print(self.calc_trade_pnl())
+        self._journal('closed', pnl=self.calc_trade_pnl())
+        return self.calc_trade_pnl()
+
+    async def trade_market_orders(self) -> float:
+        self.fill_wait_times = []
+        self.fill_timeouts = []
+        self.fill_ledger.clear_legs()
+
+        print("Checking spot vs perp funding")
+        with self.metrics.stage('funding_check'):
+            self.long_spot = await self.check_spot_vs_perp()
+        self._journal_start(market_orders=True)
+
+        print("Initiating opening trade")
+        await self.initiate_trade_market_order(is_opening_trade=True)
+
+        print("Waiting for orders to fill")
+        await self.await_fills()
+
+        print("Updating fills")
+        with self.metrics.stage('fill_update'):
+            await self.update_fills(is_opening_trade=True)
+
+        print("Long Open Fill:")
+        print(self.long_open_fill)
+
+        print("Short Open Fill:")
+        print(self.short_open_fill)
+
+        print("Waiting for exit condition")
+        with self.metrics.stage('exit'):
+            await self.wait_for_exit_condition()
+
+        print("Initiating close trade")
+        await self.initiate_trade_market_order(is_opening_trade=False)
+
+        print("Waiting for fills")
+        await self.await_fills()
+
+        print("Updating closing fills")
+        with self.metrics.stage('fill_update'):
+            await self.update_fills(is_opening_trade=False)
+
+        print("Long Close Fill:")
+        print(self.long_close_fill)
+        print("Short Close Fill:")
+        print(self.short_close_fill)
+
+        self._report_fill_wait_saved()
+
+        print("Calculating trade pnl")
+        print(self.calc_trade_pnl())
+        self._journal('closed', pnl=self.calc_trade_pnl())
+
+        return self.calc_trade_pnl()
+
+    async def pre_trade(self) -> Tuple[tuple, tuple]:
+        """Fetch funding rates and both quotes concurrently and decide
+        the trade direction
+
+        Returns:
+            tuple containing the spot quote & perp quote
+        """
+        spot_borrow, spot_lend, perp_funding, spot_quote, perp_quote = await asyncio.gather(
+            self.get_spot_borrow_rate(),
+            self.get_spot_lending_rate(),
+            self.get_perp_funding_rate(),
+            self.get_spot_quote(),
+            self.get_perp_quote(),
+        )
+        self.long_spot = self._choose_long_spot(spot_borrow, spot_lend, perp_funding)
+        return (spot_quote, perp_quote)
+
+    async def initiate_trade(self, is_opening_trade, quotes: Optional[Tuple[tuple, tuple]] = None) -> None:
+        """Places maker post only orders for making a new trade
+        trade can be an opening trade or a closing trade
+
+        Args:
+            is_opening_trade (bool): true if opening trade, false if closing
+            quotes (tuple): spot & perp quotes from pre_trade, fetched here if not given
+        """
+        if quotes is None:
+            with self.metrics.stage('quote'):
+                quotes = await asyncio.gather(self.get_spot_quote(), self.get_perp_quote())
+        spot_quote, perp_quote = quotes
+
+        if self._select_markets(is_opening_trade):
+            long_quote, short_quote = spot_quote, perp_quote
+        else:
+            long_quote, short_quote = perp_quote, spot_quote
+        long_price = self._quoted_price(self.long_market, "buy", *long_quote)
+        short_price = self._quoted_price(self.short_market, "sell", *short_quote)
+
+        with self.metrics.stage('place'):
+            self.long_order, self.short_order = await self._place_order_pair(
+                {'market': self.long_market, 'side': "buy", 'price': long_price,
+                 'size': self.trade_size, 'type': 'limit', 'post_only': True},
+                {'market': self.short_market, 'side': "sell", 'price': short_price,
+                 'size': self.trade_size, 'type': 'limit', 'post_only': True})
+        self.maker_chains = [[(self.long_order['id'], 0.0)], [(self.short_order['id'], 0.0)]]
+        self.trade_orders = {self.long_order['id']: self.long_market, self.short_order['id']: self.short_market}
+        self._journal_placed(is_opening_trade)
+
+        print("Buy order placed")
+        print(self.long_order)
+        print("Sell order placed")
+        print(self.short_order)
+        print("Legs placed " + str(round(self.leg_timing['ack_gap'] * 1000, 3)) + "ms apart")
+
+    async def _maker_price(self, market: str, side: str) -> float:
+        bid, ask = await self._market_quote(market)
+        return self._quoted_price(market, side, bid, ask)
+
+    async def _requote_makers(self, is_opening_trade: bool) -> None:
+        """Amend any maker order the market has moved away from, both legs at once,
+        see DeltaNeutralTrade._requote_makers
+        """
+        legs = ((True, self.long_market, "buy"), (False, self.short_market, "sell"))
+        quotes = await asyncio.gather(*[self._market_quote(market) for _, market, _ in legs])
+        amends = []
+        for (long_leg, market, side), (bid, ask) in zip(legs, quotes):
+            order = self.long_order if long_leg else self.short_order
+            bid_size, ask_size = self._top_sizes(market)
+            price = self.quoter.requote(market, side, order['price'], bid, ask, bid_size, ask_size, self.trade_size)
+            if price is not None:
+                amends.append((long_leg, market, side, price, order))
+        results = await asyncio.gather(*[self.ftx_client.modify_order(existing_order_id=order['id'], price=price)
+                                         for _, _, _, price, order in amends], return_exceptions=True)
+        requoted = False
+        for (long_leg, market, side, price, _), order in zip(amends, results):
+            if isinstance(order, Exception):
+                # filled or closed while the amend was on the wire, the monitor picks that up
+                print("Requote failed: " + str(order))
+                continue
+            print(side + " order requoted to " + str(price))
+            self.trade_orders[order['id']] = market
+            self._extend_chain(self.maker_chains[0 if long_leg else 1], order)
+            if long_leg:
+                self.long_order = order
+            else:
+                self.short_order = order
+            requoted = True
+        if requoted:
+            self._journal_placed(is_opening_trade)
+
+    async def _replace_rejected_makers(self, is_opening_trade: bool, long_order_id: Any, short_order_id: Any) -> None:
+        """Quote and place again any leg that closed without filling anything,
+        see DeltaNeutralTrade._replace_rejected_makers
+        """
+        replaced = False
+        for long_leg, order_id, market, side in ((True, long_order_id, self.long_market, "buy"),
+                                                 (False, short_order_id, self.short_market, "sell")):
+            if (self.long_order if long_leg else self.short_order) is not None:
+                continue
+            if (await self.ftx_client.get_order(order_id))['filledSize'] > 0:
+                continue
+            order = await self.ftx_client.place_order(market, side, await self._maker_price(market, side),
+                                                      self.trade_size, 'limit', post_only=True)
+            print(side + " order closed unfilled, placed again")
+            self.trade_orders[order['id']] = market
+            self.maker_chains[0 if long_leg else 1] = [(order['id'], 0.0)]
+            if long_leg:
+                self.long_order = order
+            else:
+                self.short_order = order
+            replaced = True
+        if replaced:
+            self._journal_placed(is_opening_trade)
+
+    async def initiate_trade_market_order(self, is_opening_trade) -> None:
+        """Place opposite sided taker orders
+
+        Args:
+            is_opening_trade (bool): true if opening trade, false if closing
+        """
+        self._select_markets(is_opening_trade)
+
+        with self.metrics.stage('place'):
+            self.long_order, self.short_order = await self._place_order_pair(
+                {'market': self.long_market, 'side': "buy", 'price': None,
+                 'size': self.trade_size, 'type': 'market'},
+                {'market': self.short_market, 'side': "sell", 'price': None,
+                 'size': self.trade_size, 'type': 'market'})
+        self.pending_fills = {self.long_order['id']: (self.long_market, self.trade_size),
+                              self.short_order['id']: (self.short_market, self.trade_size)}
+        self.trade_orders = {self.long_order['id']: self.long_market, self.short_order['id']: self.short_market}
+        self._journal_placed(is_opening_trade)
+
+        print("Long order placed")
+        print(self.long_order)
+        print("Short order placed")
+        print(self.short_order)
+        print("Legs placed " + str(round(self.leg_timing['ack_gap'] * 1000, 3)) + "ms apart")
+
+    async def _place_order_pair(self, long_order_args: dict, short_order_args: dict) -> Tuple[dict, dict]:
+        """Send both legs at the same time on the shared session, see
+        DeltaNeutralTrade._place_order_pair
+
+        Raises:
+            LegRejectedError: either leg was rejected
+
+        Returns:
+            tuple containing the long & short orders
+        """
+        long_result, short_result = await asyncio.gather(self._timed_place_order(long_order_args),
+                                                         self._timed_place_order(short_order_args))
+        self._record_leg_timing(long_result, short_result)
+
+        (long_order, long_error), (short_order, short_error) = long_result[0], short_result[0]
+        if long_error is None and short_error is None:
+            return long_order, short_order
+
+        unwinds = []
+        if long_error is None:
+            unwinds.append(self._unwind_leg(long_order, long_order_args))
+        if short_error is None:
+            unwinds.append(self._unwind_leg(short_order, short_order_args))
+        await asyncio.gather(*unwinds)
+        raise LegRejectedError(f"Long leg: {long_error}, short leg: {short_error}")
+
+    async def _timed_place_order(self, order_args: dict) -> tuple:
+        sent_at = time.perf_counter()
+        try:
+            result = (await self.ftx_client.place_order(**order_args), None)
+        except Exception as error:
+            result = (None, error)
+        return result, sent_at, time.perf_counter()
+
+    async def _unwind_leg(self, order: dict, order_args: dict) -> None:
+        if order_args['type'] == 'market':
+            await self.ftx_client.place_order(
+                market=order_args['market'], side="sell" if order_args['side'] == "buy" else "buy",
+                price=None, size=order_args['size'], type='market')
+            print(order_args['side'] + " leg unwound")
+        else:
+            await self.ftx_client.cancel_order(order['id'])
+            print(order_args['side'] + " leg cancelled")
+
+    async def order_status_monitor(self, is_opening_trade) -> None:
+        """Function to monitor for fills on open maker orders, see
+        DeltaNeutralTrade.order_status_monitor
+
+        Args:
+            is_opening_trade (bool): true if opening trade, false if closing
+
+        Raises:
+            Exception: Timeout after order_timeout seconds with no complete fills
+        """
+        sleep_time = self.poll_interval
+
+        timeout = self.order_timeout
+
+        stream_generation = None
+        last_requote = time.monotonic()
+
+        while True:
+            stream = self.order_stream
+            polled = False
+            long_order_id, short_order_id = self.long_order['id'], self.short_order['id']
+            if stream is not None and stream.connected and stream.generation == stream_generation:
+                wait_start = time.monotonic()
+                await stream.tracker.wait_for_fill_async((self.long_order['id'], self.short_order['id']),
+                                                         min(1, timeout))
+                timeout -= time.monotonic() - wait_start
+                self.long_order = self._streamed_order(self.long_order)
+                self.short_order = self._streamed_order(self.short_order)
+            else:
+                stream_generation = stream.generation if stream is not None and stream.connected else None
+                polled = True
+
+                order_list = await self.ftx_client.get_order_status()
+                self.long_order = next((order for order in order_list if order['id'] == self.long_order['id']), None)
+                self.short_order = next((order for order in order_list if order['id'] == self.short_order['id']), None)
+                timeout -= sleep_time
+
+            if self.quoter is not None:
+                await self._replace_rejected_makers(is_opening_trade, long_order_id, short_order_id)
+
+            if self.long_order is None or self.short_order is None or self.long_order['remainingSize'] == 0 or self.short_order['remainingSize'] == 0:
+                print("At least one trade filled, stopping monitoring process")
+                break
+
+            if self.quoter is not None and time.monotonic() - last_requote >= self.quoter.requote_interval:
+                last_requote = time.monotonic()
+                await self._requote_makers(is_opening_trade)
+
+            if timeout <= 0:
+                await self._cancel_order_pair(self.long_order['id'], self.short_order['id'])
+                # a close that timed out leaves the position on, resume closes it again
+                self._journal('cancelled' if is_opening_trade else 'close_cancelled')
+                raise Exception("Timeout waiting for order execution")
+
+            if polled and stream_generation is None:
+                await asyncio.sleep(sleep_time)
+
+    async def _cancel_order_pair(self, long_order_id: Any, short_order_id: Any) -> None:
+        """Cancel both legs at once, a leg that can't be cancelled (e.g. it just filled)
+        doesn't stop the other, see DeltaNeutralTrade._cancel_order_pair
+        """
+        results = await asyncio.gather(*[self.ftx_client.cancel_order(order_id)
+                                         for order_id in (long_order_id, short_order_id)], return_exceptions=True)
+        for name, result in zip(("Long", "Short"), results):
+            if isinstance(result, Exception):
+                print(name + " order not cancelled: " + str(result))
+            else:
+                print(name + " order cancelled")
+
+    async def execute_leftover_order(self) -> None:
+        """Function to execute any leftover size after one of
+        our maker orders was filled. Cancels exsiting order
+        and places a market order for the remaining size,
+        or chases it with amends when hedge_mode is 'chase'
+        """
+        long_filled = self.long_order is None or self.long_order['remainingSize'] == 0
+        short_filled = self.short_order is None or self.short_order['remainingSize'] == 0
+        if long_filled and short_filled:
+            # both makers filled before either was pulled, there is no leftover
+            self._expect_maker_fills()
+            return
+
+        if self.hedge_mode == 'chase':
+            await self.chase_leftover_order()
+            return
+
+        hedge_start = self.clock()
+        #if short order has been filled, execute long order
+        if short_filled:
+            leftover = await self._cancel_leftover(self.long_order)
+            if leftover <= SIZE_TOLERANCE:
+                self._expect_maker_fills()
+                return
+            self.long_order = await self.ftx_client.place_order(self.long_market, "buy", None, leftover, 'market')
+            self._expect_leftover_fills(True, leftover)
+            self._record_hedge('market', 0, leftover, hedge_start)
+        else:
+            leftover = await self._cancel_leftover(self.short_order)
+            if leftover <= SIZE_TOLERANCE:
+                self._expect_maker_fills()
+                return
+            self.short_order = await self.ftx_client.place_order(self.short_market, "sell", None, leftover, 'market')
+            self._expect_leftover_fills(False, leftover)
+            self._record_hedge('market', 0, leftover, hedge_start)
+
+    async def _cancel_leftover(self, order: dict) -> float:
+        """Cancel the maker order that hasn't filled, see DeltaNeutralTrade._cancel_leftover
+        """
+        try:
+            await self.ftx_client.cancel_order(order['id'])
+        except Exception as error:
+            print("Cancel failed: " + str(error))
+            return (await self.ftx_client.get_order(order['id']))['remainingSize']
+        return order['remainingSize']
+
+    async def chase_leftover_order(self) -> None:
+        """Amend the leg whose maker order hasn't filled to the touch every time the book
+        moves and take what is left after chase_deadline, see DeltaNeutralTrade.chase_leftover_order
+        """
+        if self.short_order is None or self.short_order['remainingSize'] == 0:
+            long_leg, order, market, side = True, self.long_order, self.long_market, "buy"
+        else:
+            long_leg, order, market, side = False, self.short_order, self.short_market, "sell"
+
+        hedge_start = self.clock()
+        deadline = hedge_start + self.chase_deadline
+        chain = list(self.maker_chains[0 if long_leg else 1])
+        amends = 0
+        while True:
+            book_version = self.book_cache.version(market) if self.book_cache is not None else None
+            order = await self._chased_order_state(order, market, chain[-1][1])
+            leftover = max(order['remainingSize'], 0.0)
+            if leftover <= SIZE_TOLERANCE or order['status'] == 'closed':
+                break
+            if self.clock() >= deadline:
+                await self.ftx_client.cancel_order(order['id'])
+                break
+
+            touch = await self._touch(market, side)
+            if touch != order['price']:
+                try:
+                    order = await self.ftx_client.modify_order(existing_order_id=order['id'], price=touch)
+                except Exception as error:
+                    print("Amend failed: " + str(error))
+                else:
+                    self._extend_chain(chain, order)
+                    amends += 1
+
+            if book_version is not None:
+                # the book cache waits on a threading condition, off the event loop
+                await asyncio.to_thread(self.book_cache.wait_for_update, market, book_version, self.poll_interval)
+            else:
+                await asyncio.sleep(self.poll_interval)
+
+        hedge_order = None
+        if leftover > SIZE_TOLERANCE:
+            hedge_order = await self.ftx_client.place_order(market, side, None, leftover, 'market')
+        if long_leg:
+            self.long_order = hedge_order or order
+        else:
+            self.short_order = hedge_order or order
+        self._expect_chased_fills(long_leg, chain, leftover, hedge_order)
+        self._record_hedge('chase', amends, leftover, hedge_start)
+
+    async def _chased_order_state(self, order: dict, market: str, filled_before: float) -> dict:
+        """Latest state of the order being chased, see DeltaNeutralTrade._chased_order_state
+        """
+        if self.order_stream is not None and self.order_stream.connected:
+            # a polled feed only refreshes the orders it is told about, and every amend makes a new one
+            self.order_stream.tracker.watch([order['id']])
+            latest = self.order_stream.tracker.get_order(order['id'])
+            if latest is not None and latest['status'] != 'closed':
+                return latest
+            # not seen yet, or closed with sizes a poller can't know, the exchange has the rest
+        latest = next((open_order for open_order in await self.ftx_client.get_order_status()
+                       if open_order['id'] == order['id']), None)
+        if latest is not None:
+            return latest
+        filled = filled_before + filled_size(await read_fills_async(self.ftx_client, market, order['id'], order['size']))
+        return dict(order, status='closed', filledSize=filled, remainingSize=self.trade_size - filled)
+
+    async def _touch(self, market: str, side: str) -> float:
+        bid, ask = await self._market_quote(market)
+        return bid if side == "buy" else ask
+
+    async def _market_quote(self, market: str) -> tuple:
+        return await (self.get_spot_quote() if market == self.underlier + "/USD" else self.get_perp_quote())
+
+    async def await_fills(self) -> None:
+        """Wait for the fills of the orders just executed to be confirmed, see
+        DeltaNeutralTrade.await_fills
+        """
+        start = self.metrics.clock()
+        try:
+            waited = await wait_for_fills_async(self.ftx_client, self.pending_fills, self.fill_timeout,
+                                                order_stream=self.order_stream, fill_ledger=self.fill_ledger)
+        except FillTimeoutError as error:
+            self._record_fill_timeout(error, self.metrics.clock() - start)
+            return
+        self.confirmed_orders = set(self.pending_fills)
+        self._record_fill_wait(waited, self.metrics.clock() - start)
+
+    async def update_fills(self, is_opening_trade: bool) -> None:
+        """Update current state with trade fills, the fills of every order of this
+        open/close are fetched at once, see DeltaNeutralTrade.update_fills
+
+        Args:
+            is_opening_trade (bool): true if opening trade, false if closing trade
+        """
+        for order_id, market in self.trade_orders.items():
+            self.fill_ledger.assign(order_id, self._fill_leg(market, is_opening_trade))
+        fills = await asyncio.gather(*[read_fills_async(self.ftx_client, market, order_id, expected_size)
+                                       for order_id, market, expected_size in self._unconfirmed_orders()])
+        for order_fills in fills:
+            self.fill_ledger.add_all(order_fills)
+        self.confirmed_orders = set()
+        self._read_leg_fills(is_opening_trade)
+        self._journal_fills(is_opening_trade)
+
+    async def resume(self, state: Dict) -> Optional[float]:
+        """Carry on with a journaled trade another process didn't finish, see
+        DeltaNeutralTrade.resume
+
+        Args:
+            state (dict): journaled state of the trade
+
+        Returns:
+            float: PnL of the trade, None if it was abandoned before any orders went out
+        """
+        self.trade_id = state['trade_id']
+        self.long_spot = state['long_spot']
+        self.fill_wait_times = []
+        self.fill_timeouts = []
+        self.fill_ledger.clear_legs()
+        for leg, fill in state['fills'].items():
+            setattr(self, leg + '_fill', fill)
+        market_orders = state['market_orders']
+        opening = state['stage'] == 'open'
+        print("Resuming trade " + self.trade_id + " at " + state['stage'] + " " + state['step'])
+
+        if state['step'] == 'started':
+            print("No orders were placed, abandoning trade")
+            self._journal('abandoned')
+            return None
+
+        if state['step'] not in ('filled', 'close_cancelled'):
+            self._select_markets(opening)
+            # the monitor polls for the orders' current state before it looks at anything else
+            self.long_order, self.short_order = {'id': state['long_order']}, {'id': state['short_order']}
+            self.maker_chains = self._journaled_maker_chains(state)
+            self.trade_orders = dict(state['trade_orders'])
+            self.pending_fills = dict(state['pending_fills'])
+            await self._finish_orders(opening, market_orders, state['step'])
+
+        if opening or state['step'] == 'close_cancelled':
+            if opening:
+                print("Waiting for exit condition")
+                with self.metrics.stage('exit'):
+                    await self.wait_for_exit_condition()
+            print("Initiating close trade")
+            if market_orders:
+                await self.initiate_trade_market_order(is_opening_trade=False)
+            else:
+                await self.initiate_trade(is_opening_trade=False)
+            await self._finish_orders(False, market_orders, 'placed')
+
+        print("Calculating trade pnl")
+        pnl = self.calc_trade_pnl()
+        print(pnl)
+        self._journal('closed', pnl=pnl)
+        return pnl
+
+    async def _finish_orders(self, is_opening_trade: bool, market_orders: bool, step: str) -> None:
+        """Remaining steps of an open or close from the journaled step on
+        """
+        if step == 'placed' and not market_orders:
+            print("Starting to monitor for fills")
+            with self.metrics.stage('monitor'):
+                await self.order_status_monitor(is_opening_trade)
+            print("Executing remaining order")
+            with self.metrics.stage('hedge'):
+                await self.execute_leftover_order()
+        print("Waiting for fills")
+        await self.await_fills()
+        print("Updating fills")
+        with self.metrics.stage('fill_update'):
+            await self.update_fills(is_opening_trade)
+
+    async def wait_for_exit_condition(self) -> None:
+        """Same exit condition as DeltaNeutralTrade, without blocking the event loop
+        """
+        await asyncio.sleep(10)
+
+    async def check_spot_vs_perp(self) -> bool:
+        """Function to check perp funding rates vs spot market borrow/lend rates,
+        all three rates are fetched concurrently
+
+        Returns:
+            bool: true if long spot, false if short spot
+        """
+        spot_borrow, spot_lend, perp_funding = await asyncio.gather(
+            self.get_spot_borrow_rate(),
+            self.get_spot_lending_rate(),
+            self.get_perp_funding_rate(),
+        )
+        return self._choose_long_spot(spot_borrow, spot_lend, perp_funding)
+
+    async def get_spot_borrow_rate(self) -> float:
+        if self.rate_store is not None:
+            return await self.rate_store.borrow_rate_async(self.underlier)
+        borrow_list = await self.ftx_client.get_borrow_rates()
+        borrow_dict = {x['coin']: [x['previous'], x['estimate']] for x in borrow_list}
+        return borrow_dict[self.underlier][1]
+
+    async def get_spot_lending_rate(self) -> float:
+        if self.rate_store is not None:
+            return await self.rate_store.lending_rate_async(self.underlier)
+        lending_list = await self.ftx_client.get_lending_rates()
+        lending_dict = {x['coin']: [x['previous'], x['estimate']] for x in lending_list}
+        return lending_dict[self.underlier][1]
+
+    async def get_perp_funding_rate(self) -> float:
+        return (await self.ftx_client.get_future_stats(self.underlier + "-PERP"))['nextFundingRate']
+
+    async def get_spot_quote(self):
+        cached_quote = self._cached_quote(self.underlier + "/USD")
+        if cached_quote is not None:
+            return cached_quote
+        spot_market = await self.ftx_client.get_single_market(self.underlier + "/USD")
+        return (spot_market['bid'], spot_market['ask'])
+
+    async def get_perp_quote(self):
+        cached_quote = self._cached_quote(self.underlier + "-PERP")
+        if cached_quote is not None:
+            return cached_quote
+        perp_market = await self.ftx_client.get_future(self.underlier + "-PERP")
+        return (perp_market['bid'], perp_market['ask'])
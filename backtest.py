@@ -0,0 +1,557 @@
+import contextlib
+import csv
+import itertools
+import math
+import os
+import random
+import threading
+import time
+from typing import Optional, Dict, Iterable, Iterator, List, Tuple
+
+from fills import FillLedger
+from main import DeltaNeutralTrade
+from metrics import Metrics
+
+# events are tuples sorted by time:
+#   (time, market, 'quote', bid, bid_size, ask, ask_size)
+#   (time, market, 'trade', aggressor side, price, size, None)
+Event = Tuple[float, str, str, object, float, Optional[float], Optional[float]]
+
+PRICE_TOLERANCE = 1e-9
+
+
+class ReplayFinished(Exception):
+    """
+    Raised from the replay clock once the recorded events run out, ends the backtest
+    """
+
+
+def read_events(path: str) -> Iterator[Event]:
+    """Stream events from a csv file, one event per row:
+    time,market,quote,bid,bid_size,ask,ask_size or time,market,trade,side,price,size
+
+    Args:
+        path (str): csv file sorted by time, rows starting with # are skipped
+
+    Returns:
+        iterator of events
+    """
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#'):
+                continue
+            if row[2] == 'quote':
+                yield (float(row[0]), row[1], 'quote', float(row[3]), float(row[4]), float(row[5]), float(row[6]))
+            else:
+                yield (float(row[0]), row[1], 'trade', row[3], float(row[4]), float(row[5]), None)
+
+
+def synthetic_events(underlier: str = 'ETH', seconds: float = 3600, price: float = 1078.4, tick: float = .1,
+                     basis: float = .3, quote_interval: float = .1, trade_rate: float = 5,
+                     volatility: float = .0002, seed: Optional[int] = None) -> Iterator[Event]:
+    """Random walk quotes and trades for an underlier's spot market and perp,
+    for trying out the backtester without recorded data
+
+    Args:
+        underlier (str): coin name, e.g. 'ETH'
+        seconds (float): length of the replay
+        price (float): starting spot bid
+        tick (float): price increment of both markets
+        basis (float): perp price over spot
+        quote_interval (float): seconds between quote updates of a market
+        trade_rate (float): mean trades per second per market
+        volatility (float): standard deviation of the relative price move per quote update
+        seed (int): random seed, for repeatable replays
+
+    Returns:
+        iterator of events
+    """
+    rng = random.Random(seed)
+    markets = (underlier + '/USD', underlier + '-PERP')
+    t = 0.0
+    while t < seconds:
+        price *= 1 + rng.gauss(0, volatility)
+        interval = []
+        for market, offset in zip(markets, (0, basis)):
+            bid = round((price + offset) / tick) * tick
+            spread = tick * rng.choice((1, 1, 1, 2, 3))
+            interval.append((t, market, 'quote', bid, rng.uniform(1, 50), bid + spread, rng.uniform(1, 50)))
+            for _ in range(_poisson(rng, trade_rate * quote_interval)):
+                side = rng.choice(('buy', 'sell'))
+                # mostly at the touch, sometimes through it
+                through = tick * rng.choice((0, 0, 0, 1, 2))
+                trade_price = bid + spread + through if side == 'buy' else bid - through
+                interval.append((t + rng.uniform(0, quote_interval), market, 'trade', side, trade_price,
+                                 rng.expovariate(1 / 5), None))
+        yield from sorted(interval, key=lambda event: event[0])
+        t += quote_interval
+
+
+def _poisson(rng: random.Random, mean: float) -> int:
+    count, threshold, product = 0, math.exp(-mean), rng.random()
+    while product > threshold:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def _same_price(a: float, b: float) -> bool:
+    return abs(a - b) <= PRICE_TOLERANCE * max(1.0, abs(a))
+
+
+class ReplayExchange:
+    """
+    In-process simulated exchange with the FtxClient method surface, driven by
+    recorded quotes and trades on a virtual clock. Every request costs a round
+    trip of virtual time and the clock only moves forward through the events
+    when the strategy sleeps, so a replay runs as fast as the strategy can execute.
+
+    Post only orders fill by queue position: an order joining the best level
+    queues behind the size shown there, an order behind the best level finds
+    out its place once the level becomes the best. Trades at the order's price
+    eat through the queue ahead of it first, trades through the price or the
+    other side of the book crossing it fill it completely. Market orders take
+    the touch
+    """
+
+    def __init__(self, events: Iterable[Event], rtt: float = .05, maker_fee: float = .0002,
+                 taker_fee: float = .0007, tick_sizes: Optional[Dict[str, float]] = None,
+                 borrow_rates: Optional[Dict[str, float]] = None, lending_rates: Optional[Dict[str, float]] = None,
+                 funding_rates: Optional[Dict[str, float]] = None) -> None:
+        """Initialize the replay exchange, the events up to the first timestamp are applied straight away
+
+        Args:
+            events (iterable): events sorted by time, e.g. from read_events
+            rtt (float): virtual seconds every request takes, half before and half after it reaches the exchange
+            maker_fee (float): fee rate charged on resting order fills
+            taker_fee (float): fee rate charged on market order fills
+            tick_sizes (dict): market -> price increment limit prices are rounded to (passively)
+            borrow_rates (dict): coin -> spot borrow rate
+            lending_rates (dict): coin -> spot lending rate
+            funding_rates (dict): perp name -> next funding rate
+        """
+        self.rtt = rtt
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.tick_sizes = tick_sizes or {}
+        self.borrow_rates = borrow_rates or {}
+        self.lending_rates = lending_rates or {}
+        self.funding_rates = funding_rates or {}
+
+        self.quotes = {}
+        self.orders = {}
+        self.fills = []
+        self.positions = {}
+        self.events_replayed = 0
+
+        # market -> ids of resting orders, order id -> size queued ahead of it (None while behind the best level)
+        self._resting = {}
+        self._queue_ahead = {}
+        self._fills_by_order = {}
+        self._next_order_id = itertools.count(1)
+        self._next_fill_id = itertools.count(1)
+        # both legs of a pair are placed from threads
+        self._lock = threading.RLock()
+
+        self._events = iter(events)
+        self._next_event = next(self._events, None)
+        if self._next_event is None:
+            raise ReplayFinished("No events to replay")
+        self.now = self._next_event[0]
+        self._advance(self.now)
+
+    def clock(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        with self._lock:
+            self._advance(self.now + seconds)
+
+    def _advance(self, until: float) -> None:
+        """Apply every event up to the given time and move the clock there
+
+        Raises:
+            ReplayFinished: no events left
+        """
+        while True:
+            event = self._next_event
+            if event is None:
+                raise ReplayFinished(f"Replay finished after {self.events_replayed} events")
+            if event[0] > until:
+                break
+            self.now = event[0]
+            if event[2] == 'quote':
+                self._on_quote(*event)
+            else:
+                self._on_trade(*event)
+            self.events_replayed += 1
+            self._next_event = next(self._events, None)
+        self.now = until
+
+    def _round_trip(self, action, *args):
+        with self._lock:
+            self._advance(self.now + self.rtt / 2)
+            result = action(*args)
+            self._advance(self.now + self.rtt / 2)
+            return result
+
+    def _on_quote(self, t: float, market: str, kind: str, bid: float, bid_size: float, ask: float,
+                  ask_size: float) -> None:
+        quote = self.quotes.get(market)
+        if quote is None:
+            quote = self.quotes[market] = {'name': market}
+        quote['bid'], quote['bidSize'], quote['ask'], quote['askSize'] = bid, bid_size, ask, ask_size
+
+        for order_id in list(self._resting.get(market, ())):
+            order = self.orders[order_id]
+            if order['side'] == 'buy':
+                if order['price'] >= ask - PRICE_TOLERANCE:
+                    self._fill(order, order['remainingSize'], order['price'], self.maker_fee)
+                else:
+                    self._update_queue(order_id, order['price'], bid, bid_size, order['price'] > bid)
+            else:
+                if order['price'] <= bid + PRICE_TOLERANCE:
+                    self._fill(order, order['remainingSize'], order['price'], self.maker_fee)
+                else:
+                    self._update_queue(order_id, order['price'], ask, ask_size, order['price'] < ask)
+
+    def _update_queue(self, order_id: int, price: float, best: float, best_size: float, improves: bool) -> None:
+        if improves:
+            self._queue_ahead[order_id] = 0.0
+        elif _same_price(price, best):
+            # cancels ahead of us can only shrink the queue, joins go behind us
+            queued = self._queue_ahead[order_id]
+            self._queue_ahead[order_id] = best_size if queued is None else min(queued, best_size)
+
+    def _on_trade(self, t: float, market: str, kind: str, side: str, price: float, size: float,
+                  unused: None) -> None:
+        for order_id in list(self._resting.get(market, ())):
+            order = self.orders[order_id]
+            # buy aggressors trade against resting sells and the other way round
+            if order['side'] == side:
+                continue
+            through = price < order['price'] if side == 'sell' else price > order['price']
+            if through and not _same_price(price, order['price']):
+                self._fill(order, order['remainingSize'], order['price'], self.maker_fee)
+            elif _same_price(price, order['price']) and self._queue_ahead[order_id] is not None:
+                queued = self._queue_ahead[order_id]
+                self._queue_ahead[order_id] = max(0.0, queued - size)
+                if size > queued:
+                    self._fill(order, min(size - queued, order['remainingSize']), order['price'], self.maker_fee)
+
+    def _fill(self, order: Dict, size: float, price: float, fee_rate: float) -> None:
+        order['avgFillPrice'] = ((order['avgFillPrice'] or 0) * order['filledSize'] + price * size) / \
+            (order['filledSize'] + size)
+        order['filledSize'] += size
+        order['remainingSize'] = order['size'] - order['filledSize']
+        if order['remainingSize'] <= PRICE_TOLERANCE:
+            order['remainingSize'] = 0
+            self._close(order)
+
+        fill = {
+            'id': next(self._next_fill_id),
+            'orderId': order['id'],
+            'market': order['market'],
+            'side': order['side'],
+            'price': price,
+            'size': size,
+            'fee': size * price * fee_rate,
+            'liquidity': 'taker' if order['type'] == 'market' else 'maker',
+            'time': self.now,
+        }
+        self.fills.append(fill)
+        self._fills_by_order.setdefault(order['id'], []).append(fill)
+        self.positions[order['market']] = self.positions.get(order['market'], 0.0) + \
+            (size if order['side'] == 'buy' else -size)
+
+    def _close(self, order: Dict) -> None:
+        order['status'] = 'closed'
+        resting = self._resting.get(order['market'])
+        if resting is not None and order['id'] in resting:
+            resting.remove(order['id'])
+            del self._queue_ahead[order['id']]
+
+    def _quote(self, market: str) -> Dict:
+        quote = self.quotes.get(market)
+        if quote is None:
+            raise Exception(f"No quote for market {market}")
+        return quote
+
+    def _round_price(self, market: str, side: str, price: float) -> float:
+        tick = self.tick_sizes.get(market)
+        if tick is None:
+            return price
+        ticks = price / tick
+        return (math.floor(ticks + PRICE_TOLERANCE) if side == 'buy' else math.ceil(ticks - PRICE_TOLERANCE)) * tick
+
+    def _place(self, market: str, side: str, price: Optional[float], size: float, type: str,
+               post_only: bool, client_id: Optional[str]) -> Dict:
+        quote = self._quote(market)
+        order = {
+            'id': next(self._next_order_id),
+            'market': market,
+            'side': side,
+            'price': None if type == 'market' else self._round_price(market, side, price),
+            'size': size,
+            'type': type,
+            'postOnly': post_only,
+            'clientId': client_id,
+            'status': 'open',
+            'filledSize': 0,
+            'remainingSize': size,
+            'avgFillPrice': None,
+            'createdAt': self.now,
+        }
+        self.orders[order['id']] = order
+
+        if type == 'market':
+            self._fill(order, size, quote['ask'] if side == 'buy' else quote['bid'], self.taker_fee)
+            return dict(order)
+
+        crosses = order['price'] >= quote['ask'] - PRICE_TOLERANCE if side == 'buy' else \
+            order['price'] <= quote['bid'] + PRICE_TOLERANCE
+        if crosses:
+            if post_only:
+                # post only orders that would take are cancelled instead
+                order['status'] = 'closed'
+            else:
+                self._fill(order, size, quote['ask'] if side == 'buy' else quote['bid'], self.taker_fee)
+            return dict(order)
+
+        self._rest(order)
+        return dict(order)
+
+    def _rest(self, order: Dict) -> None:
+        quote = self.quotes[order['market']]
+        self._resting.setdefault(order['market'], []).append(order['id'])
+        self._queue_ahead[order['id']] = None
+        if order['side'] == 'buy':
+            self._update_queue(order['id'], order['price'], quote['bid'], quote['bidSize'], order['price'] > quote['bid'])
+        else:
+            self._update_queue(order['id'], order['price'], quote['ask'], quote['askSize'], order['price'] < quote['ask'])
+
+    def _cancel(self, order_id: int) -> str:
+        order = self.orders.get(int(order_id))
+        if order is None or order['status'] == 'closed':
+            raise Exception("Order already closed")
+        self._close(order)
+        return 'Order queued for cancellation'
+
+    def _modify(self, order_id: int, price: Optional[float], size: Optional[float]) -> Dict:
+        order = self.orders.get(int(order_id))
+        if order is None or order['status'] == 'closed':
+            raise Exception("Order already closed")
+        self._close(order)
+        new_order = dict(order, id=next(self._next_order_id), status='open',
+                         price=order['price'] if price is None else self._round_price(order['market'], order['side'], price),
+                         size=order['size'] if size is None else size)
+        new_order['remainingSize'] = new_order['size'] - new_order['filledSize']
+        self.orders[new_order['id']] = new_order
+        # a modified order goes to the back of the queue
+        self._rest(new_order)
+        return dict(new_order)
+
+    def _cancel_all(self, market: Optional[str]) -> str:
+        for resting_market, resting in list(self._resting.items()):
+            if market in (None, resting_market):
+                for order_id in list(resting):
+                    self._close(self.orders[order_id])
+        return 'Orders queued for cancellation'
+
+    def _open_orders(self) -> List[Dict]:
+        return [dict(self.orders[order_id]) for resting in self._resting.values() for order_id in resting]
+
+    def _order_fills(self, market: Optional[str], order_id: Optional[int]) -> List[Dict]:
+        fills = self._fills_by_order.get(int(order_id), []) if order_id is not None else self.fills
+        return [fill for fill in reversed(fills) if market in (None, fill['market'])]
+
+    # FtxClient methods
+
+    def get_future(self, future_name: str = None) -> dict:
+        return self._round_trip(lambda: dict(self._quote(future_name)))
+
+    def get_all_futures(self) -> List[dict]:
+        return self._round_trip(lambda: [dict(quote) for market, quote in self.quotes.items() if '-' in market])
+
+    def get_single_market(self, market: str = None) -> Dict:
+        return self._round_trip(lambda: dict(self._quote(market)))
+
+    def get_order_status(self, order_id: str = None) -> List[dict]:
+        return self._round_trip(self._open_orders)
+
+    def get_order(self, order_id: str) -> dict:
+        return self._round_trip(lambda: dict(self.orders[int(order_id)]))
+
+    def place_order(self, market: str, side: str, price: float, size: float, type: str = 'limit',
+                    reduce_only: bool = False, ioc: bool = False, post_only: bool = False,
+                    client_id: str = None, reject_after_ts: float = None) -> dict:
+        return self._round_trip(self._place, market, side, price, size, type, post_only, client_id)
+
+    def modify_order(self, existing_order_id: Optional[str] = None, existing_client_order_id: Optional[str] = None,
+                     price: Optional[float] = None, size: Optional[float] = None,
+                     client_order_id: Optional[str] = None) -> dict:
+        return self._round_trip(self._modify, existing_order_id, price, size)
+
+    def cancel_order(self, order_id: str) -> dict:
+        return self._round_trip(self._cancel, order_id)
+
+    def cancel_orders(self, market_name: str = None, conditional_orders: bool = False,
+                      limit_orders: bool = False) -> dict:
+        return self._round_trip(self._cancel_all, market_name)
+
+    def get_fills(self, market: str = None, start_time: float = None, end_time: float = None,
+                  min_id: int = None, order_id: int = None) -> List[dict]:
+        return self._round_trip(self._order_fills, market, order_id)
+
+    def get_borrow_rates(self) -> List[dict]:
+        return self._round_trip(lambda: [{'coin': coin, 'previous': rate, 'estimate': rate}
+                                         for coin, rate in self.borrow_rates.items()])
+
+    def get_lending_rates(self) -> List[dict]:
+        return self._round_trip(lambda: [{'coin': coin, 'previous': rate, 'estimate': rate}
+                                         for coin, rate in self.lending_rates.items()])
+
+    def get_future_stats(self, future_name: str) -> dict:
+        return self._round_trip(lambda: {'nextFundingRate': self.funding_rates.get(future_name, 0.0)})
+
+    def get_positions(self, show_avg_price: bool = False) -> List[dict]:
+        return self._round_trip(lambda: [{'future': market, 'netSize': size, 'size': abs(size),
+                                          'side': 'buy' if size >= 0 else 'sell'}
+                                         for market, size in self.positions.items() if '-' in market])
+
+    def get_balances(self) -> List[dict]:
+        return self._round_trip(lambda: [{'coin': market.split('/')[0], 'total': size}
+                                         for market, size in self.positions.items() if '/' in market])
+
+
+class Backtest:
+    """
+    Runs the strategy round trip after round trip (open, hold, close) over
+    recorded events on a ReplayExchange until the events run out
+    """
+
+    def __init__(self, events: Iterable[Event], underlier: str = 'ETH', trade_size: float = .01,
+                 market_orders: bool = False, rtt: float = .05, maker_fee: float = .0002, taker_fee: float = .0007,
+                 tick_size: Optional[float] = None, borrow_rate: float = .001, lending_rate: float = .002,
+                 funding_rate: float = .003, trade_class: type = DeltaNeutralTrade,
+                 trade_kwargs: Optional[Dict] = None) -> None:
+        """Initialize backtest
+
+        Args:
+            events (iterable): events sorted by time covering the underlier's spot market and perp
+            underlier (str): underlier to trade
+            trade_size (float): size of every round trip
+            market_orders (bool): run trade_market_orders instead of the maker-then-hedge trade
+            rtt (float): virtual seconds every request takes
+            maker_fee (float): fee rate on resting order fills
+            taker_fee (float): fee rate on market order fills
+            tick_size (float): price increment of both markets, limit prices aren't rounded without one
+            borrow_rate (float): spot borrow rate
+            lending_rate (float): spot lending rate
+            funding_rate (float): perp funding rate
+            trade_class (type): DeltaNeutralTrade or a subclass of it
+            trade_kwargs (dict): further trade_class arguments, e.g. quote_offset or order_timeout
+        """
+        markets = (underlier + '/USD', underlier + '-PERP')
+        self.exchange = ReplayExchange(
+            events, rtt=rtt, maker_fee=maker_fee, taker_fee=taker_fee,
+            tick_sizes={market: tick_size for market in markets} if tick_size else None,
+            borrow_rates={underlier: borrow_rate}, lending_rates={underlier: lending_rate},
+            funding_rates={underlier + '-PERP': funding_rate})
+        # stages are timed on the virtual clock
+        self.metrics = Metrics(clock=self.exchange.clock)
+        self.trade = trade_class(underlier, self.exchange, trade_size, clock=self.exchange.clock,
+                                 sleep=self.exchange.sleep, metrics=self.metrics, **(trade_kwargs or {}))
+        if getattr(self.trade, 'quoter', None) is not None:
+            # volatility is measured on the virtual clock too
+            self.trade.quoter.clock = self.exchange.clock
+        self.market_orders = market_orders
+        self.round_trips = []
+
+    def run(self, max_round_trips: Optional[int] = None) -> Dict:
+        """Replay until the events run out (the round trip in progress then is dropped)
+        or max_round_trips have been made. Strategy output is discarded
+
+        Returns:
+            dict: summary, see summary()
+        """
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            try:
+                while max_round_trips is None or len(self.round_trips) < max_round_trips:
+                    self._round_trip()
+            except ReplayFinished:
+                pass
+            finally:
+                self.trade._leg_executor.shutdown()
+        self.wall_seconds = time.perf_counter() - start
+        return self.summary()
+
+    def _round_trip(self) -> None:
+        self.trade.fill_ledger = FillLedger()
+        started = self.exchange.now
+        first_fill = len(self.exchange.fills)
+        monitored = self._monitor_seconds()
+        try:
+            pnl = self.trade.trade_market_orders() if self.market_orders else self.trade.trade()
+            error = None
+        except ReplayFinished:
+            raise
+        except Exception as exc:
+            pnl, error = None, str(exc)
+        self.round_trips.append({
+            'start': started,
+            'end': self.exchange.now,
+            'pnl': pnl,
+            'error': error,
+            'fees': sum(fill['fee'] for fill in self.exchange.fills[first_fill:]),
+            # virtual seconds waiting for a maker order to fill, opening and closing together
+            'monitor_seconds': self._monitor_seconds() - monitored,
+        })
+
+    def _monitor_seconds(self) -> float:
+        histogram = self.metrics.stage_histogram('monitor')
+        return histogram.total if histogram is not None else 0.0
+
+    def summary(self) -> Dict:
+        """Round trips made, their PnL and how fast the replay ran
+
+        Returns:
+            dict: round_trips, completed, failed, total_pnl, mean_pnl, fees, virtual_seconds,
+                wall_seconds, round_trips_per_second and events_per_second
+        """
+        completed = [round_trip for round_trip in self.round_trips if round_trip['error'] is None]
+        wall_seconds = getattr(self, 'wall_seconds', 0.0)
+        total_pnl = sum(round_trip['pnl'] for round_trip in completed)
+        return {
+            'round_trips': len(self.round_trips),
+            'completed': len(completed),
+            'failed': len(self.round_trips) - len(completed),
+            'total_pnl': total_pnl,
+            'mean_pnl': total_pnl / len(completed) if completed else None,
+            'fees': sum(fill['fee'] for fill in self.exchange.fills),
+            'virtual_seconds': self.round_trips[-1]['end'] - self.round_trips[0]['start'] if self.round_trips else 0.0,
+            'wall_seconds': wall_seconds,
+            'round_trips_per_second': len(self.round_trips) / wall_seconds if wall_seconds else None,
+            'events_per_second': self.exchange.events_replayed / wall_seconds if wall_seconds else None,
+        }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay recorded quotes & trades through the strategy")
+    parser.add_argument('events', nargs='?', help='csv of events, synthetic events are generated without one')
+    parser.add_argument('--underlier', default='ETH')
+    parser.add_argument('--size', type=float, default=.01)
+    parser.add_argument('--market-orders', action='store_true')
+    parser.add_argument('--rtt', type=float, default=.05)
+    parser.add_argument('--hours', type=float, default=24, help='length of the synthetic replay')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    events = read_events(args.events) if args.events else \
+        synthetic_events(args.underlier, seconds=args.hours * 3600, seed=args.seed)
+    backtest = Backtest(events, args.underlier, args.size, market_orders=args.market_orders, rtt=args.rtt)
+    for key, value in backtest.run().items():
+        print(key + ": " + str(value))
@@ -0,0 +1,147 @@
+"""
+Runs the same engine operations through every exchange adapter against its
+local stand-in (AsyncFtxClient on LocalFtxExchange, AsyncBybitClient on
+LocalBybitExchange) with the same round trip time, and reports the median time
+of each in milliseconds and in round trips. Every operation has one round trip
+budget for all adapters, exits 1 if an adapter's median goes over one
+
+    python benchmarks/adapter_latency.py --runs 10 --rtt .05
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_client import AsyncFtxClient  # noqa: E402
+from async_trade import AsyncDeltaNeutralTrade  # noqa: E402
+from bybit_client import AsyncBybitClient  # noqa: E402
+from flatten import flatten_async  # noqa: E402
+from local_bybit import LocalBybitExchange  # noqa: E402
+from local_exchange import LocalFtxExchange  # noqa: E402
+
+ADAPTERS = {
+    'ftx': (LocalFtxExchange, AsyncFtxClient),
+    'bybit': (LocalBybitExchange, AsyncBybitClient),
+}
+
+
+class NoWaitExitTrade(AsyncDeltaNeutralTrade):
+    async def wait_for_exit_condition(self) -> None:
+        pass
+
+
+async def pre_trade(client, state: Dict) -> None:
+    await AsyncDeltaNeutralTrade("ETH", client, state['size']).pre_trade()
+
+
+async def place_pair(client, state: Dict) -> None:
+    state['orders'] = await asyncio.gather(
+        client.place_order("ETH/USD", "buy", 1000, state['size'], post_only=True),
+        client.place_order("ETH-PERP", "sell", 1200, state['size'], post_only=True))
+
+
+async def amend_pair(client, state: Dict) -> None:
+    spot_order, perp_order = state['orders']
+    state['orders'] = await asyncio.gather(client.modify_order(existing_order_id=spot_order['id'], price=1001),
+                                           client.modify_order(existing_order_id=perp_order['id'], price=1199))
+
+
+async def cancel_pair(client, state: Dict) -> None:
+    await asyncio.gather(*[client.cancel_order(order['id']) for order in state['orders']])
+
+
+async def market_pair(client, state: Dict) -> None:
+    state['orders'] = await asyncio.gather(client.place_order("ETH/USD", "buy", None, state['size'], 'market'),
+                                           client.place_order("ETH-PERP", "sell", None, state['size'], 'market'))
+
+
+async def read_fills(client, state: Dict) -> None:
+    await asyncio.gather(*[client.get_fills(order['market'], order_id=order['id']) for order in state['orders']])
+
+
+async def flatten(client, state: Dict) -> None:
+    await flatten_async(client)
+
+
+async def market_trade(client, state: Dict) -> None:
+    await NoWaitExitTrade("ETH", client, state['size']).trade_market_orders()
+
+
+# name, coroutine, round trip budget. Amends can be a cancel and a new order (bybit spot) and spot market
+# orders can need the touch first (bybit again), the budgets allow for both. Flatten reads positions only
+# once its cancel is back
+OPERATIONS: List[tuple] = [
+    ('pre_trade', pre_trade, 1),
+    ('place pair', place_pair, 1),
+    ('amend pair', amend_pair, 2),
+    ('cancel pair', cancel_pair, 1),
+    ('market pair', market_pair, 2),
+    ('read fills', read_fills, 1),
+    ('flatten', flatten, 4),
+    ('market trade', market_trade, 9),
+]
+
+
+async def run_adapter(exchange_type: type, client_type: Callable, runs: int, rtt: float, size: float) -> Dict:
+    """Seconds each operation took on every run, the first (warm up) run dropped
+    """
+    times = {name: [] for name, _, _ in OPERATIONS}
+    with exchange_type(latency=rtt) as exchange:
+        async with client_type(api_key=exchange.api_key, api_secret=exchange.api_secret,
+                               endpoint=exchange.url) as client:
+            for run in range(runs + 1):
+                state = {'size': size}
+                for name, operation, _ in OPERATIONS:
+                    start = time.perf_counter()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        await operation(client, state)
+                    if run:
+                        times[name].append(time.perf_counter() - start)
+    return times
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--rtt', type=float, default=.05, help='round trip time in seconds')
+    parser.add_argument('--size', type=float, default=.01)
+    parser.add_argument('--slack', type=float, default=.5,
+                        help='round trips of client and stand-in overhead allowed over a budget')
+    parser.add_argument('--output', help='write results json here')
+    args = parser.parse_args()
+
+    results = {name: asyncio.run(run_adapter(exchange_type, client_type, args.runs, args.rtt, args.size))
+               for name, (exchange_type, client_type) in ADAPTERS.items()}
+
+    print(f"{'operation':<14}{'budget':>8}" + ''.join(f"{name + ' ms':>12}{name + ' rtts':>12}" for name in ADAPTERS))
+    over = []
+    for name, _, budget in OPERATIONS:
+        row = f"{name:<14}{budget:>8}"
+        for adapter, times in results.items():
+            p50 = statistics.median(times[name])
+            row += f"{p50 * 1000:>12.1f}{p50 / args.rtt:>12.2f}"
+            if p50 / args.rtt > budget + args.slack:
+                over.append(f"{adapter} {name}")
+        print(row)
+    print(f"{args.runs} runs at {args.rtt * 1000:.1f}ms RTT")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'budgets': {name: budget for name, _, budget in OPERATIONS},
+                       'runs': results}, f, indent=2)
+
+    if over:
+        print("Over budget: " + ", ".join(over))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Per-call cost of BybitClient's quote reads against a local stand-in for the
+Bybit ticker endpoints, with one pybit session per call (how every method used
+to work) next to the client's long lived per-product sessions. Reports time per
+call and how many connections each way opened. Localhost connections are
+nearly free, --handshake adds what the first request on a new connection would
+cost against the real endpoint (TCP + TLS round trips)
+
+    python benchmarks/bybit_sessions.py --calls 200 --handshake .03
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Callable, List
+
+from aiohttp import web
+from pybit import spot, usdt_perpetual
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main_pybit import BybitClient  # noqa: E402
+
+
+class BybitStandIn:
+    """
+    Serves the perp and spot ticker endpoints pybit reads quotes from, counting
+    the connections requests arrive on
+    """
+
+    def __init__(self, handshake: float = 0.0) -> None:
+        self.handshake = handshake
+        self.connections = set()
+        self.url = None
+        self._loop = None
+
+    async def _perp_ticker(self, request: web.Request) -> web.Response:
+        await self._on_request(request)
+        return web.json_response({'ret_code': 0, 'ret_msg': 'OK', 'result': [
+            {'symbol': request.query.get('symbol'), 'bid_price': '1078.4', 'ask_price': '1078.9',
+             'predicted_funding_rate': '0.0001'}]})
+
+    async def _spot_ticker(self, request: web.Request) -> web.Response:
+        await self._on_request(request)
+        return web.json_response({'ret_code': 0, 'ret_msg': '', 'result': {
+            'symbol': request.query.get('symbol'), 'bestBidPrice': '1078.3', 'bestAskPrice': '1078.8'}})
+
+    async def _on_request(self, request: web.Request) -> None:
+        peer = request.transport.get_extra_info('peername')
+        if peer not in self.connections:
+            self.connections.add(peer)
+            await asyncio.sleep(self.handshake)
+
+    def start(self) -> 'BybitStandIn':
+        started = threading.Event()
+
+        async def serve():
+            app = web.Application()
+            app.router.add_get('/v2/public/tickers', self._perp_ticker)
+            app.router.add_get('/spot/quote/v1/ticker/24hr', self._spot_ticker)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            await site.start()
+            self.url = 'http://127.0.0.1:' + str(self._runner.addresses[0][1])
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(serve())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self) -> None:
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def session_per_call(url: str) -> Callable[[int], None]:
+    """Quote reads the way BybitClient used to make them, a new pybit session each time
+    """
+    def call(i: int) -> None:
+        if i % 2:
+            usdt_perpetual.HTTP(endpoint=url, api_key='key', api_secret='secret') \
+                .latest_information_for_symbol(symbol="ETHUSDT")
+        else:
+            spot.HTTP(endpoint=url, api_key='key', api_secret='secret') \
+                .latest_information_for_symbol(symbol="ETHUSDT", spot=True)
+    return call
+
+
+def shared_sessions(url: str) -> Callable[[int], None]:
+    client = BybitClient(api_key='key', api_secret='secret', endpoint=url)
+
+    def call(i: int) -> None:
+        if i % 2:
+            client.get_future("ETHUSDT")
+        else:
+            client.get_single_market("ETHUSDT")
+    return call
+
+
+def run(make_call: Callable[[str], Callable[[int], None]], calls: int, handshake: float) -> tuple:
+    server = BybitStandIn(handshake).start()
+    try:
+        call = make_call(server.url)
+        times = []
+        for i in range(calls):
+            start = time.perf_counter()
+            call(i)
+            times.append(time.perf_counter() - start)
+        return times, len(server.connections)
+    finally:
+        server.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200, help='quote reads, alternating perp and spot')
+    parser.add_argument('--handshake', type=float, default=0.0,
+                        help='seconds the first request on a new connection is delayed by')
+    args = parser.parse_args()
+    # pybit logs every session it makes
+    logging.getLogger('pybit').setLevel(logging.WARNING)
+
+    print(f"{'sessions':<10}{'mean (ms)':>11}{'p50 (ms)':>10}{'p99 (ms)':>10}{'connections':>13}")
+    results: List[float] = []
+    for name, make_call in (('per call', session_per_call), ('shared', shared_sessions)):
+        times, connections = run(make_call, args.calls, args.handshake)
+        times.sort()
+        results.append(statistics.mean(times))
+        print(f"{name:<10}{statistics.mean(times) * 1000:>11.2f}{times[len(times) // 2] * 1000:>10.2f}"
+              f"{times[int(len(times) * .99)] * 1000:>10.2f}{connections:>13}")
+    print(f"Shared sessions are {results[0] / results[1]:.1f}x quicker per call")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Measures how long flatten() takes to pull every resting order and take every
+position off against a SimulatedExchange, next to doing the same one request
+at a time. Every run opens a spot/perp position and rests an order on both
+markets of each underlier first, and checks the account is flat afterwards.
+Exits 1 if the median parallel flatten misses --target seconds
+
+    python benchmarks/flatten_latency.py --underliers 5 --rtt .05 --target .25
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fills import SIZE_TOLERANCE  # noqa: E402
+from flatten import flatten, offsetting_orders  # noqa: E402
+from client import FtxClient  # noqa: E402
+from simulator import SimulatedExchange  # noqa: E402
+
+
+def open_positions(client: FtxClient, coins: List[str], size: float) -> None:
+    """Long spot/short perp on every coin plus a resting order on each market
+    """
+    for coin in coins:
+        client.place_order(coin + "/USD", "buy", None, size, 'market')
+        client.place_order(coin + "-PERP", "sell", None, size, 'market')
+        client.place_order(coin + "/USD", "buy", 1, size, 'limit', post_only=True)
+        client.place_order(coin + "-PERP", "sell", 100000, size, 'limit', post_only=True)
+
+
+def flatten_sequentially(client: FtxClient) -> Dict:
+    """The one request at a time way: cancel each order, read, send each offsetting order
+    """
+    start = time.perf_counter()
+    for order in client.get_order_status():
+        client.cancel_order(order['id'])
+    for order_args in offsetting_orders(client.get_positions(), client.get_balances()):
+        client.place_order(**order_args)
+    return {'total_seconds': time.perf_counter() - start}
+
+
+def is_flat(exchange: SimulatedExchange) -> bool:
+    return (all(order['status'] == 'closed' for order in exchange.orders.values()) and
+            all(abs(position['netSize']) <= SIZE_TOLERANCE for position in exchange.positions) and
+            all(abs(balance['total']) <= SIZE_TOLERANCE for balance in exchange.balances if balance['coin'] != 'USD'))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--underliers', type=int, default=5, help='coins with a position open')
+    parser.add_argument('--size', type=float, default=.01)
+    parser.add_argument('--rtt', type=float, default=.05, help='mean round trip time in seconds')
+    parser.add_argument('--jitter', type=float, default=.005, help='round trip time standard deviation')
+    parser.add_argument('--target', type=float, help='median seconds the parallel flatten must beat, 5 RTTs by default')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results json here')
+    args = parser.parse_args()
+    # three round trips, plus headroom for jitter (each phase waits on its slowest request) and client overhead
+    target = 5 * args.rtt if args.target is None else args.target
+
+    coins = ['ETH'] + [f"C{i}" for i in range(1, args.underliers)]
+    exchange = SimulatedExchange(rtt=args.rtt, jitter=args.jitter, maker_fill_probability=0, seed=args.seed)
+    for coin in coins[1:]:
+        exchange.list_underlier(coin)
+
+    results = {'parallel': [], 'sequential': []}
+    with exchange:
+        client = FtxClient(api_key=exchange.api_key, api_secret=exchange.api_secret, subaccount_name='bench',
+                           endpoint=exchange.url)
+        for _ in range(args.runs):
+            for mode in results:
+                open_positions(client, coins, args.size)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    run = flatten(client) if mode == 'parallel' else flatten_sequentially(client)
+                results[mode].append({'total_seconds': run['total_seconds'], 'flat': is_flat(exchange)})
+
+    summary = {}
+    for mode, runs in results.items():
+        seconds = [run['total_seconds'] for run in runs]
+        summary[mode] = {'mean': statistics.mean(seconds), 'p50': statistics.median(seconds), 'max': max(seconds),
+                         'all_flat': all(run['flat'] for run in runs)}
+        print(f"{mode:<12}mean {summary[mode]['mean'] * 1000:8.1f}ms  p50 {summary[mode]['p50'] * 1000:8.1f}ms  "
+              f"max {summary[mode]['max'] * 1000:8.1f}ms  flat {summary[mode]['all_flat']}")
+    print(f"Target {target * 1000:.1f}ms, {args.underliers} underliers at {args.rtt * 1000:.1f}ms RTT")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': vars(args), 'target': target, 'summary': summary, 'runs': results}, f, indent=2)
+
+    if summary['parallel']['p50'] > target or not summary['parallel']['all_flat']:
+        print("Flatten missed its target")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+CPU cost of building, signing and decoding one FtxClient request, before and
+after the single-prepare/pre-keyed HMAC/fast JSON pipeline. Nothing is sent,
+the response is a canned one, so this measures only our own per-request overhead
+
+    python benchmarks/request_pipeline.py [--iterations N]
+"""
+import argparse
+import hmac
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+from requests import Request, Response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client import FtxClient  # noqa: E402
+
+
+def legacy_request(client: FtxClient, method: str, path: str, params=None, json_body=None,
+                   response: Response = None):
+    """The pipeline as it was: prepare to sign, prepare again to send, re-key the
+    HMAC on every call and decode with response.json()
+    """
+    request = Request(method, client._endpoint + path, params=params, json=json_body)
+    ts = int(time.time() * 1000)
+    prepared = request.prepare()
+    signature_payload = f'{ts}{prepared.method}{prepared.path_url}'.encode()
+    if prepared.body:
+        signature_payload += prepared.body
+    signature = hmac.new(client._api_secret.encode(), signature_payload, 'sha256').hexdigest()
+    request.headers['FTX-KEY'] = client._api_key
+    request.headers['FTX-SIGN'] = signature
+    request.headers['FTX-TS'] = str(ts)
+    request.headers['FTX-SUBACCOUNT'] = urllib.parse.quote(client._subaccount_name)
+    request.prepare()
+    data = response.json()
+    return data['result']
+
+
+def current_request(client: FtxClient, method: str, path: str, params=None, json_body=None,
+                    response: Response = None):
+    client._prepare_request(method, path, params=params, json=json_body)
+    return client._process_response(response)
+
+
+def canned_response(result) -> Response:
+    response = Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'application/json'
+    response._content = json.dumps({'success': True, 'result': result}).encode()
+    return response
+
+
+def place_order_case() -> tuple:
+    body = {'market': 'ETH-PERP', 'side': 'sell', 'price': 1079.43, 'size': .01, 'type': 'limit',
+            'reduceOnly': False, 'ioc': False, 'postOnly': True, 'clientId': None}
+    order = dict(body, id=112590877630, status='new', filledSize=0.0, remainingSize=.01, avgFillPrice=None,
+                 createdAt='2022-06-20T10:06:03.215186+00:00', future='ETH-PERP')
+    return 'POST', 'orders', None, body, canned_response(order)
+
+
+def fills_case(count: int = 200) -> tuple:
+    fills = [{'id': 5000000000 + i, 'orderId': 112590877630 + i // 4, 'market': 'ETH-PERP', 'future': 'ETH-PERP',
+              'baseCurrency': None, 'quoteCurrency': None, 'type': 'order', 'side': 'buy' if i % 2 else 'sell',
+              'price': 1078.4 + i * .1, 'size': .01, 'fee': .0002, 'feeCurrency': 'USD', 'feeRate': .0002,
+              'liquidity': 'maker', 'time': '2022-06-20T10:06:03.215186+00:00', 'tradeId': 2400000000 + i}
+             for i in range(count)]
+    return 'GET', 'fills', {'market': 'ETH-PERP', 'orderId': None}, None, canned_response(fills)
+
+
+def cpu_per_request(pipeline, client: FtxClient, case: tuple, iterations: int) -> float:
+    method, path, params, body, response = case
+    pipeline(client, method, path, params, body, response)
+    start = time.process_time()
+    for _ in range(iterations):
+        pipeline(client, method, path, params, body, response)
+    return (time.process_time() - start) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5000)
+    args = parser.parse_args()
+
+    client = FtxClient(api_key='key', api_secret='secret', subaccount_name='sub')
+    print(f"{'payload':<14}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for name, case, iterations in (('place_order', place_order_case(), args.iterations),
+                                   ('fills x200', fills_case(), max(1, args.iterations // 10))):
+        before = cpu_per_request(legacy_request, client, case, iterations)
+        after = cpu_per_request(current_request, client, case, iterations)
+        print(f"{name:<14}{before * 1e6:>14.1f}{after * 1e6:>14.1f}{before / after:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
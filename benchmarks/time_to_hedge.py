@@ -0,0 +1,193 @@
+"""
+Runs DeltaNeutralTrade.trade (maker orders, hedged with a market order or
+chased with amends) and trade_market_orders against a SimulatedExchange and
+measures, per run: wall clock time per stage, how long the position was
+unhedged, API calls made, fees and slippage. The fee and hedge time the chase
+saves over the market order hedge is reported when both modes run. Results are
+written as JSON, pass a previous results file as --baseline to fail on regressions
+
+    python benchmarks/time_to_hedge.py --runs 10 --rtt .05 --output results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import DeltaNeutralTrade, FtxClient  # noqa: E402
+from metrics import Metrics, endpoint_name  # noqa: E402
+from simulator import SimulatedExchange, unhedged_intervals  # noqa: E402
+
+# mode -> (DeltaNeutralTrade method, constructor kwargs)
+MODES = {'maker': ('trade', {}), 'chase': ('trade', {'hedge_mode': 'chase'}),
+         'market': ('trade_market_orders', {})}
+
+# regressions are checked on the mean of these, all lower is better
+CHECKED = ('total_seconds', 'unhedged_seconds', 'api_calls', 'fees', 'slippage')
+
+
+class BenchmarkTrade(DeltaNeutralTrade):
+    """Exits as soon as it is in, the holding period isn't what's being measured
+    """
+
+    def wait_for_exit_condition(self) -> None:
+        return
+
+
+def run_once(exchange: SimulatedExchange, mode: str, trade_size: float, chase_deadline: float = 2) -> Dict:
+    """Run one full open & close and measure it from the exchange's side
+
+    Returns:
+        dict: measurements of the run
+    """
+    metrics = Metrics()
+    client = FtxClient(api_key=exchange.api_key, api_secret=exchange.api_secret, subaccount_name='bench',
+                       endpoint=exchange.url, metrics=metrics)
+    method, trade_kwargs = MODES[mode]
+    trade = BenchmarkTrade('ETH', client, trade_size, chase_deadline=chase_deadline, **trade_kwargs)
+
+    first_fill = len(exchange.fills)
+    first_request = len(exchange.requests)
+    error = None
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            pnl = getattr(trade, method)()
+        except Exception as exc:
+            pnl, error = None, str(exc)
+    end = time.time()
+    trade._leg_executor.shutdown()
+
+    fills = exchange.fills[first_fill:]
+    requests = exchange.requests[first_request:]
+    intervals = unhedged_intervals(fills)
+    return {
+        'mode': mode,
+        'error': error,
+        'pnl': pnl,
+        'total_seconds': end - start,
+        'stage_seconds': {stage: metrics.stage_histogram(stage).total for stage in metrics.summary()['stages']},
+        'unhedged_seconds': sum((interval_end or end) - interval_start for interval_start, interval_end in intervals),
+        'max_unhedged_seconds': max([(interval_end or end) - interval_start
+                                     for interval_start, interval_end in intervals], default=0.0),
+        'api_calls': len(requests),
+        'api_calls_by_endpoint': dict(Counter(endpoint_name(method, path[len('/api/'):])
+                                              for method, path, _ in requests)),
+        'fees': sum(fill['fee'] for fill in fills),
+        'slippage': exchange.slippage(fills),
+        'taker_size': sum(fill['size'] for fill in fills if fill['liquidity'] == 'taker'),
+    }
+
+
+def summarize(runs: List[Dict]) -> Dict:
+    """mean/p50/max of every measurement over the runs that completed
+    """
+    completed = [run for run in runs if run['error'] is None]
+    summary = {'runs': len(runs), 'errors': len(runs) - len(completed)}
+    if not completed:
+        return summary
+    for key in CHECKED + ('max_unhedged_seconds', 'taker_size'):
+        values = [run[key] for run in completed]
+        summary[key] = {'mean': statistics.mean(values), 'p50': statistics.median(values), 'max': max(values)}
+    stages = {stage for run in completed for stage in run['stage_seconds']}
+    summary['stage_seconds'] = {stage: statistics.mean(run['stage_seconds'].get(stage, 0.0) for run in completed)
+                                for stage in sorted(stages)}
+    return summary
+
+
+def regressions(summary: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Measurements whose mean got worse than the baseline by more than tolerance
+    """
+    found = []
+    for mode, mode_summary in summary.items():
+        for key in CHECKED:
+            if key not in mode_summary or key not in baseline.get(mode, {}):
+                continue
+            before, after = baseline[mode][key]['mean'], mode_summary[key]['mean']
+            if after > before + abs(before) * tolerance + 1e-9:
+                found.append(f"{mode} {key}: {before:.6g} -> {after:.6g}")
+    return found
+
+
+def hedge_savings(summary: Dict) -> Dict:
+    """What chasing the leftover leg saved over cancelling it and taking the rest,
+    positive is better for the chase
+    """
+    maker, chase = summary.get('maker', {}), summary.get('chase', {})
+    if 'fees' not in maker or 'fees' not in chase:
+        return {}
+    return {
+        'fees': maker['fees']['mean'] - chase['fees']['mean'],
+        'slippage': maker['slippage']['mean'] - chase['slippage']['mean'],
+        'taker_size': maker['taker_size']['mean'] - chase['taker_size']['mean'],
+        'hedge_seconds': maker['stage_seconds'].get('hedge', 0.0) - chase['stage_seconds'].get('hedge', 0.0),
+        'unhedged_seconds': maker['unhedged_seconds']['mean'] - chase['unhedged_seconds']['mean'],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='trades per mode')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--size', type=float, default=.01, help='trade size in ETH')
+    parser.add_argument('--rtt', type=float, default=.05, help='mean round trip time in seconds')
+    parser.add_argument('--jitter', type=float, default=.01, help='round trip time standard deviation')
+    parser.add_argument('--maker-fill-time', type=float, default=1.0, help='mean seconds for a maker order to fill')
+    parser.add_argument('--partial-fill-probability', type=float, default=0.0)
+    parser.add_argument('--taker-slippage', type=float, default=0.0, help='fraction beyond the touch')
+    parser.add_argument('--chase-deadline', type=float, default=2.0,
+                        help='seconds the chase mode amends before taking liquidity')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results json here')
+    parser.add_argument('--baseline', help='results json to compare against, exits 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=.2, help='allowed relative worsening of a mean')
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'tolerance')}
+    exchange = SimulatedExchange(rtt=args.rtt, jitter=args.jitter, maker_fill_time=args.maker_fill_time,
+                                 partial_fill_probability=args.partial_fill_probability,
+                                 taker_slippage=args.taker_slippage, seed=args.seed)
+    with exchange:
+        runs = [run_once(exchange, mode, args.size, args.chase_deadline)
+                for mode in args.modes for _ in range(args.runs)]
+
+    summary = {mode: summarize([run for run in runs if run['mode'] == mode]) for mode in args.modes}
+    savings = hedge_savings(summary)
+    results = {'config': config, 'summary': summary, 'chase_savings': savings, 'runs': runs}
+
+    print(f"{'mode':<8}{'runs':>6}{'errors':>8}{'total s':>10}{'unhedged s':>12}{'calls':>8}{'fees':>10}{'slippage':>10}")
+    for mode, mode_summary in summary.items():
+        if 'total_seconds' not in mode_summary:
+            print(f"{mode:<8}{mode_summary['runs']:>6}{mode_summary['errors']:>8}")
+            continue
+        print(f"{mode:<8}{mode_summary['runs']:>6}{mode_summary['errors']:>8}"
+              f"{mode_summary['total_seconds']['mean']:>10.3f}{mode_summary['unhedged_seconds']['mean']:>12.3f}"
+              f"{mode_summary['api_calls']['mean']:>8.1f}{mode_summary['fees']['mean']:>10.5f}"
+              f"{mode_summary['slippage']['mean']:>10.5f}")
+    if savings:
+        print(f"Chase vs market hedge, per trade: fees saved {savings['fees']:.5f}, slippage saved "
+              f"{savings['slippage']:.5f}, taker size saved {savings['taker_size']:.5g}, hedge stage time saved "
+              f"{savings['hedge_seconds'] * 1000:.1f}ms, unhedged time saved {savings['unhedged_seconds'] * 1000:.1f}ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(summary, json.load(f)['summary'], args.tolerance)
+        for regression in found:
+            print("Regression: " + regression)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,479 @@
+"""
+AsyncBybitClient runs the async strategy engine on Bybit: it implements the
+exchange.AsyncExchange interface on the USDT perpetual (linear) and spot v1 REST
+APIs. "ETH-PERP" is the ETHUSDT perp and "ETH/USD" the ETHUSDT spot market, ids
+of the orders it returns carry the market they were sent to ("ETH-PERP#<bybit
+id>") so every later call on them knows which product and symbol to route to
+"""
+import asyncio
+import hmac
+import math
+import time
+import urllib.parse
+from typing import Optional, Dict, Any, List, Tuple
+
+import aiohttp
+from yarl import URL
+
+from codec import json_dumps, json_loads
+from fills import FILLS_PAGE_SIZE
+from metrics import Metrics, endpoint_name
+from ratelimit import CANCEL, DATA, PLACE, RateLimiter
+
+# bybit order status -> FTX order status
+_PERP_STATUS = {'Created': 'new', 'New': 'open', 'PartiallyFilled': 'open', 'Filled': 'closed',
+                'Cancelled': 'closed', 'Rejected': 'closed', 'PendingCancel': 'closed'}
+_SPOT_STATUS = {'NEW': 'open', 'PARTIALLY_FILLED': 'open', 'FILLED': 'closed', 'CANCELED': 'closed',
+                'PENDING_CANCEL': 'closed', 'REJECTED': 'closed'}
+
+
+def venue_symbol(market: str) -> Tuple[bool, str]:
+    """Bybit product and symbol of a market
+
+    Args:
+        market (str): FTX style market name, e.g. "ETH-PERP" or "ETH/USD"
+
+    Returns:
+        tuple: (is_perp, symbol), e.g. (True, "ETHUSDT")
+    """
+    if market.endswith('-PERP'):
+        return True, market[:-len('-PERP')] + 'USDT'
+    base, quote = market.split('/')
+    return False, base + ('USDT' if quote == 'USD' else quote)
+
+
+def market_name(symbol: str, is_perp: bool) -> str:
+    base = symbol[:-len('USDT')] if symbol.endswith('USDT') else symbol
+    return base + '-PERP' if is_perp else base + '/USD'
+
+
+def split_order_id(order_id: str) -> Tuple[str, str]:
+    """(market, bybit order id) of an id AsyncBybitClient returned
+    """
+    market, venue_id = str(order_id).rsplit('#', 1)
+    return market, venue_id
+
+
+def _param_text(value: Any) -> str:
+    # how bybit reads parameters back when checking the signature, json booleans included
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _float(value: Any) -> Optional[float]:
+    return None if value in (None, '') else float(value)
+
+
+def _perp_order(market: str, order: Dict) -> dict:
+    size = float(order['qty'])
+    filled = float(order.get('cum_exec_qty') or 0)
+    value = float(order.get('cum_exec_value') or 0)
+    return {
+        'id': market + '#' + order['order_id'],
+        'clientId': order.get('order_link_id') or None,
+        'market': market,
+        'type': order.get('order_type', '').lower(),
+        'side': order.get('side', '').lower(),
+        # market orders carry bybit's protection price, FTX's have none
+        'price': _float(order.get('price')) or None,
+        'size': size,
+        'status': _PERP_STATUS.get(order.get('order_status'), 'open'),
+        'filledSize': filled,
+        'remainingSize': size - filled,
+        'avgFillPrice': value / filled if filled else None,
+    }
+
+
+def _spot_order(market: str, order: Dict, order_type: Optional[str] = None) -> dict:
+    size = float(order['origQty'])
+    filled = float(order.get('executedQty') or 0)
+    value = float(order.get('cummulativeQuoteQty') or 0)
+    return {
+        'id': market + '#' + str(order['orderId']),
+        'clientId': order.get('orderLinkId') or None,
+        'market': market,
+        'type': order_type or ('market' if order.get('type') == 'MARKET' else 'limit'),
+        'side': order.get('side', '').lower(),
+        'price': _float(order.get('price')),
+        'size': size,
+        'status': _SPOT_STATUS.get(order.get('status'), 'open'),
+        'filledSize': filled,
+        'remainingSize': size - filled,
+        'avgFillPrice': value / filled if filled and value else _float(order.get('avgPrice')) or None,
+    }
+
+
+def _perp_fill(market: str, execution: Dict) -> dict:
+    return {
+        'id': execution['exec_id'],
+        'orderId': market + '#' + execution['order_id'],
+        'market': market,
+        'side': execution['side'].lower(),
+        'price': float(execution['exec_price']),
+        'size': float(execution['exec_qty']),
+        'fee': float(execution.get('exec_fee') or 0),
+        'liquidity': 'maker' if execution.get('last_liquidity_ind') == 'AddedLiquidity' else 'taker',
+        'time': int(execution['trade_time_ms']) / 1000,
+    }
+
+
+def _spot_fill(trade: Dict) -> dict:
+    market = market_name(trade['symbol'], False)
+    price = float(trade['price'])
+    fee = float(trade.get('commission') or 0)
+    if trade.get('commissionAsset') == market.split('/')[0]:
+        # buys pay their fee in the coin, the strategy counts fees in USD
+        fee *= price
+    return {
+        'id': str(trade['id']),
+        'orderId': market + '#' + str(trade['orderId']),
+        'market': market,
+        'side': 'buy' if trade.get('isBuyer') else 'sell',
+        'price': price,
+        'size': float(trade['qty']),
+        'fee': fee,
+        'liquidity': 'maker' if trade.get('isMaker') else 'taker',
+        'time': int(trade['time']) / 1000,
+    }
+
+
+class AsyncBybitClient:
+    """
+    exchange.AsyncExchange on Bybit, with AsyncFtxClient's method surface and
+    results so AsyncDeltaNeutralTrade, Portfolio and flatten_async run on it as is.
+    Requests share one pooled keep-alive connector, go through a RateLimiter and
+    record into Metrics the same way AsyncFtxClient's do.
+
+    Where Bybit has no equivalent it gets as close as it can: spot market orders
+    go out as IOC limits market_slippage through the touch (spot market buys are
+    sized in USDT on Bybit), spot amends are a cancel and a new order for what is
+    left, and borrow/lending rates are 0 (the account trades spot unmargined).
+    Bulk cancels and open order reads cover the markets this client has quoted
+    or traded, plus any passed as markets
+    """
+    _ENDPOINT = 'https://api.bybit.com'
+
+    def __init__(self, api_key=None, api_secret=None, endpoint=None, pool_size: int = 20,
+                 rate_limiter: Optional[RateLimiter] = None, metrics: Optional[Metrics] = None,
+                 markets: Tuple[str, ...] = (), market_slippage: float = .002, recv_window: int = 5000) -> None:
+        self._session = None
+        self._endpoint = (endpoint or self._ENDPOINT).rstrip('/')
+        self._pool_size = pool_size
+        self._api_key = api_key
+        self._hmac = hmac.new(api_secret.encode(), digestmod='sha256') if api_secret else None
+        self._recv_window = recv_window
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.metrics = metrics or Metrics()
+        self.market_slippage = market_slippage
+        # markets bulk cancels and open order reads go through, bybit scopes both by symbol
+        self.markets = set(markets)
+        # spot symbol -> /spot/v1/symbols entry, read once
+        self._spot_symbols = None
+
+    async def __aenter__(self) -> 'AsyncBybitClient':
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # created lazily so the session binds to the loop that actually runs the requests
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, keepalive_timeout=30, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def _request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                       signed: bool = True, json_body: bool = False, priority: int = DATA) -> Any:
+        """Send a request, parameters go in the query string unless json_body (linear POSTs)
+        """
+        start = time.perf_counter()
+        endpoint = endpoint_name(method, path)
+        await self.rate_limiter.acquire_async(priority)
+        queued = time.perf_counter()
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        if signed:
+            params = self._sign(params)
+        url = self._endpoint + path
+        body = b''
+        headers = {}
+        if json_body:
+            body = json_dumps(params)
+            headers['Content-Type'] = 'application/json'
+        elif params:
+            url += '?' + urllib.parse.urlencode({k: _param_text(v) for k, v in params.items()})
+        prepared = time.perf_counter()
+
+        async with self._get_session().request(method, URL(url, encoded=True), data=body or None,
+                                               headers=headers) as response:
+            content = await response.read()
+        received = time.perf_counter()
+        try:
+            return self._process_response(response, content)
+        finally:
+            done = time.perf_counter()
+            self.metrics.record_request(endpoint, {
+                'queue': queued - start, 'sign': prepared - queued, 'network': received - prepared,
+                'decode': done - received, 'total': done - start})
+
+    def _sign(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        params = dict(params, api_key=self._api_key, timestamp=int(time.time() * 1000),
+                      recv_window=self._recv_window)
+        signature = self._hmac.copy()
+        signature.update('&'.join(f'{k}={_param_text(params[k])}' for k in sorted(params)).encode())
+        params['sign'] = signature.hexdigest()
+        return params
+
+    def _process_response(self, response: aiohttp.ClientResponse, content: bytes) -> Any:
+        try:
+            data = json_loads(content)
+        except ValueError:
+            response.raise_for_status()
+            raise
+        else:
+            if data.get('ret_code') != 0:
+                raise Exception(data.get('ret_msg') or data.get('ret_code'))
+            return data['result']
+
+    def _route(self, market: str) -> Tuple[bool, str]:
+        self.markets.add(market)
+        return venue_symbol(market)
+
+    async def _perp_ticker(self, future_name: str) -> Dict:
+        _, symbol = self._route(future_name)
+        return (await self._request('GET', '/v2/public/tickers', {'symbol': symbol}, signed=False))[0]
+
+    async def get_future(self, future_name: str = None) -> dict:
+        ticker = await self._perp_ticker(future_name)
+        return {'name': future_name, 'bid': _float(ticker['bid_price']), 'ask': _float(ticker['ask_price']),
+                'last': _float(ticker.get('last_price')), 'price': _float(ticker.get('mark_price'))}
+
+    async def get_future_stats(self, future_name: str) -> dict:
+        ticker = await self._perp_ticker(future_name)
+        return {'nextFundingRate': float(ticker['predicted_funding_rate'])}
+
+    async def get_single_market(self, market: str = None) -> dict:
+        _, symbol = self._route(market)
+        ticker = await self._request('GET', '/spot/quote/v1/ticker/book_ticker', {'symbol': symbol}, signed=False)
+        return {'name': market, 'bid': _float(ticker['bidPrice']), 'ask': _float(ticker['askPrice']),
+                'bidSize': _float(ticker.get('bidQty')), 'askSize': _float(ticker.get('askQty'))}
+
+    async def _get_spot_symbols(self) -> Dict[str, Dict]:
+        if self._spot_symbols is None:
+            symbols = await self._request('GET', '/spot/v1/symbols', signed=False)
+            self._spot_symbols = {symbol['name']: symbol for symbol in symbols}
+        return self._spot_symbols
+
+    async def _zero_rates(self) -> List[dict]:
+        return [{'coin': symbol['baseCurrency'], 'previous': 0.0, 'estimate': 0.0}
+                for symbol in (await self._get_spot_symbols()).values() if symbol.get('quoteCurrency') == 'USDT']
+
+    async def get_borrow_rates(self) -> List[dict]:
+        return await self._zero_rates()
+
+    async def get_lending_rates(self) -> List[dict]:
+        return await self._zero_rates()
+
+    async def _through_touch(self, market: str, side: str) -> float:
+        """Limit price that takes the spot touch like a market order would
+        """
+        quote, symbols = await asyncio.gather(self.get_single_market(market), self._get_spot_symbols())
+        price = quote['ask'] * (1 + self.market_slippage) if side == 'buy' else \
+            quote['bid'] * (1 - self.market_slippage)
+        tick = float(symbols.get(venue_symbol(market)[1], {}).get('minPricePrecision') or 0)
+        if tick:
+            # whole ticks, rounded away from the touch so the order still crosses
+            ticks = price / tick
+            price = round((math.ceil(ticks) if side == 'buy' else math.floor(ticks)) * tick, 10)
+        return price
+
+    async def place_order(self, market: str, side: str, price: float, size: float, type: str = 'limit',
+                          reduce_only: bool = False, ioc: bool = False, post_only: bool = False,
+                          client_id: str = None, reject_after_ts: float = None) -> dict:
+        is_perp, symbol = self._route(market)
+        # market orders only go out to finish or unwind a hedge, they can't wait behind new quotes
+        priority = CANCEL if type == 'market' else PLACE
+        if is_perp:
+            order = await self._request('POST', '/private/linear/order/create', {
+                'side': side.capitalize(),
+                'symbol': symbol,
+                'order_type': 'Market' if type == 'market' else 'Limit',
+                'qty': size,
+                'price': None if type == 'market' else price,
+                'time_in_force': 'PostOnly' if post_only else 'ImmediateOrCancel' if ioc else 'GoodTillCancel',
+                'reduce_only': reduce_only,
+                'close_on_trigger': False,
+                'order_link_id': client_id,
+            }, json_body=True, priority=priority)
+            return _perp_order(market, order)
+
+        if type == 'market':
+            price = await self._through_touch(market, side)
+        order = await self._request('POST', '/spot/v1/order', {
+            'symbol': symbol,
+            'qty': size,
+            'side': side.upper(),
+            'type': 'LIMIT_MAKER' if post_only else 'LIMIT',
+            'price': price,
+            'timeInForce': 'IOC' if ioc or type == 'market' else 'GTC',
+            'orderLinkId': client_id,
+        }, priority=priority)
+        return _spot_order(market, order, type)
+
+    async def _perp_order_search(self, symbol: str, order_id: Optional[str] = None) -> Any:
+        return await self._request('GET', '/private/linear/order/search', {'symbol': symbol, 'order_id': order_id})
+
+    async def get_order_status(self, order_id: str = None) -> List[dict]:
+        markets = sorted(self.markets)
+        perps = [market for market in markets if market.endswith('-PERP')]
+        results = await asyncio.gather(self._request('GET', '/spot/v1/open-orders'),
+                                       *[self._perp_order_search(venue_symbol(market)[1]) for market in perps])
+        orders = [_spot_order(market_name(order['symbol'], False), order) for order in results[0] or ()]
+        for market, perp_orders in zip(perps, results[1:]):
+            orders.extend(_perp_order(market, order) for order in perp_orders or ())
+        return [order for order in orders if order['status'] != 'closed']
+
+    async def get_order(self, order_id: str) -> dict:
+        market, venue_id = split_order_id(order_id)
+        is_perp, symbol = self._route(market)
+        if is_perp:
+            return _perp_order(market, await self._perp_order_search(symbol, venue_id))
+        return _spot_order(market, await self._request('GET', '/spot/v1/order', {'orderId': venue_id}))
+
+    async def modify_order(
+        self, existing_order_id: Optional[str] = None,
+        existing_client_order_id: Optional[str] = None, price: Optional[float] = None,
+        size: Optional[float] = None, client_order_id: Optional[str] = None,
+    ) -> dict:
+        assert existing_order_id is not None and existing_client_order_id is None, \
+            'Orders can only be modified by id on Bybit'
+        market, venue_id = split_order_id(existing_order_id)
+        is_perp, symbol = self._route(market)
+        if is_perp:
+            await self._request('POST', '/private/linear/order/replace', {
+                'symbol': symbol, 'order_id': venue_id, 'p_r_price': price, 'p_r_qty': size,
+            }, json_body=True, priority=PLACE)
+            return await self.get_order(existing_order_id)
+
+        # no spot amend, take the order down and put what is left of it back up
+        cancelled = await self._request('DELETE', '/spot/v1/order', {'orderId': venue_id}, priority=CANCEL)
+        filled = float(cancelled.get('executedQty') or 0)
+        remaining = (float(cancelled['origQty']) if size is None else size) - filled
+        order = await self._request('POST', '/spot/v1/order', {
+            'symbol': symbol,
+            'qty': remaining,
+            'side': cancelled['side'],
+            'type': cancelled.get('type') or 'LIMIT',
+            'price': float(cancelled['price']) if price is None else price,
+            'timeInForce': cancelled.get('timeInForce') or 'GTC',
+            'orderLinkId': client_order_id,
+        }, priority=PLACE)
+        return _spot_order(market, order)
+
+    async def cancel_order(self, order_id: str) -> dict:
+        market, venue_id = split_order_id(order_id)
+        is_perp, symbol = self._route(market)
+        if is_perp:
+            return await self._request('POST', '/private/linear/order/cancel',
+                                       {'symbol': symbol, 'order_id': venue_id}, json_body=True, priority=CANCEL)
+        return await self._request('DELETE', '/spot/v1/order', {'orderId': venue_id}, priority=CANCEL)
+
+    async def cancel_orders(self, market_name: str = None, conditional_orders: bool = False,
+                            limit_orders: bool = False) -> dict:
+        markets = [market_name] if market_name is not None else sorted(self.markets)
+        cancels = []
+        for market in markets:
+            is_perp, symbol = self._route(market)
+            if is_perp:
+                cancels.append(self._request('POST', '/private/linear/order/cancel-all', {'symbol': symbol},
+                                             json_body=True, priority=CANCEL))
+            else:
+                cancels.append(self._request('DELETE', '/spot/order/batch-cancel', {'symbolId': symbol},
+                                             priority=CANCEL))
+        await asyncio.gather(*cancels)
+        return 'Orders queued for cancellation'
+
+    async def _market_fills(self, market: Optional[str], start_ms: Optional[int], end_ms: Optional[int],
+                            venue_id: Optional[str]) -> List[dict]:
+        if market is not None and market.endswith('-PERP'):
+            _, symbol = self._route(market)
+            page = await self._request('GET', '/private/linear/trade/execution/list', {
+                'symbol': symbol, 'order_id': venue_id, 'start_time': start_ms, 'end_time': end_ms,
+                'limit': FILLS_PAGE_SIZE})
+            return [_perp_fill(market, execution) for execution in (page or {}).get('data') or ()]
+        symbol = venue_symbol(market)[1] if market is not None else None
+        if venue_id is None:
+            trades = await self._request('GET', '/spot/v1/myTrades', {
+                'symbol': symbol, 'startTime': start_ms, 'endTime': end_ms, 'limit': FILLS_PAGE_SIZE})
+            return [_spot_fill(trade) for trade in trades or ()]
+
+        # spot trades can't be asked for by order. Filtering one page would come back short and
+        # look like the last page to the fill readers, so the window is walked back until a page
+        # of the order's fills is in, the trades are older than the order or nothing older is left
+        params = {'symbol': symbol, 'startTime': start_ms, 'endTime': end_ms, 'limit': FILLS_PAGE_SIZE}
+        trades, order = await asyncio.gather(self._request('GET', '/spot/v1/myTrades', params),
+                                             self._request('GET', '/spot/v1/order', {'orderId': venue_id}))
+        created_ms = int(order['time'])
+        fills, seen = [], set()
+        while True:
+            trades = [trade for trade in trades or () if trade['id'] not in seen]
+            if not trades:
+                break
+            seen.update(trade['id'] for trade in trades)
+            fills += [_spot_fill(trade) for trade in trades if str(trade['orderId']) == venue_id]
+            # inclusive, trades in the oldest millisecond that didn't fit come back on the next page
+            params['endTime'] = min(int(trade['time']) for trade in trades)
+            if len(fills) >= FILLS_PAGE_SIZE or params['endTime'] < created_ms:
+                break
+            trades = await self._request('GET', '/spot/v1/myTrades', params)
+        return fills[:FILLS_PAGE_SIZE]
+
+    async def get_fills(self, market: str = None, start_time: float = None,
+                        end_time: float = None, min_id: int = None, order_id: int = None
+                        ) -> List[dict]:
+        venue_id = None
+        if order_id is not None:
+            market, venue_id = split_order_id(order_id)
+        start_ms = int(start_time * 1000) if start_time is not None else None
+        # rounded up so a fill in the end_time millisecond is still in
+        end_ms = math.ceil(end_time * 1000) if end_time is not None else None
+        if market is not None:
+            markets = [market]
+        else:
+            # every spot fill in one request, then the perps one at a time
+            markets = [None] + sorted(market for market in self.markets if market.endswith('-PERP'))
+        pages = await asyncio.gather(*[self._market_fills(market, start_ms, end_ms, venue_id)
+                                       for market in markets])
+        fills = [fill for page in pages for fill in page]
+        fills.sort(key=lambda fill: fill['time'], reverse=True)
+        # a full page only reaches back to its oldest fill, older fills of the other markets would
+        # have the fill readers page on from there and skip the rest of it. One page is what every
+        # market has down to where the first of them stops, the next page picks up from there
+        full_pages = [page for page in pages if len(page) >= FILLS_PAGE_SIZE]
+        if full_pages:
+            cutoff = max(min(fill['time'] for fill in page) for page in full_pages)
+            fills = [fill for fill in fills if fill['time'] >= cutoff]
+        return fills
+
+    async def get_positions(self, show_avg_price: bool = False) -> List[dict]:
+        net_sizes = {}
+        for position in await self._request('GET', '/private/linear/position/list') or ():
+            position = position.get('data', position)
+            size = float(position.get('size') or 0)
+            market = market_name(position['symbol'], True)
+            # hedge mode accounts have a buy and a sell position per symbol
+            net_sizes[market] = net_sizes.get(market, 0.0) + (-size if position.get('side') == 'Sell' else size)
+        return [{'future': market, 'netSize': net_size, 'size': abs(net_size),
+                 'side': 'buy' if net_size >= 0 else 'sell'} for market, net_size in net_sizes.items()]
+
+    async def get_balances(self) -> List[dict]:
+        account = await self._request('GET', '/spot/v1/account')
+        return [{'coin': 'USD' if balance['coin'] == 'USDT' else balance['coin'],
+                 'total': float(balance['total']), 'free': float(balance['free'])}
+                for balance in account['balances']]
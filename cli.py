@@ -0,0 +1,98 @@
+"""
+Command line entry point: runs the strategy for one underlier against the account
+in .env (FTX_API_KEY, FTX_API_SECRET, SUBACCOUNT_NAME, optionally RECORD_DIR and
+JOURNAL_PATH). Trades a previous run left open are finished first
+
+    python cli.py --underlier ETH --size .01 --mode compare
+"""
+import argparse
+from typing import Optional, List
+
+# what each mode runs, compare is the strategy followed by market orders only, as main.py always did
+MODES = ('maker', 'chase', 'market', 'compare', 'flatten')
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--underlier', default='ETH', help='coin to trade, its /USD spot market and -PERP')
+    parser.add_argument('--size', type=float, default=.01, help='size of each leg')
+    parser.add_argument('--mode', choices=MODES, default='compare',
+                        help='maker orders hedged at market or chased with amends, market orders only, '
+                             'both maker and market one after the other, or flatten every position')
+    parser.add_argument('--adaptive-quotes', action='store_true',
+                        help='place maker orders with AdaptiveQuoter instead of a fixed offset')
+    parser.add_argument('--env', default='.env', help='file with the account settings')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+
+    # the heavy dependencies are only loaded for an actual run
+    from dotenv import dotenv_values
+
+    from client import FtxClient
+    from flatten import flatten
+    from journal import TradeJournal
+    from main import DeltaNeutralTrade
+    from quoting import AdaptiveQuoter
+    from rates import RateStore
+    from recorder import Recorder
+    from streams import FtxWebsocketClient
+
+    config = dotenv_values(args.env)
+
+    FTX_API_KEY = config['FTX_API_KEY']
+    FTX_API_SECRET = config['FTX_API_SECRET']
+    SUBACCOUNT_NAME = config['SUBACCOUNT_NAME']
+
+    recorder = Recorder(config.get('RECORD_DIR') or 'recordings')
+    ftx_client = FtxClient(api_key=FTX_API_KEY, api_secret=FTX_API_SECRET, subaccount_name=SUBACCOUNT_NAME,
+                           recorder=recorder)
+
+    if args.mode == 'flatten':
+        print(flatten(ftx_client))
+        recorder.close()
+        return
+
+    markets = [args.underlier + "/USD", args.underlier + "-PERP"]
+    order_stream = FtxWebsocketClient(api_key=FTX_API_KEY, api_secret=FTX_API_SECRET, subaccount_name=SUBACCOUNT_NAME,
+                                      markets=markets).start()
+    rate_store = RateStore(ftx_client)
+    journal = TradeJournal(config.get('JOURNAL_PATH') or 'trades.journal')
+
+    def make_trade(underlier: str, trade_size: float) -> DeltaNeutralTrade:
+        return DeltaNeutralTrade(underlier, ftx_client, trade_size, order_stream=order_stream,
+                                 book_cache=order_stream.books, rate_store=rate_store, journal=journal,
+                                 hedge_mode='chase' if args.mode == 'chase' else 'market',
+                                 quoter=AdaptiveQuoter() if args.adaptive_quotes else None)
+
+    try:
+        # finish whatever a previous run left open before starting anything new
+        for state in journal.open_trades().values():
+            make_trade(state['underlier'], state['trade_size']).resume(state)
+        journal.compact()
+
+        trade_object = make_trade(args.underlier, args.size)
+        pnls = {}
+        if args.mode in ('maker', 'chase', 'compare'):
+            print("Running strategy")
+            pnls['Strategy'] = trade_object.trade()
+        if args.mode in ('market', 'compare'):
+            print("Running market orders only")
+            pnls['Market Order'] = trade_object.trade_market_orders()
+
+        print("Results:")
+        for name, pnl in pnls.items():
+            print(name + " PnL: " + str(round(pnl, 5)))
+        print("Rate store: " + str(rate_store.stats()))
+        print("Rate limiter: " + str(ftx_client.rate_limiter.stats()))
+        print(ftx_client.metrics.format_summary())
+    finally:
+        recorder.close()
+        journal.close()
+        order_stream.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import time
+import urllib.parse
+from typing import TYPE_CHECKING, Optional, Dict, Any, List
+
+import hmac
+
+from codec import json_dumps, json_loads
+from metrics import Metrics, endpoint_name
+from ratelimit import RateLimiter, request_priority
+
+if TYPE_CHECKING:
+    from requests import PreparedRequest, Response
+
+    from recorder import Recorder
+
+
+class FtxClient:
+    """
+    This class was taken from FTX sample code with a few functions added/removed as needed
+    """
+    _ENDPOINT = 'https://ftx.com/api/'
+
+    def __init__(self, api_key=None, api_secret=None, subaccount_name=None, endpoint=None,
+                 rate_limiter: Optional[RateLimiter] = None, metrics: Optional[Metrics] = None,
+                 recorder: Optional['Recorder'] = None) -> None:
+        # requests is only imported once a client is made, so importing this module stays cheap
+        import requests
+        self._session = requests.Session()
+        self._new_request = requests.Request
+        self._endpoint = endpoint or self._ENDPOINT
+        self._api_key = api_key
+        self._api_secret = api_secret
+        self._subaccount_name = subaccount_name
+        # keyed once, each signature works on a copy
+        self._hmac = hmac.new(api_secret.encode(), digestmod='sha256') if api_secret else None
+        # every request waits for a token, cancels/hedges ahead of orders ahead of data
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # latency of every request per endpoint, split into queue/sign/network/decode
+        self.metrics = metrics or Metrics()
+        # quotes, rates, orders & fills of every response are appended here if given
+        self.recorder = recorder
+
+    def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return self._request('GET', path, params=params)
+
+    def _post(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return self._request('POST', path, json=params)
+
+    def _delete(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        return self._request('DELETE', path, json=params)
+
+    def _request(self, method: str, path: str, **kwargs) -> Any:
+        start = time.perf_counter()
+        self.rate_limiter.acquire(request_priority(method, path, kwargs.get('json')))
+        queued = time.perf_counter()
+        prepared = self._prepare_request(method, path, **kwargs)
+        signed = time.perf_counter()
+        response = self._session.send(prepared)
+        received = time.perf_counter()
+        try:
+            result = self._process_response(response)
+        finally:
+            done = time.perf_counter()
+            self.metrics.record_request(endpoint_name(method, path), {
+                'queue': queued - start, 'sign': signed - queued, 'network': received - signed,
+                'decode': done - received, 'total': done - start})
+        if self.recorder is not None:
+            self.recorder.record_response(method, path, result)
+        return result
+
+    def _prepare_request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                         json: Optional[Dict[str, Any]] = None) -> 'PreparedRequest':
+        """Serialize the body, prepare and sign a request, each exactly once
+        """
+        headers = {}
+        body = None
+        if json is not None:
+            body = json_dumps(json)
+            headers['Content-Type'] = 'application/json'
+        prepared = self._new_request(method, self._endpoint + path, params=params, data=body, headers=headers).prepare()
+        self._sign_request(prepared)
+        return prepared
+
+    def _sign_request(self, prepared: 'PreparedRequest') -> None:
+        ts = int(time.time() * 1000)
+        signature_payload = f'{ts}{prepared.method}{prepared.path_url}'.encode(
+        )
+        if prepared.body:
+            signature_payload += prepared.body
+        signature = self._hmac.copy()
+        signature.update(signature_payload)
+        prepared.headers['FTX-KEY'] = self._api_key
+        prepared.headers['FTX-SIGN'] = signature.hexdigest()
+        prepared.headers['FTX-TS'] = str(ts)
+        if self._subaccount_name:
+            prepared.headers['FTX-SUBACCOUNT'] = urllib.parse.quote(
+                self._subaccount_name)
+
+    def _process_response(self, response: 'Response') -> Any:
+        try:
+            data = json_loads(response.content)
+        except ValueError:
+            response.raise_for_status()
+            raise
+        else:
+            if not data['success']:
+                raise Exception(data['error'])
+            return data['result']
+
+    def get_future(self, future_name: str = None) -> dict:
+        return self._get(f'futures/{future_name}')
+
+    def get_all_futures(self) -> List[dict]:
+        return self._get('futures')
+
+    def get_order_status(self, order_id: str = None) -> List[dict]:
+        return self._get(f'orders', {'order_id': order_id})
+
+    def get_order(self, order_id: str) -> dict:
+        return self._get(f'orders/{order_id}')
+
+    def modify_order(
+        self, existing_order_id: Optional[str] = None,
+        existing_client_order_id: Optional[str] = None, price: Optional[float] = None,
+        size: Optional[float] = None, client_order_id: Optional[str] = None,
+    ) -> dict:
+        assert (existing_order_id is None) ^ (existing_client_order_id is None), \
+            'Must supply exactly one ID for the order to modify'
+        assert (price is None) or (
+            size is None), 'Must modify price or size of order'
+        path = f'orders/{existing_order_id}/modify' if existing_order_id is not None else \
+            f'orders/by_client_id/{existing_client_order_id}/modify'
+        return self._post(path, {
+            **({'size': size} if size is not None else {}),
+            **({'price': price} if price is not None else {}),
+            ** ({'clientId': client_order_id} if client_order_id is not None else {}),
+        })
+
+    def place_order(self, market: str, side: str, price: float, size: float, type: str = 'limit',
+                    reduce_only: bool = False, ioc: bool = False, post_only: bool = False,
+                    client_id: str = None, reject_after_ts: float = None) -> dict:
+        return self._post('orders', {
+            'market': market,
+            'side': side,
+            'price': price,
+            'size': size,
+            'type': type,
+            'reduceOnly': reduce_only,
+            'ioc': ioc,
+            'postOnly': post_only,
+            'clientId': client_id,
+            'rejectAfterTs': reject_after_ts
+        })
+
+    def cancel_order(self, order_id: str) -> dict:
+        return self._delete(f'orders/{order_id}')
+
+    def cancel_orders(self, market_name: str = None, conditional_orders: bool = False,
+                      limit_orders: bool = False) -> dict:
+        return self._delete('orders', {'market': market_name,
+                                       **({'conditionalOrdersOnly': True} if conditional_orders else {}),
+                                       **({'limitOrdersOnly': True} if limit_orders else {})})
+
+    def get_fills(self, market: str = None, start_time: float = None,
+                  end_time: float = None, min_id: int = None, order_id: int = None
+                  ) -> List[dict]:
+        return self._get('fills', {
+            'market': market,
+            'start_time': start_time,
+            'end_time': end_time,
+            'minId': min_id,
+            'orderId': order_id
+        })
+
+    def get_borrow_rates(self) -> List[dict]:
+        return self._get('spot_margin/borrow_rates')
+
+    def get_lending_rates(self) -> List[dict]:
+        return self._get('spot_margin/lending_rates')
+
+    def get_future_stats(self, future_name: str) -> dict:
+        return self._get(f'futures/{future_name}/stats')
+
+    def get_single_market(self, market: str = None) -> Dict:
+        return self._get(f'markets/{market}')
+    
+    def get_positions(self, show_avg_price: bool = False) -> List[dict]:
+        return self._get('positions', {'showAvgPrice': show_avg_price})
+    
+    def get_balances(self) -> List[dict]:
+        return self._get('wallet/balances')
@@ -0,0 +1,18 @@
+"""
+JSON encoding/decoding for request bodies and responses. Uses orjson when it is
+installed, the stdlib json module otherwise; either way json_dumps returns bytes
+"""
+try:
+    import orjson
+
+    def json_dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+
+    json_loads = orjson.loads
+except ImportError:
+    import json
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+    json_loads = json.loads
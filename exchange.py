@@ -0,0 +1,91 @@
+"""
+The interface the async strategy engine (AsyncDeltaNeutralTrade, Portfolio,
+flatten_async and the fill readers) is written against. Markets are named the
+FTX way ("ETH/USD" spot, "ETH-PERP" perp) whatever the venue calls them, orders,
+fills and quotes come back as dicts under FTX's field names and times are unix
+seconds, so the engine runs unchanged on AsyncFtxClient or AsyncBybitClient
+"""
+from typing import List, Optional, Protocol, runtime_checkable
+
+from metrics import Metrics
+from ratelimit import RateLimiter
+
+
+@runtime_checkable
+class AsyncExchange(Protocol):
+    # every request goes through these, see ratelimit.py and metrics.py
+    rate_limiter: RateLimiter
+    metrics: Metrics
+
+    async def close(self) -> None:
+        ...
+
+    async def get_future(self, future_name: str = None) -> dict:
+        """Perp quote, e.g. get_future("ETH-PERP")
+        """
+        ...
+
+    async def get_single_market(self, market: str = None) -> dict:
+        """Spot quote, e.g. get_single_market("ETH/USD")
+        """
+        ...
+
+    async def get_future_stats(self, future_name: str) -> dict:
+        """{'nextFundingRate': rate} of a perp
+        """
+        ...
+
+    async def get_borrow_rates(self) -> List[dict]:
+        """[{'coin', 'previous', 'estimate'}] spot borrow rate per coin
+        """
+        ...
+
+    async def get_lending_rates(self) -> List[dict]:
+        """[{'coin', 'previous', 'estimate'}] spot lending rate per coin
+        """
+        ...
+
+    async def place_order(self, market: str, side: str, price: float, size: float, type: str = 'limit',
+                          reduce_only: bool = False, ioc: bool = False, post_only: bool = False,
+                          client_id: str = None, reject_after_ts: float = None) -> dict:
+        ...
+
+    async def get_order_status(self, order_id: str = None) -> List[dict]:
+        """Every open order
+        """
+        ...
+
+    async def get_order(self, order_id: str) -> dict:
+        ...
+
+    async def modify_order(self, existing_order_id: Optional[str] = None,
+                           existing_client_order_id: Optional[str] = None, price: Optional[float] = None,
+                           size: Optional[float] = None, client_order_id: Optional[str] = None) -> dict:
+        """Move an order's price or size, returns the order that now rests (which may have a new id)
+        """
+        ...
+
+    async def cancel_order(self, order_id: str) -> dict:
+        ...
+
+    async def cancel_orders(self, market_name: str = None, conditional_orders: bool = False,
+                            limit_orders: bool = False) -> dict:
+        ...
+
+    async def get_fills(self, market: str = None, start_time: float = None, end_time: float = None,
+                        min_id: int = None, order_id: int = None) -> List[dict]:
+        """Fills matching the filters, newest first, bounds inclusive, at most a page:
+        nothing newer than the oldest fill returned is left out, so the fill readers can
+        page on from there
+        """
+        ...
+
+    async def get_positions(self, show_avg_price: bool = False) -> List[dict]:
+        """[{'future', 'netSize'}] per perp
+        """
+        ...
+
+    async def get_balances(self) -> List[dict]:
+        """[{'coin', 'total', 'free'}] per coin, USD for the quote currency
+        """
+        ...
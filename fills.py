@@ -0,0 +1,360 @@
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# sizes come back as floats, rounding shouldn't keep us waiting on a fill that is complete
+SIZE_TOLERANCE = 1e-9
+
+# most fills the fills endpoint returns for one request, a shorter page is the last one
+FILLS_PAGE_SIZE = 100
+
+
+class FillTimeoutError(Exception):
+    """
+    Raised when the fills of an order don't add up to the size we expect by the deadline
+    """
+
+
+class FillLedger:
+    """
+    Every fill we have seen, stored once per fill id and indexed by order id and
+    market. Running size, notional and fee totals are kept per order and per trade
+    leg (e.g. 'long_open'), so reading a leg's fill costs nothing however long the
+    account's fill history is. A leg can be made up of several orders, like a
+    maker order that was part filled and the market order that finished it
+    """
+
+    def __init__(self) -> None:
+        self._fill_ids = set()
+        self._by_order = defaultdict(list)
+        self._by_market = defaultdict(list)
+        # order id / leg -> [size, notional, fee]
+        self._order_totals = defaultdict(lambda: [0.0, 0.0, 0.0])
+        self._leg_totals = {}
+        self._leg_orders = {}
+        self._order_legs = {}
+
+    def add(self, fill: dict) -> bool:
+        """Record a fill, fills already seen are ignored
+
+        Args:
+            fill (dict): fill as returned by get_fills or pushed on the fills channel
+
+        Returns:
+            bool: false if the fill was a duplicate
+        """
+        fill_id = fill.get('id')
+        if fill_id is not None:
+            if fill_id in self._fill_ids:
+                return False
+            self._fill_ids.add(fill_id)
+
+        order_id = fill['orderId']
+        self._by_order[order_id].append(fill)
+        self._by_market[fill['market']].append(fill)
+        self._add_to(self._order_totals[order_id], fill)
+        leg = self._order_legs.get(order_id)
+        if leg is not None:
+            self._add_to(self._leg_totals[leg], fill)
+        return True
+
+    def add_all(self, fills: Iterable[dict]) -> int:
+        """Record a batch of fills
+
+        Returns:
+            int: number of fills that were new
+        """
+        return sum(self.add(fill) for fill in fills)
+
+    @staticmethod
+    def _add_to(totals: list, fill: dict) -> None:
+        totals[0] += fill['size']
+        totals[1] += fill['price'] * fill['size']
+        totals[2] += fill['fee']
+
+    def assign(self, order_id: Any, leg: str) -> None:
+        """Count an order's fills towards a trade leg, fills already recorded for it are
+        included unless the order was counted towards a different leg before
+
+        Args:
+            order_id: id of the order
+            leg (str): leg name, e.g. 'long_open'
+        """
+        previous_leg = self._order_legs.get(order_id)
+        if previous_leg == leg:
+            return
+        totals = self._leg_totals.setdefault(leg, [0.0, 0.0, 0.0])
+        self._leg_orders.setdefault(leg, []).append(order_id)
+        self._order_legs[order_id] = leg
+        if previous_leg is None:
+            for fill in self._by_order.get(order_id, ()):
+                self._add_to(totals, fill)
+
+    def clear_legs(self) -> None:
+        """Forget leg assignments before starting a new trade, recorded fills are kept
+        """
+        self._leg_totals = {}
+        self._leg_orders = {}
+        self._order_legs = {}
+
+    def fills_for_order(self, order_id: Any) -> List[dict]:
+        return list(self._by_order.get(order_id, ()))
+
+    def fills_for_market(self, market: str) -> List[dict]:
+        return list(self._by_market.get(market, ()))
+
+    def order_fill(self, order_id: Any) -> Optional[dict]:
+        """Aggregated fill of one order
+
+        Returns:
+            dict: size, VWAP price & fee of the order, None if it has no fills
+        """
+        if order_id not in self._by_order:
+            return None
+        return self._aggregate(self._order_totals[order_id], orderId=order_id)
+
+    def leg_fill(self, leg: str) -> Optional[dict]:
+        """Aggregated fill of every order assigned to a leg
+
+        Returns:
+            dict: size, VWAP price & fee of the leg plus its order ids, None if nothing filled
+        """
+        totals = self._leg_totals.get(leg)
+        if totals is None or totals[0] == 0:
+            return None
+        return self._aggregate(totals, orderIds=list(self._leg_orders[leg]))
+
+    @staticmethod
+    def _aggregate(totals: list, **extra) -> dict:
+        size, notional, fee = totals
+        return dict(extra, size=size, price=notional / size if size else None, fee=fee)
+
+
+def filled_size(fills: List[dict]) -> float:
+    return sum(fill['size'] for fill in fills)
+
+
+def _fill_time(fill: dict) -> Optional[float]:
+    fill_time = fill.get('time')
+    if isinstance(fill_time, str):
+        return datetime.fromisoformat(fill_time).timestamp()
+    return fill_time
+
+
+class _FillPager:
+    """
+    Walks the fills endpoint back in time a page at a time. The endpoint returns the
+    newest fills first, each next page ends at the oldest fill of the one before;
+    fills at that boundary come back again and are skipped by id, which is the only
+    state kept between pages
+    """
+
+    def __init__(self, start_time: Optional[float], end_time: Optional[float], page_size: int) -> None:
+        self.start_time = start_time
+        self.end_time = end_time
+        self.page_size = page_size
+        self.done = False
+        self.pages = 0
+        self._boundary_time = None
+        self._boundary_ids = set()
+
+    def window(self) -> Dict[str, float]:
+        # only the bounds that are set, so clients without them still work for a single page
+        window = {}
+        if self.start_time is not None:
+            window['start_time'] = self.start_time
+        if self.end_time is not None:
+            window['end_time'] = self.end_time
+        return window
+
+    def take(self, page: List[dict]) -> List[dict]:
+        """The fills of a page not seen on the page before, and where the next page ends
+        """
+        self.pages += 1
+        new_fills = [fill for fill in page if fill.get('id') is None or fill['id'] not in self._boundary_ids]
+        times = [_fill_time(fill) for fill in page]
+        if len(page) < self.page_size or not new_fills or None in times:
+            self.done = True
+            return new_fills
+
+        oldest = min(times)
+        if oldest != self._boundary_time:
+            self._boundary_time = oldest
+            self._boundary_ids = set()
+        self._boundary_ids.update(fill['id'] for fill, fill_time in zip(page, times) if fill_time == oldest)
+        self.end_time = oldest
+        if self.start_time is not None and oldest < self.start_time:
+            self.done = True
+        return new_fills
+
+
+def _fill_pages(ftx_client: object, market: Optional[str], order_id: Any, start_time: Optional[float],
+                end_time: Optional[float], page_size: int) -> Iterator[List[dict]]:
+    pager = _FillPager(start_time, end_time, page_size)
+    while not pager.done:
+        yield pager.take(ftx_client.get_fills(market, order_id=order_id, **pager.window()))
+
+
+async def _fill_pages_async(ftx_client: object, market: Optional[str], order_id: Any, start_time: Optional[float],
+                            end_time: Optional[float], page_size: int) -> AsyncIterator[List[dict]]:
+    pager = _FillPager(start_time, end_time, page_size)
+    while not pager.done:
+        yield pager.take(await ftx_client.get_fills(market, order_id=order_id, **pager.window()))
+
+
+def iter_fills(ftx_client: object, market: Optional[str] = None, order_id: Any = None,
+               start_time: Optional[float] = None, end_time: Optional[float] = None,
+               page_size: int = FILLS_PAGE_SIZE) -> Iterator[dict]:
+    """Fills matching the filters, newest first. Pages are only requested as the
+    fills are consumed, so stopping early (e.g. once an order's size is accounted
+    for) saves the requests for the rest, and only one page is held at a time
+
+    Args:
+        ftx_client (object): ftx client object
+        market (str): market the fills are on, every market by default
+        order_id: only this order's fills
+        start_time (float): seconds since the epoch of the oldest fill wanted
+        end_time (float): seconds since the epoch of the newest fill wanted
+        page_size (int): fills the endpoint returns per request at most
+
+    Returns:
+        iterator of fills
+    """
+    for page in _fill_pages(ftx_client, market, order_id, start_time, end_time, page_size):
+        yield from page
+
+
+async def iter_fills_async(ftx_client: object, market: Optional[str] = None, order_id: Any = None,
+                           start_time: Optional[float] = None, end_time: Optional[float] = None,
+                           page_size: int = FILLS_PAGE_SIZE) -> AsyncIterator[dict]:
+    """Async generator version of iter_fills for an AsyncFtxClient
+    """
+    async for page in _fill_pages_async(ftx_client, market, order_id, start_time, end_time, page_size):
+        for fill in page:
+            yield fill
+
+
+def read_fills(ftx_client: object, market: Optional[str] = None, order_id: Any = None,
+               size: Optional[float] = None, start_time: Optional[float] = None,
+               end_time: Optional[float] = None, page_size: int = FILLS_PAGE_SIZE) -> List[dict]:
+    """Fills of an order (or a time window), no more pages are requested once
+    size is accounted for
+
+    Args:
+        size (float): size expected to be filled, every page is read without it
+        see iter_fills for the rest
+
+    Returns:
+        list: fills, newest first
+    """
+    fills, filled = [], 0.0
+    # whole pages, so fills past the expected size on the last one are kept too
+    for page in _fill_pages(ftx_client, market, order_id, start_time, end_time, page_size):
+        fills += page
+        filled += filled_size(page)
+        if size is not None and filled >= size - SIZE_TOLERANCE:
+            break
+    return fills
+
+
+async def read_fills_async(ftx_client: object, market: Optional[str] = None, order_id: Any = None,
+                           size: Optional[float] = None, start_time: Optional[float] = None,
+                           end_time: Optional[float] = None, page_size: int = FILLS_PAGE_SIZE) -> List[dict]:
+    """Coroutine version of read_fills for an AsyncFtxClient
+    """
+    fills, filled = [], 0.0
+    async for page in _fill_pages_async(ftx_client, market, order_id, start_time, end_time, page_size):
+        fills += page
+        filled += filled_size(page)
+        if size is not None and filled >= size - SIZE_TOLERANCE:
+            break
+    return fills
+
+
+def _expected_sizes(expected_fills: Dict[Any, Tuple[str, float]]) -> Dict[Any, float]:
+    return {order_id: size for order_id, (market, size) in expected_fills.items()}
+
+
+def _still_outstanding(outstanding: Dict[Any, Tuple[str, float]], order_ids: List[Any], fills: List[List[dict]],
+                       fill_ledger: Optional[FillLedger]) -> Dict[Any, Tuple[str, float]]:
+    """Orders whose fills don't add up to their expected size yet, the fills read are kept
+    in the ledger if there is one so update_fills needn't ask for them again
+    """
+    if fill_ledger is not None:
+        for order_fills in fills:
+            fill_ledger.add_all(order_fills)
+    return {order_id: outstanding[order_id] for order_id, order_fills in zip(order_ids, fills)
+            if filled_size(order_fills) < outstanding[order_id][1] - SIZE_TOLERANCE}
+
+
+def wait_for_fills(ftx_client: object, expected_fills: Dict[Any, Tuple[str, float]], timeout: float = 10,
+                   poll_interval: float = .05, order_stream: object = None,
+                   clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep,
+                   fill_ledger: Optional[FillLedger] = None) -> float:
+    """Block until the fills endpoint shows the full expected size for every order,
+    so update_fills can run straight away instead of after a fixed sleep.
+    With a connected order stream we wait on the pushed fills first and only
+    ask the fills endpoint once they are in
+
+    Args:
+        ftx_client (object): ftx client object
+        expected_fills (dict): order id -> (market, size we expect to be filled)
+        timeout (float): seconds to wait at most
+        poll_interval (float): seconds between fills requests
+        order_stream (FtxWebsocketClient): optional orders/fills stream
+        clock (callable): returns monotonic time in seconds
+        sleep (callable): sleeps for the given seconds
+        fill_ledger (FillLedger): optional ledger the fills read while waiting are added to
+
+    Raises:
+        FillTimeoutError: some orders still short of their size at the deadline
+
+    Returns:
+        float: seconds waited
+    """
+    start = clock()
+    deadline = start + timeout
+    outstanding = dict(expected_fills)
+
+    while True:
+        if order_stream is not None and order_stream.connected:
+            # short slices so a dropped stream doesn't hold us past the next fills request
+            order_stream.tracker.wait_for_sizes(_expected_sizes(outstanding),
+                                                max(0, min(1, deadline - clock())))
+
+        order_ids = list(outstanding)
+        fills = [read_fills(ftx_client, market, order_id, size) for order_id, (market, size) in outstanding.items()]
+        outstanding = _still_outstanding(outstanding, order_ids, fills, fill_ledger)
+        if not outstanding:
+            return clock() - start
+        if clock() >= deadline:
+            raise FillTimeoutError(f"Fills for orders {list(outstanding)} not confirmed after {timeout}s")
+        sleep(poll_interval)
+
+
+async def wait_for_fills_async(ftx_client: object, expected_fills: Dict[Any, Tuple[str, float]],
+                               timeout: float = 10, poll_interval: float = .05,
+                               order_stream: object = None, fill_ledger: Optional[FillLedger] = None) -> float:
+    """Coroutine version of wait_for_fills for an AsyncFtxClient, the
+    fills of every order are requested at the same time
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    outstanding = dict(expected_fills)
+
+    while True:
+        if order_stream is not None and order_stream.connected:
+            await order_stream.tracker.wait_for_sizes_async(_expected_sizes(outstanding),
+                                                            max(0, min(1, deadline - time.monotonic())))
+
+        order_ids = list(outstanding)
+        fills = await asyncio.gather(*[read_fills_async(ftx_client, market, order_id, size)
+                                       for order_id, (market, size) in outstanding.items()])
+        outstanding = _still_outstanding(outstanding, order_ids, fills, fill_ledger)
+        if not outstanding:
+            return time.monotonic() - start
+        if time.monotonic() >= deadline:
+            raise FillTimeoutError(f"Fills for orders {list(outstanding)} not confirmed after {timeout}s")
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,101 @@
+"""
+Emergency flatten: pull every resting order and take every position off at once.
+Every order is cancelled first, so nothing can fill after positions and balances
+are read, then both reads go out together, then every offsetting market order goes
+out together, so the whole thing costs about three round trips however many
+underliers are open
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Iterable
+
+from fills import SIZE_TOLERANCE
+
+
+def offsetting_orders(positions: List[dict], balances: List[dict],
+                      underliers: Optional[Iterable[str]] = None) -> List[dict]:
+    """Market orders that take the perp positions and spot balances of the underliers to zero
+
+    Args:
+        positions (list): get_positions result
+        balances (list): get_balances result
+        underliers (list): coins to flatten, every coin with an open perp position by default
+
+    Returns:
+        list: place_order arguments, one per market
+    """
+    open_positions = [position for position in positions
+                      if position['future'].endswith('-PERP') and abs(position['netSize']) > SIZE_TOLERANCE]
+    if underliers is None:
+        underliers = {position['future'][:-len('-PERP')] for position in open_positions}
+    underliers = set(underliers)
+
+    orders = []
+    for position in open_positions:
+        if position['future'][:-len('-PERP')] in underliers:
+            orders.append({'market': position['future'], 'side': "sell" if position['netSize'] > 0 else "buy",
+                           'price': None, 'size': abs(position['netSize']), 'type': 'market', 'reduce_only': True})
+    for balance in balances:
+        if balance['coin'] in underliers and abs(balance['total']) > SIZE_TOLERANCE:
+            orders.append({'market': balance['coin'] + "/USD", 'side': "sell" if balance['total'] > 0 else "buy",
+                           'price': None, 'size': abs(balance['total']), 'type': 'market'})
+    return orders
+
+
+def _report(start: float, cancelled: float, orders: List[dict], results: list) -> Dict:
+    report = {'cancel_and_read_seconds': cancelled - start, 'offset_seconds': time.perf_counter() - cancelled,
+              'total_seconds': time.perf_counter() - start, 'orders': [], 'errors': []}
+    for order_args, (order, error) in zip(orders, results):
+        if error is None:
+            report['orders'].append(order)
+        else:
+            report['errors'].append(order_args['market'] + ": " + str(error))
+    for error in report['errors']:
+        print("Flatten order failed, " + error)
+    return report
+
+
+def _place(ftx_client: object, order_args: dict) -> tuple:
+    try:
+        return ftx_client.place_order(**order_args), None
+    except Exception as error:
+        return None, error
+
+
+def flatten(ftx_client: object, underliers: Optional[Iterable[str]] = None, max_workers: int = 16) -> Dict:
+    """Cancel every resting order and send offsetting market orders for every position, in parallel
+
+    Args:
+        ftx_client (object): ftx client object
+        underliers (list): coins to flatten, every coin with an open perp position by default.
+            Orders are cancelled on every market either way
+        max_workers (int): requests on the wire at once
+
+    Returns:
+        dict: offsetting orders sent, orders that failed and how long each phase took
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # a resting order filling after the reads would be left unhedged
+        ftx_client.cancel_orders()
+        positions = executor.submit(ftx_client.get_positions)
+        balances = executor.submit(ftx_client.get_balances)
+        orders = offsetting_orders(positions.result(), balances.result(), underliers)
+        cancelled = time.perf_counter()
+        results = list(executor.map(lambda order_args: _place(ftx_client, order_args), orders))
+    return _report(start, cancelled, orders, results)
+
+
+async def flatten_async(ftx_client: object, underliers: Optional[Iterable[str]] = None) -> Dict:
+    """Coroutine version of flatten for an AsyncFtxClient
+    """
+    start = time.perf_counter()
+    await ftx_client.cancel_orders()
+    positions, balances = await asyncio.gather(ftx_client.get_positions(), ftx_client.get_balances())
+    orders = offsetting_orders(positions, balances, underliers)
+    cancelled = time.perf_counter()
+    results = await asyncio.gather(*[ftx_client.place_order(**order_args) for order_args in orders],
+                                   return_exceptions=True)
+    results = [(None, result) if isinstance(result, Exception) else (result, None) for result in results]
+    return _report(start, cancelled, orders, results)
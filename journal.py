@@ -0,0 +1,154 @@
+import itertools
+import os
+import threading
+import time
+from typing import Optional, Dict, Any
+
+from codec import json_dumps, json_loads
+
+# trades in these steps need nothing more done. A close that timed out is journaled as close_cancelled
+# instead, the position is still on and resume closes it again
+FINISHED_STEPS = ('closed', 'cancelled', 'abandoned')
+
+
+class TradeJournal:
+    """
+    Append-only log of every lifecycle transition of every trade, one json record
+    per line. Each record is written to the file straight away, so a crashed
+    process loses nothing; fsyncs (what protects against losing the machine)
+    are batched, every sync_every records or sync_interval seconds, whichever
+    comes first. open_trades() folds the log back into the state of every
+    trade that hadn't finished, which DeltaNeutralTrade.resume carries on from
+    """
+
+    def __init__(self, path: str, sync_every: int = 16, sync_interval: float = .05) -> None:
+        """Initialize journal, appending to the file if it exists
+
+        Args:
+            path (str): journal file
+            sync_every (int): records written before an fsync
+            sync_interval (float): longest seconds a written record goes without an fsync,
+                checked whenever a record is written
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self.syncs = 0
+
+    def __enter__(self) -> 'TradeJournal':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def new_trade_id(self, underlier: str) -> str:
+        return f"{underlier}-{int(time.time() * 1000)}-{os.getpid()}-{next(self._ids)}"
+
+    def record(self, trade_id: str, event: str, **data: Any) -> None:
+        """Append a lifecycle transition
+
+        Args:
+            trade_id (str): trade it belongs to, from new_trade_id
+            event (str): started, placed, hedged, filled, closed, cancelled or abandoned
+            **data: whatever the transition needs to resume from it
+        """
+        line = json_dumps(dict(data, trade=trade_id, event=event, time=time.time())) + b'\n'
+        with self._lock:
+            os.write(self._fd, line)
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+                self._sync()
+
+    def _sync(self) -> None:
+        os.fsync(self._fd)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self.syncs += 1
+
+    def sync(self) -> None:
+        with self._lock:
+            if self._unsynced:
+                self._sync()
+
+    def close(self) -> None:
+        if self._fd is None:
+            return
+        self.sync()
+        os.close(self._fd)
+        self._fd = None
+
+    def open_trades(self) -> Dict[str, Dict]:
+        """Replay the journal into the latest state of every trade that hasn't finished
+
+        Returns:
+            dict: trade id -> state, see apply_record
+        """
+        trades = {}
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # torn last write, the process died mid record
+                    break
+                record = json_loads(line)
+                trades[record['trade']] = apply_record(trades.get(record['trade']), record)
+        return {trade_id: state for trade_id, state in trades.items() if state['step'] not in FINISHED_STEPS}
+
+    def compact(self) -> None:
+        """Rewrite the journal with only the records of unfinished trades, so it stays
+        quick to replay. Not safe while other processes append to the same file
+        """
+        open_ids = set(self.open_trades())
+        tmp_path = self.path + '.tmp'
+        with self._lock, open(self.path, 'rb') as f, open(tmp_path, 'wb') as tmp:
+            for line in f:
+                if line.endswith(b'\n') and json_loads(line)['trade'] in open_ids:
+                    tmp.write(line)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+            os.replace(tmp_path, self.path)
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._unsynced = 0
+
+
+def apply_record(state: Optional[Dict], record: Dict) -> Dict:
+    """Fold one journal record into a trade's state
+
+    Args:
+        state (dict): state so far, None for the first record of a trade
+        record (dict): journal record
+
+    Returns:
+        dict: trade_id, underlier, trade_size, market_orders, long_spot, stage (open or close),
+            step (started, placed, hedged, filled, close_cancelled or one of FINISHED_STEPS), long_order & short_order
+            (ids of the orders last placed), maker_chains ((order id, size filled before it) of every
+            maker order each leg went through), trade_orders (order id -> market), pending_fills
+            (order id -> (market, size)), fills (leg -> fill) and pnl once closed
+    """
+    event = record['event']
+    if event == 'started':
+        return {'trade_id': record['trade'], 'underlier': record['underlier'], 'trade_size': record['trade_size'],
+                'market_orders': record['market_orders'], 'long_spot': record['long_spot'], 'stage': 'open',
+                'step': 'started', 'long_order': None, 'short_order': None, 'maker_chains': None, 'trade_orders': {},
+                'pending_fills': {}, 'fills': {}, 'pnl': None}
+
+    state = dict(state, step=event)
+    if event == 'placed':
+        state['stage'] = 'open' if record['opening'] else 'close'
+        state['long_order'], state['short_order'] = record['long_order'], record['short_order']
+        state['maker_chains'] = record.get('maker_chains')
+        state['trade_orders'] = {order_id: market for order_id, market in record['trade_orders']}
+        state['pending_fills'] = {order_id: (market, size) for order_id, market, size in record['pending_fills']}
+    elif event == 'hedged':
+        state['trade_orders'] = {order_id: market for order_id, market in record['trade_orders']}
+        state['pending_fills'] = {order_id: (market, size) for order_id, market, size in record['pending_fills']}
+    elif event == 'filled':
+        state['fills'] = dict(state['fills'], **record['fills'])
+    elif event == 'closed':
+        state['pnl'] = record['pnl']
+    return state
@@ -0,0 +1,308 @@
+import hmac
+from typing import Optional, Dict, Any, List
+
+from aiohttp import web
+
+from codec import json_loads
+from local_exchange import LocalFtxExchange
+
+
+def _symbol(market: str) -> str:
+    return market.split('/')[0] + 'USDT' if '/' in market else market[:-len('-PERP')] + 'USDT'
+
+
+def _text(value: Any) -> str:
+    return ('true' if value else 'false') if isinstance(value, bool) else str(value)
+
+
+class LocalBybitExchange(LocalFtxExchange):
+    """
+    LocalFtxExchange behind the Bybit USDT perpetual and spot v1 REST endpoints
+    AsyncBybitClient uses, signed and enveloped the way Bybit does it. The state
+    underneath is LocalFtxExchange's (the ETHUSDT perp is "ETH-PERP", the ETHUSDT
+    spot market "ETH/USD" and USDT is USD), so tests set markets up and fill
+    orders exactly as they do there. Order ids are its integer ids as strings
+    """
+    # no signature on market data
+    PUBLIC_PATHS = {'/v2/public/tickers', '/spot/quote/v1/ticker/book_ticker', '/spot/v1/symbols'}
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def _add_routes(self, router: web.UrlDispatcher) -> None:
+        router.add_get('/v2/public/tickers', self._perp_ticker)
+        router.add_get('/spot/quote/v1/ticker/book_ticker', self._spot_ticker)
+        router.add_get('/spot/v1/symbols', self._spot_symbols)
+        router.add_post('/private/linear/order/create', self._perp_create)
+        router.add_get('/private/linear/order/search', self._perp_search)
+        router.add_post('/private/linear/order/replace', self._perp_replace)
+        router.add_post('/private/linear/order/cancel', self._perp_cancel)
+        router.add_post('/private/linear/order/cancel-all', self._perp_cancel_all)
+        router.add_get('/private/linear/trade/execution/list', self._perp_executions)
+        router.add_get('/private/linear/position/list', self._perp_positions)
+        router.add_post('/spot/v1/order', self._spot_place)
+        router.add_get('/spot/v1/order', self._spot_order)
+        router.add_delete('/spot/v1/order', self._spot_cancel)
+        router.add_get('/spot/v1/open-orders', self._spot_open_orders)
+        router.add_delete('/spot/order/batch-cancel', self._spot_batch_cancel)
+        router.add_get('/spot/v1/myTrades', self._spot_trades)
+        router.add_get('/spot/v1/account', self._spot_account)
+
+    def _check_signature(self, request: web.Request, body: bytes) -> bool:
+        if request.path in self.PUBLIC_PATHS:
+            return True
+        params = self._params(request, body)
+        sign = params.pop('sign', '')
+        payload = '&'.join(f'{k}={_text(params[k])}' for k in sorted(params))
+        expected = hmac.new(self.api_secret.encode(), payload.encode(), 'sha256').hexdigest()
+        return params.get('api_key') == self.api_key and hmac.compare_digest(sign, expected)
+
+    @staticmethod
+    def _params(request: web.Request, body: bytes = b'') -> Dict[str, Any]:
+        # linear POSTs send a json body, everything else the query string
+        params = dict(request.query)
+        if body:
+            params.update(json_loads(body))
+        return params
+
+    def _result(self, result: Any) -> web.Response:
+        return web.json_response({'ret_code': 0, 'ret_msg': 'OK', 'result': result})
+
+    def _error(self, error: str, status: int = 200) -> web.Response:
+        # bybit answers errors with a 200 and a non zero ret_code
+        return web.json_response({'ret_code': 10001, 'ret_msg': error, 'result': None})
+
+    def _open_order(self, order_id: Any, market_type: str) -> Optional[Dict]:
+        order = self.orders.get(int(order_id)) if str(order_id).isdigit() else None
+        if order is None or (order['market'] in self.futures) != (market_type == 'perp'):
+            return None
+        return order
+
+    def _perp_view(self, order: Dict) -> Dict:
+        if order['status'] == 'closed':
+            status = 'Filled' if order['remainingSize'] <= 0 else 'Cancelled'
+        else:
+            status = 'PartiallyFilled' if order['filledSize'] else 'New'
+        return {
+            'order_id': str(order['id']),
+            'symbol': _symbol(order['market']),
+            'side': order['side'].capitalize(),
+            'order_type': order['type'].capitalize(),
+            'price': order['price'] or 0,
+            'qty': order['size'],
+            'time_in_force': 'PostOnly' if order.get('postOnly') else
+            'ImmediateOrCancel' if order.get('ioc') else 'GoodTillCancel',
+            'order_status': status,
+            'cum_exec_qty': order['filledSize'],
+            'cum_exec_value': (order['avgFillPrice'] or 0) * order['filledSize'],
+            'order_link_id': order.get('clientId') or '',
+        }
+
+    def _spot_view(self, order: Dict) -> Dict:
+        if order['status'] == 'closed':
+            status = 'FILLED' if order['remainingSize'] <= 0 else 'CANCELED'
+        else:
+            status = 'PARTIALLY_FILLED' if order['filledSize'] else 'NEW'
+        return {
+            'orderId': str(order['id']),
+            'orderLinkId': order.get('clientId') or '',
+            'symbol': _symbol(order['market']),
+            'price': str(order['price'] or 0),
+            'origQty': str(order['size']),
+            'executedQty': str(order['filledSize']),
+            'cummulativeQuoteQty': str((order['avgFillPrice'] or 0) * order['filledSize']),
+            'status': status,
+            'timeInForce': 'IOC' if order.get('ioc') else 'GTC',
+            'type': 'MARKET' if order['type'] == 'market' else 'LIMIT_MAKER' if order.get('postOnly') else 'LIMIT',
+            'side': order['side'].upper(),
+            'time': str(int(order['createdAt'] * 1000)),
+        }
+
+    def _close(self, order: Dict) -> None:
+        order['status'] = 'closed'
+        self._publish('orders', order)
+
+    def _fills_in(self, request: web.Request, market_type: str, start: str, end: str, limit: int) -> List[Dict]:
+        params = self._params(request)
+        fills = [fill for fill in reversed(self.fills) if (fill['market'] in self.futures) == (market_type == 'perp')]
+        if 'symbol' in params:
+            fills = [fill for fill in fills if _symbol(fill['market']) == params['symbol']]
+        if 'order_id' in params:
+            fills = [fill for fill in fills if str(fill['orderId']) == params['order_id']]
+        # newest first, millisecond bounds inclusive
+        if start in params:
+            fills = [fill for fill in fills if int(fill['time'] * 1000) >= int(params[start])]
+        if end in params:
+            fills = [fill for fill in fills if int(fill['time'] * 1000) <= int(params[end])]
+        return fills[:min(int(params.get('limit', limit)), self.fills_page_size)]
+
+    async def _perp_ticker(self, request: web.Request) -> web.Response:
+        market = request.query['symbol'][:-len('USDT')] + '-PERP'
+        future = self.futures[market]
+        return self._result([{
+            'symbol': request.query['symbol'],
+            'bid_price': str(future['bid']),
+            'ask_price': str(future['ask']),
+            'last_price': str(future['bid']),
+            'mark_price': str((future['bid'] + future['ask']) / 2),
+            'predicted_funding_rate': str(self.future_stats[market]['nextFundingRate']),
+        }])
+
+    async def _spot_ticker(self, request: web.Request) -> web.Response:
+        market = request.query['symbol'][:-len('USDT')] + '/USD'
+        quote = self.markets[market]
+        bids, asks = self._book_levels(market)
+        return self._result({
+            'symbol': request.query['symbol'],
+            'bidPrice': str(quote['bid']),
+            'bidQty': str(bids[0][1] if bids else 0),
+            'askPrice': str(quote['ask']),
+            'askQty': str(asks[0][1] if asks else 0),
+        })
+
+    async def _spot_symbols(self, request: web.Request) -> web.Response:
+        return self._result([{'name': _symbol(market), 'baseCurrency': market.split('/')[0], 'quoteCurrency': 'USDT',
+                              'minPricePrecision': '0.01'} for market in self.markets])
+
+    async def _perp_create(self, request: web.Request) -> web.Response:
+        params = await request.json()
+        market = params['symbol'][:-len('USDT')] + '-PERP'
+        if market in self.rejected_markets:
+            return self._error('Order rejected')
+        order = self._add_order({
+            'market': market,
+            'side': params['side'].lower(),
+            'price': params.get('price'),
+            'size': params['qty'],
+            'type': params['order_type'].lower(),
+            'postOnly': params.get('time_in_force') == 'PostOnly',
+            'ioc': params.get('time_in_force') == 'ImmediateOrCancel',
+            'clientId': params.get('order_link_id'),
+        })
+        return self._result(self._perp_view(order))
+
+    async def _perp_search(self, request: web.Request) -> web.Response:
+        if 'order_id' in request.query:
+            order = self._open_order(request.query['order_id'], 'perp')
+            if order is None:
+                return self._error('Order not exists')
+            return self._result(self._perp_view(order))
+        return self._result([self._perp_view(order) for order in self.orders.values()
+                             if order['status'] != 'closed' and order['market'] in self.futures
+                             and _symbol(order['market']) == request.query['symbol']])
+
+    async def _perp_replace(self, request: web.Request) -> web.Response:
+        params = await request.json()
+        order = self._open_order(params['order_id'], 'perp')
+        if order is None or order['status'] == 'closed':
+            return self._error('order not exists or too late to replace')
+        if params.get('p_r_price') is not None:
+            order['price'] = params['p_r_price']
+        if params.get('p_r_qty') is not None:
+            order['size'] = params['p_r_qty']
+            order['remainingSize'] = order['size'] - order['filledSize']
+        self._publish('orders', order)
+        return self._result({'order_id': str(order['id'])})
+
+    async def _perp_cancel(self, request: web.Request) -> web.Response:
+        params = await request.json()
+        order = self._open_order(params['order_id'], 'perp')
+        if order is None or order['status'] == 'closed':
+            return self._error('order not exists or too late to cancel')
+        self._close(order)
+        return self._result({'order_id': str(order['id'])})
+
+    async def _perp_cancel_all(self, request: web.Request) -> web.Response:
+        params = await request.json()
+        cancelled = []
+        for order in self.orders.values():
+            if order['status'] != 'closed' and order['market'] in self.futures \
+                    and _symbol(order['market']) == params['symbol']:
+                self._close(order)
+                cancelled.append(str(order['id']))
+        return self._result(cancelled)
+
+    async def _perp_executions(self, request: web.Request) -> web.Response:
+        return self._result({'current_page': 1, 'data': [{
+            'exec_id': str(fill['id']),
+            'order_id': str(fill['orderId']),
+            'symbol': _symbol(fill['market']),
+            'side': fill['side'].capitalize(),
+            'exec_price': fill['price'],
+            'exec_qty': fill['size'],
+            'exec_fee': fill['fee'],
+            'last_liquidity_ind': 'AddedLiquidity' if fill['liquidity'] == 'maker' else 'RemovedLiquidity',
+            'trade_time_ms': int(fill['time'] * 1000),
+        } for fill in self._fills_in(request, 'perp', 'start_time', 'end_time', 200)] or None})
+
+    async def _perp_positions(self, request: web.Request) -> web.Response:
+        return self._result([{'is_valid': True, 'data': {
+            'symbol': _symbol(position['future']),
+            'side': 'None' if not position['netSize'] else 'Buy' if position['netSize'] > 0 else 'Sell',
+            'size': abs(position['netSize']),
+        }} for position in self.positions])
+
+    async def _spot_place(self, request: web.Request) -> web.Response:
+        params = request.query
+        market = params['symbol'][:-len('USDT')] + '/USD'
+        if market in self.rejected_markets:
+            return self._error('Order rejected')
+        order = self._add_order({
+            'market': market,
+            'side': params['side'].lower(),
+            'price': float(params['price']) if 'price' in params else None,
+            'size': float(params['qty']),
+            'type': 'market' if params['type'] == 'MARKET' else 'limit',
+            'postOnly': params['type'] == 'LIMIT_MAKER',
+            'ioc': params.get('timeInForce') == 'IOC',
+            'clientId': params.get('orderLinkId'),
+        })
+        return self._result(self._spot_view(order))
+
+    async def _spot_order(self, request: web.Request) -> web.Response:
+        order = self._open_order(request.query['orderId'], 'spot')
+        if order is None:
+            return self._error('Order does not exist')
+        return self._result(self._spot_view(order))
+
+    async def _spot_cancel(self, request: web.Request) -> web.Response:
+        order = self._open_order(request.query['orderId'], 'spot')
+        if order is None or order['status'] == 'closed':
+            return self._error('Order does not exist')
+        self._close(order)
+        return self._result(self._spot_view(order))
+
+    async def _spot_open_orders(self, request: web.Request) -> web.Response:
+        return self._result([self._spot_view(order) for order in self.orders.values()
+                             if order['status'] != 'closed' and order['market'] in self.markets
+                             and request.query.get('symbol') in (None, _symbol(order['market']))])
+
+    async def _spot_batch_cancel(self, request: web.Request) -> web.Response:
+        for order in self.orders.values():
+            if order['status'] != 'closed' and order['market'] in self.markets \
+                    and _symbol(order['market']) == request.query['symbolId']:
+                self._close(order)
+        return self._result({'success': True})
+
+    async def _spot_trades(self, request: web.Request) -> web.Response:
+        return self._result([{
+            'id': str(fill['id']),
+            'symbol': _symbol(fill['market']),
+            'orderId': str(fill['orderId']),
+            'price': str(fill['price']),
+            'qty': str(fill['size']),
+            'commission': str(fill['fee']),
+            'commissionAsset': 'USDT',
+            'isBuyer': fill['side'] == 'buy',
+            'isMaker': fill['liquidity'] == 'maker',
+            'time': str(int(fill['time'] * 1000)),
+        } for fill in self._fills_in(request, 'spot', 'startTime', 'endTime', 500)])
+
+    async def _spot_account(self, request: web.Request) -> web.Response:
+        return self._result({'balances': [{
+            'coin': 'USDT' if balance['coin'] == 'USD' else balance['coin'],
+            'total': str(balance['total']),
+            'free': str(balance.get('free', balance['total'])),
+            'locked': '0',
+        } for balance in self.balances]})
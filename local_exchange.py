@@ -0,0 +1,481 @@
+import asyncio
+import hmac
+import threading
+import time
+from collections import defaultdict
+from typing import Optional, Dict, Any
+
+from aiohttp import web, WSMsgType
+
+from fills import FILLS_PAGE_SIZE
+from orderbook import book_checksum
+
+
+class LocalFtxExchange:
+    """
+    In-memory stand-in for the FTX REST API, served over real HTTP on localhost
+    so FtxClient and AsyncFtxClient can be exercised end to end without touching
+    the exchange. Runs on its own event loop in a background thread
+    """
+
+    def __init__(self, api_key: str = 'key', api_secret: str = 'secret', latency: float = 0.0) -> None:
+        """Initialize the stand-in exchange
+
+        Args:
+            api_key (str): api key requests must be signed with
+            api_secret (str): api secret requests must be signed with
+            latency (float): seconds to delay every response by, to mimic network RTT
+        """
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.latency = latency
+
+        self.borrow_rates = [{'coin': 'ETH', 'previous': .001, 'estimate': .001}]
+        self.lending_rates = [{'coin': 'ETH', 'previous': .002, 'estimate': .002}]
+        self.markets = {'ETH/USD': {'name': 'ETH/USD', 'bid': 1078.4, 'ask': 1078.9}}
+        self.futures = {'ETH-PERP': {'name': 'ETH-PERP', 'underlying': 'ETH', 'type': 'perpetual',
+                                     'bid': 1078.8, 'ask': 1078.9}}
+        self.future_stats = {'ETH-PERP': {'nextFundingRate': .003}}
+        self.positions = []
+        self.balances = []
+        self.orders = {}
+        self.fills = []
+        self.fills_page_size = FILLS_PAGE_SIZE
+        # orders sent to these markets are rejected, to exercise error paths
+        self.rejected_markets = set()
+
+        # bookkeeping so tests can assert on what the clients actually sent
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        # market -> {'bids': {price: size}, 'asks': {price: size}} served on the orderbook channel
+        self.books = {}
+
+        # (channel, market) -> websockets subscribed to it
+        self._subscribers = defaultdict(set)
+        self._websockets = set()
+
+        self._next_order_id = 1
+        self._next_fill_id = 1
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self.port = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/api/'
+
+    @property
+    def ws_url(self) -> str:
+        return f'ws://127.0.0.1:{self.port}/ws/'
+
+    def start(self) -> 'LocalFtxExchange':
+        """Start serving on a free localhost port, returns once the server is listening
+        """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_site())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self) -> None:
+        """Shut the server down and join its thread
+        """
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self) -> 'LocalFtxExchange':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    async def _start_site(self) -> None:
+        app = web.Application(middlewares=[self._middleware])
+        self._add_routes(app.router)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def _add_routes(self, router: web.UrlDispatcher) -> None:
+        router.add_get('/ws/', self._websocket)
+        router.add_get('/api/spot_margin/borrow_rates', self._borrow_rates)
+        router.add_get('/api/spot_margin/lending_rates', self._lending_rates)
+        router.add_get('/api/futures', self._all_futures)
+        router.add_get('/api/futures/{name}/stats', self._future_stats)
+        router.add_get('/api/futures/{name}', self._future)
+        router.add_get('/api/markets/{base}/{quote}', self._market)
+        router.add_get('/api/orders', self._open_orders)
+        router.add_get('/api/orders/{order_id}', self._order)
+        router.add_post('/api/orders', self._place_order)
+        router.add_post('/api/orders/{order_id}/modify', self._modify_order)
+        router.add_delete('/api/orders/{order_id}', self._cancel_order)
+        router.add_delete('/api/orders', self._cancel_orders)
+        router.add_get('/api/fills', self._get_fills)
+        router.add_get('/api/positions', self._get_positions)
+        router.add_get('/api/wallet/balances', self._get_balances)
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.Response:
+        if request.path == '/ws/':
+            return await handler(request)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            body = await request.read()
+            self.requests.append((request.method, request.path_qs, time.monotonic()))
+            if not self._check_signature(request, body):
+                return self._error('Not logged in', status=401)
+            # half the round trip on the way in, half on the way out
+            await self._network_delay()
+            response = await handler(request)
+            await self._network_delay()
+            return response
+        finally:
+            self.in_flight -= 1
+
+    async def _network_delay(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency / 2)
+
+    def _check_signature(self, request: web.Request, body: bytes) -> bool:
+        ts = request.headers.get('FTX-TS', '')
+        payload = f'{ts}{request.method}{request.raw_path}'.encode() + body
+        expected = hmac.new(self.api_secret.encode(), payload, 'sha256').hexdigest()
+        return request.headers.get('FTX-KEY') == self.api_key and \
+            hmac.compare_digest(request.headers.get('FTX-SIGN', ''), expected)
+
+    async def _websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._websockets.add(ws)
+        logged_in = False
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    break
+                message = message.json()
+                if message['op'] == 'login':
+                    args = message['args']
+                    expected = hmac.new(self.api_secret.encode(), f"{args['time']}websocket_login".encode(),
+                                        'sha256').hexdigest()
+                    logged_in = args['key'] == self.api_key and hmac.compare_digest(args['sign'], expected)
+                elif message['op'] == 'ping':
+                    await ws.send_json({'type': 'pong'})
+                elif message['op'] == 'subscribe':
+                    if message['channel'] in ('orders', 'fills') and not logged_in:
+                        await ws.send_json({'type': 'error', 'code': 400, 'msg': 'Not logged in'})
+                        continue
+                    market = message.get('market')
+                    self._subscribers[(message['channel'], market)].add(ws)
+                    await ws.send_json({'type': 'subscribed', 'channel': message['channel'], 'market': market})
+                    if message['channel'] == 'orderbook':
+                        await ws.send_json(self._book_message(market, 'partial', *self._book_levels(market)))
+                elif message['op'] == 'unsubscribe':
+                    self._subscribers[(message['channel'], message.get('market'))].discard(ws)
+                    await ws.send_json({'type': 'unsubscribed', 'channel': message['channel'],
+                                        'market': message.get('market')})
+        finally:
+            self._websockets.discard(ws)
+            for subscribers in self._subscribers.values():
+                subscribers.discard(ws)
+        return ws
+
+    def _publish(self, channel: str, data: Dict, market: Optional[str] = None) -> None:
+        # may be called from the test thread, so hop onto the server loop
+        message = {'channel': channel, 'market': market, 'type': 'update', 'data': dict(data)}
+        self._loop.call_soon_threadsafe(self._broadcast, (channel, market), message)
+
+    def _broadcast(self, key: tuple, message: Dict) -> None:
+        for ws in list(self._subscribers[key]):
+            self._loop.create_task(ws.send_json(message))
+
+    def _book_levels(self, market: str) -> tuple:
+        book = self.books.get(market, {'bids': {}, 'asks': {}})
+        return ([[price, size] for price, size in sorted(book['bids'].items(), reverse=True)],
+                [[price, size] for price, size in sorted(book['asks'].items())])
+
+    def _book_message(self, market: str, action: str, bids: list, asks: list, checksum: Optional[int] = None) -> Dict:
+        if checksum is None:
+            checksum = book_checksum(*self._book_levels(market))
+        return {'channel': 'orderbook', 'market': market, 'type': action,
+                'data': {'action': action, 'bids': bids, 'asks': asks, 'checksum': checksum, 'time': time.time()}}
+
+    def set_book(self, market: str, bids: list, asks: list) -> None:
+        """Replace a market's book and send subscribers a partial
+
+        Args:
+            market (str): market name
+            bids: [price, size] levels
+            asks: [price, size] levels
+        """
+        self.books[market] = {'bids': dict(map(tuple, bids)), 'asks': dict(map(tuple, asks))}
+        self._update_top(market)
+        message = self._book_message(market, 'partial', *self._book_levels(market))
+        self._loop.call_soon_threadsafe(self._broadcast, ('orderbook', market), message)
+
+    def update_book(self, market: str, bids: list = (), asks: list = (), bad_checksum: bool = False) -> None:
+        """Change some levels of a market's book (size 0 removes the level) and send subscribers the update
+
+        Args:
+            market (str): market name
+            bids: changed [price, size] bid levels
+            asks: changed [price, size] ask levels
+            bad_checksum (bool): send a wrong checksum, to exercise client resyncs
+        """
+        book = self.books[market]
+        for side, levels in ((book['bids'], bids), (book['asks'], asks)):
+            for price, size in levels:
+                if size == 0:
+                    side.pop(price, None)
+                else:
+                    side[price] = size
+        self._update_top(market)
+        checksum = book_checksum(*self._book_levels(market))
+        message = self._book_message(market, 'update', [list(level) for level in bids],
+                                     [list(level) for level in asks], checksum + 1 if bad_checksum else checksum)
+        self._loop.call_soon_threadsafe(self._broadcast, ('orderbook', market), message)
+
+    def _update_top(self, market: str) -> None:
+        # keep the REST quotes in line with the streamed book
+        book = self.books[market]
+        quote = self.markets.get(market) or self.futures.get(market)
+        if quote is not None:
+            quote['bid'] = max(book['bids']) if book['bids'] else None
+            quote['ask'] = min(book['asks']) if book['asks'] else None
+
+    def _update_holdings(self, market: str, size: float, price: float) -> None:
+        # perp fills move the position, spot fills the coin and USD balances
+        if market in self.futures:
+            position = next((position for position in self.positions if position['future'] == market), None)
+            if position is None:
+                position = {'future': market, 'netSize': 0.0}
+                self.positions.append(position)
+            position['netSize'] += size
+            position['size'] = abs(position['netSize'])
+            position['side'] = 'buy' if position['netSize'] >= 0 else 'sell'
+            return
+        coin, quote = market.split('/')
+        for balance_coin, change in ((coin, size), (quote, -size * price)):
+            balance = next((balance for balance in self.balances if balance['coin'] == balance_coin), None)
+            if balance is None:
+                balance = {'coin': balance_coin, 'total': 0.0}
+                self.balances.append(balance)
+            balance['total'] += change
+            balance['free'] = balance['total']
+
+    def disconnect_websockets(self) -> None:
+        """Drop every open websocket, to exercise client reconnects and fallbacks
+        """
+        async def close_all():
+            for ws in list(self._websockets):
+                await ws.close()
+        asyncio.run_coroutine_threadsafe(close_all(), self._loop).result()
+
+    def _result(self, result: Any) -> web.Response:
+        return web.json_response({'success': True, 'result': result})
+
+    def _error(self, error: str, status: int = 400) -> web.Response:
+        return web.json_response({'success': False, 'error': error}, status=status)
+
+    async def _borrow_rates(self, request: web.Request) -> web.Response:
+        return self._result(self.borrow_rates)
+
+    async def _lending_rates(self, request: web.Request) -> web.Response:
+        return self._result(self.lending_rates)
+
+    async def _future_stats(self, request: web.Request) -> web.Response:
+        return self._result(self.future_stats[request.match_info['name']])
+
+    async def _all_futures(self, request: web.Request) -> web.Response:
+        return self._result(list(self.futures.values()))
+
+    async def _future(self, request: web.Request) -> web.Response:
+        return self._result(self.futures[request.match_info['name']])
+
+    async def _market(self, request: web.Request) -> web.Response:
+        name = request.match_info['base'] + '/' + request.match_info['quote']
+        return self._result(self.markets[name])
+
+    async def _open_orders(self, request: web.Request) -> web.Response:
+        return self._result([order for order in self.orders.values() if order['status'] != 'closed'])
+
+    async def _order(self, request: web.Request) -> web.Response:
+        order = self.orders.get(int(request.match_info['order_id']))
+        if order is None:
+            return self._error('Order not found', status=404)
+        return self._result(order)
+
+    async def _place_order(self, request: web.Request) -> web.Response:
+        params = await request.json()
+        if params['market'] in self.rejected_markets:
+            return self._error('Order rejected')
+        return self._result(dict(self._add_order(params)))
+
+    def _add_order(self, params: Dict) -> Dict:
+        # params are the FTX place_order body
+        order = {
+            'id': self._next_order_id,
+            'market': params['market'],
+            'side': params['side'],
+            'price': params['price'],
+            'size': params['size'],
+            'type': params['type'],
+            'postOnly': params.get('postOnly', False),
+            'clientId': params.get('clientId'),
+            'status': 'open',
+            'filledSize': 0,
+            'remainingSize': params['size'],
+            'avgFillPrice': None,
+            'ioc': params.get('ioc', False),
+            'createdAt': time.time(),
+        }
+        self._next_order_id += 1
+        self.orders[order['id']] = order
+        self._publish('orders', order)
+        self._order_placed(order)
+        return order
+
+    def _order_placed(self, order: Dict) -> None:
+        # market orders take the touch immediately
+        quote = self.markets.get(order['market']) or self.futures[order['market']]
+        touch = quote['ask'] if order['side'] == 'buy' else quote['bid']
+        if order['type'] == 'market':
+            self.fill_order(order['id'], price=touch)
+        elif order.get('ioc'):
+            # ioc limits take the touch if they reach it, whatever is left is cancelled
+            if touch is not None and (order['price'] >= touch if order['side'] == 'buy' else order['price'] <= touch):
+                self.fill_order(order['id'], price=touch)
+            if order['status'] != 'closed':
+                order['status'] = 'closed'
+                self._publish('orders', order)
+
+    async def _modify_order(self, request: web.Request) -> web.Response:
+        order = self.orders.get(int(request.match_info['order_id']))
+        if order is None or order['status'] == 'closed':
+            return self._error('Order already closed')
+        params = await request.json()
+        order['status'] = 'closed'
+        self._publish('orders', order)
+        new_order = dict(order, id=self._next_order_id, status='open',
+                         price=params.get('price', order['price']),
+                         size=params.get('size', order['size']), createdAt=time.time())
+        new_order['remainingSize'] = new_order['size'] - new_order['filledSize']
+        self._next_order_id += 1
+        self.orders[new_order['id']] = new_order
+        self._publish('orders', new_order)
+        self._order_placed(new_order)
+        return self._result(dict(new_order))
+
+    async def _cancel_order(self, request: web.Request) -> web.Response:
+        order = self.orders.get(int(request.match_info['order_id']))
+        if order is None or order['status'] == 'closed':
+            return self._error('Order already closed')
+        order['status'] = 'closed'
+        self._publish('orders', order)
+        return self._result('Order queued for cancellation')
+
+    async def _cancel_orders(self, request: web.Request) -> web.Response:
+        params = await request.json() if request.body_exists else {}
+        for order in self.orders.values():
+            if order['status'] != 'closed' and params.get('market') in (None, order['market']):
+                order['status'] = 'closed'
+                self._publish('orders', order)
+        return self._result('Orders queued for cancellation')
+
+    async def _get_fills(self, request: web.Request) -> web.Response:
+        fills = [fill for fill in reversed(self.fills)
+                 if request.query.get('market') in (None, fill['market'])]
+        if 'orderId' in request.query:
+            fills = [fill for fill in fills if str(fill['orderId']) == request.query['orderId']]
+        # newest first, bounds inclusive, at most a page like FTX
+        if 'start_time' in request.query:
+            fills = [fill for fill in fills if fill['time'] >= float(request.query['start_time'])]
+        if 'end_time' in request.query:
+            fills = [fill for fill in fills if fill['time'] <= float(request.query['end_time'])]
+        return self._result(fills[:self.fills_page_size])
+
+    async def _get_positions(self, request: web.Request) -> web.Response:
+        return self._result(self.positions)
+
+    async def _get_balances(self, request: web.Request) -> web.Response:
+        return self._result(self.balances)
+
+    def list_underlier(self, coin: str, spot_quote: tuple = (1078.4, 1078.9), perp_quote: tuple = (1078.8, 1078.9),
+                       funding_rate: float = .003, borrow_rate: float = .001, lending_rate: float = .002) -> None:
+        """Add a coin with a spot market, a perp and borrow/lending rates
+
+        Args:
+            coin (str): coin name, e.g. 'BTC'
+            spot_quote (tuple): spot bid & ask
+            perp_quote (tuple): perp bid & ask
+            funding_rate (float): next perp funding rate
+            borrow_rate (float): spot borrow rate
+            lending_rate (float): spot lending rate
+        """
+        self.markets[coin + '/USD'] = {'name': coin + '/USD', 'bid': spot_quote[0], 'ask': spot_quote[1]}
+        self.futures[coin + '-PERP'] = {'name': coin + '-PERP', 'underlying': coin, 'type': 'perpetual',
+                                        'bid': perp_quote[0], 'ask': perp_quote[1]}
+        self.future_stats[coin + '-PERP'] = {'nextFundingRate': funding_rate}
+        self.borrow_rates.append({'coin': coin, 'previous': borrow_rate, 'estimate': borrow_rate})
+        self.lending_rates.append({'coin': coin, 'previous': lending_rate, 'estimate': lending_rate})
+
+    def fill_order(self, order_id: int, size: Optional[float] = None, price: Optional[float] = None,
+                   fee: float = 0.0) -> Dict:
+        """Fill some or all of a resting order, as if it traded on the exchange
+
+        Args:
+            order_id (int): id of the order to fill
+            size (float): size to fill, defaults to the remaining size
+            price (float): fill price, defaults to the order's limit price
+            fee (float): fee charged on the fill
+
+        Returns:
+            dict: the fill that was recorded
+        """
+        order = self.orders[order_id]
+        size = order['remainingSize'] if size is None else size
+        price = order['price'] if price is None else price
+
+        filled = order['filledSize'] + size
+        order['avgFillPrice'] = ((order['avgFillPrice'] or 0) * order['filledSize'] + price * size) / filled
+        order['filledSize'] = filled
+        order['remainingSize'] = order['size'] - filled
+        if order['remainingSize'] <= 0:
+            order['status'] = 'closed'
+
+        fill = {
+            'id': self._next_fill_id,
+            'orderId': order_id,
+            'market': order['market'],
+            'side': order['side'],
+            'price': price,
+            'size': size,
+            'fee': fee,
+            'liquidity': 'taker' if order['type'] == 'market' or order.get('ioc') else 'maker',
+            'time': time.time(),
+        }
+        self._next_fill_id += 1
+        self.fills.append(fill)
+        self._update_holdings(order['market'], size if order['side'] == 'buy' else -size, price)
+        self._publish('fills', fill)
+        self._publish('orders', order)
+        return fill
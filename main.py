@@ -1,138 +1,28 @@
-from audioop import add
 import time
-import urllib.parse
-from dotenv import dotenv_values
-from typing import Optional, Dict, Any, List
-from xmlrpc.client import Boolean
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple, Callable
 
-from requests import Request, Session, Response
-import hmac
+from client import FtxClient
+from fills import SIZE_TOLERANCE, FillLedger, FillTimeoutError, filled_size, read_fills, wait_for_fills
+from journal import TradeJournal
+from metrics import Metrics
+from orderbook import OrderBookCache, StaleQuoteError
+from quoting import AdaptiveQuoter
+from rates import RateStore
 
+if TYPE_CHECKING:
+    from streams import FtxWebsocketClient
 
-class FtxClient:
+
+class LegRejectedError(Exception):
     """
-    This class was taken from FTX sample code with a few functions added/removed as needed
+    Raised when one or both legs of an order pair are rejected, any leg that
+    did go through has already been cancelled or unwound when this is raised
     """
-    _ENDPOINT = 'https://ftx.com/api/'
-
-    def __init__(self, api_key=None, api_secret=None, subaccount_name=None) -> None:
-        self._session = Session()
-        self._api_key = api_key
-        self._api_secret = api_secret
-        self._subaccount_name = subaccount_name
-
-    def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        return self._request('GET', path, params=params)
-
-    def _post(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        return self._request('POST', path, json=params)
-
-    def _delete(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
-        return self._request('DELETE', path, json=params)
-
-    def _request(self, method: str, path: str, **kwargs) -> Any:
-        request = Request(method, self._ENDPOINT + path, **kwargs)
-        self._sign_request(request)
-        response = self._session.send(request.prepare())
-        return self._process_response(response)
-
-    def _sign_request(self, request: Request) -> None:
-        ts = int(time.time() * 1000)
-        prepared = request.prepare()
-        signature_payload = f'{ts}{prepared.method}{prepared.path_url}'.encode(
-        )
-        if prepared.body:
-            signature_payload += prepared.body
-        signature = hmac.new(self._api_secret.encode(),
-                             signature_payload, 'sha256').hexdigest()
-        request.headers['FTX-KEY'] = self._api_key
-        request.headers['FTX-SIGN'] = signature
-        request.headers['FTX-TS'] = str(ts)
-        if self._subaccount_name:
-            request.headers['FTX-SUBACCOUNT'] = urllib.parse.quote(
-                self._subaccount_name)
-
-    def _process_response(self, response: Response) -> Any:
-        try:
-            data = response.json()
-        except ValueError:
-            response.raise_for_status()
-            raise
-        else:
-            if not data['success']:
-                raise Exception(data['error'])
-            return data['result']
-
-    def get_future(self, future_name: str = None) -> dict:
-        return self._get(f'futures/{future_name}')
-
-    def get_order_status(self, order_id: str = None) -> List[dict]:
-        return self._get(f'orders', {'order_id': order_id})
-
-    def modify_order(
-        self, existing_order_id: Optional[str] = None,
-        existing_client_order_id: Optional[str] = None, price: Optional[float] = None,
-        size: Optional[float] = None, client_order_id: Optional[str] = None,
-    ) -> dict:
-        assert (existing_order_id is None) ^ (existing_client_order_id is None), \
-            'Must supply exactly one ID for the order to modify'
-        assert (price is None) or (
-            size is None), 'Must modify price or size of order'
-        path = f'orders/{existing_order_id}/modify' if existing_order_id is not None else \
-            f'orders/by_client_id/{existing_client_order_id}/modify'
-        return self._post(path, {
-            **({'size': size} if size is not None else {}),
-            **({'price': price} if price is not None else {}),
-            ** ({'clientId': client_order_id} if client_order_id is not None else {}),
-        })
-
-    def place_order(self, market: str, side: str, price: float, size: float, type: str = 'limit',
-                    reduce_only: bool = False, ioc: bool = False, post_only: bool = False,
-                    client_id: str = None, reject_after_ts: float = None) -> dict:
-        return self._post('orders', {
-            'market': market,
-            'side': side,
-            'price': price,
-            'size': size,
-            'type': type,
-            'reduceOnly': reduce_only,
-            'ioc': ioc,
-            'postOnly': post_only,
-            'clientId': client_id,
-            'rejectAfterTs': reject_after_ts
-        })
-
-    def cancel_order(self, order_id: str) -> dict:
-        return self._delete(f'orders/{order_id}')
-
-    def get_fills(self, market: str = None, start_time: float = None,
-                  end_time: float = None, min_id: int = None, order_id: int = None
-                  ) -> List[dict]:
-        return self._get('fills', {
-            'market': market,
-            'start_time': start_time,
-            'end_time': end_time,
-            'minId': min_id,
-            'orderId': order_id
-        })
-
-    def get_borrow_rates(self) -> List[dict]:
-        return self._get('spot_margin/borrow_rates')
-
-    def get_lending_rates(self) -> List[dict]:
-        return self._get('spot_margin/lending_rates')
-
-    def get_future_stats(self, future_name: str) -> dict:
-        return self._get(f'futures/{future_name}/stats')
-
-    def get_single_market(self, market: str = None) -> Dict:
-        return self._get(f'markets/{market}')
-    
-    def get_positions(self, show_avg_price: bool = False) -> List[dict]:
-        return self._get('positions', {'showAvgPrice': show_avg_price})
-    
-    def get_balances(self) -> List[dict]:
-        return self._get('wallet/balances')
+
+
+# seconds trade() used to sleep before reading fills, what the fill waits are measured against
+FIXED_FILL_WAIT = 2
 
 
 class DeltaNeutralTrade:
@@ -140,17 +30,90 @@ class DeltaNeutralTrade:
     Takes in an underlier, FTX Client object, & trade size
     """
 
-    def __init__(self, underlier: str, ftx_client: object, trade_size: int) -> None:
+    def __init__(self, underlier: str, ftx_client: object, trade_size: int,
+                 order_stream: Optional['FtxWebsocketClient'] = None,
+                 book_cache: Optional[OrderBookCache] = None, max_quote_age: float = 1,
+                 rate_store: Optional[RateStore] = None, fill_timeout: float = 10,
+                 metrics: Optional[Metrics] = None, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep, quote_offset: float = .0005,
+                 poll_interval: float = .1, order_timeout: float = 100,
+                 journal: Optional[TradeJournal] = None, hedge_mode: str = 'market',
+                 chase_deadline: float = 2, quoter: Optional[AdaptiveQuoter] = None) -> None:
         """Initialize Trade object
 
         Args:
             underlier (str): underlier to be traded 
             ftx_client (object): ftx client object
             trade_size (int): size of trade to be done
+            order_stream (FtxWebsocketClient): optional orders/fills stream, fill detection
+                falls back to REST polling without one (or while it is disconnected)
+            book_cache (OrderBookCache): optional streamed books to quote from, quotes
+                come from REST without one or when the cached book is stale
+            max_quote_age (float): oldest cached book in seconds we are willing to quote from
+            rate_store (RateStore): optional store shared between trades for borrow/lending
+                rates, the full rate lists are downloaded on every check without one
+            fill_timeout (float): longest we wait for fills to be confirmed before updating fills anyway
+            metrics (Metrics): where stage timings go, defaults to the client's metrics so
+                requests and stages of a run end up in one place
+            clock (callable): returns monotonic time in seconds, replaced with a virtual clock in backtests
+            sleep (callable): sleeps for the given seconds, advances the virtual clock in backtests
+            quote_offset (float): fraction maker orders are placed away from the screen price
+            poll_interval (float): seconds between open order checks while monitoring maker orders
+            order_timeout (float): seconds before unfilled maker orders are cancelled
+            journal (TradeJournal): optional journal every lifecycle transition is appended to,
+                so the trade can be resumed by another process
+            hedge_mode (str): how the leg left over after the first maker fill is finished,
+                'market' cancels it and takes the rest, 'chase' amends it to the touch on
+                every book move and only takes what is left after chase_deadline
+            chase_deadline (float): seconds the leftover leg is chased before taking liquidity
+            quoter (AdaptiveQuoter): optional quoter that places maker orders from the spread,
+                volatility and queue at the touch and re-quotes them while they rest,
+                in place of the fixed quote_offset
         """
         self.underlier = underlier
         self.ftx_client = ftx_client
         self.trade_size = trade_size
+        self.order_stream = order_stream
+        self.book_cache = book_cache
+        self.max_quote_age = max_quote_age
+        self.rate_store = rate_store
+
+        # one worker per leg so both orders are on the wire at the same time
+        self._leg_executor = ThreadPoolExecutor(max_workers=2)
+        self.leg_timing = None
+
+        self.fill_timeout = fill_timeout
+        # order id -> (market, size) we expect filled before reading fills
+        self.pending_fills = {}
+        # amends replace a maker order with a new id, (order id, size filled before it)
+        # of every order each leg went through, long leg first
+        self.maker_chains = None
+        self.fill_wait_times = []
+        self.fill_timeouts = []
+        # orders await_fills read complete fills of into the fill ledger, update_fills skips them
+        self.confirmed_orders = set()
+
+        # order id -> market of every order sent for the current open or close
+        self.trade_orders = {}
+        self.fill_ledger = FillLedger()
+
+        self.metrics = metrics or getattr(ftx_client, 'metrics', None) or Metrics()
+        self.clock = clock
+        self.sleep = sleep
+
+        self.quote_offset = quote_offset
+        self.poll_interval = poll_interval
+        self.order_timeout = order_timeout
+
+        self.journal = journal
+        self.trade_id = None
+
+        self.hedge_mode = hedge_mode
+        self.chase_deadline = chase_deadline
+        # how the last leftover leg was finished, see _record_hedge
+        self.hedge_stats = None
+
+        self.quoter = quoter
 
     def trade(self) -> float:
         """Entry point to start the delta neutral trade strategy
@@ -158,9 +121,15 @@ class DeltaNeutralTrade:
         Returns:
             float: PnL of executed trades
         """
+        self.fill_wait_times = []
+        self.fill_timeouts = []
+        self.fill_ledger.clear_legs()
+
         # check if we want to long spot or long perp
         print("Checking spot vs perp funding")
-        self.long_spot = self.check_spot_vs_perp()  
+        with self.metrics.stage('funding_check'):
+            self.long_spot = self.check_spot_vs_perp()
+        self._journal_start(market_orders=False)
 
         # start the opening order process
         print("Initiating opening trade")
@@ -168,18 +137,21 @@ class DeltaNeutralTrade:
 
         # start monitoring for one side of our trade getting filled     
         print("Starting to monitor for fills")
-        self.order_status_monitor(is_opening_trade=True)
+        with self.metrics.stage('monitor'):
+            self.order_status_monitor(is_opening_trade=True)
 
         # execute leftover on other trade
         print("Executing remaining opening order")
-        self.execute_leftover_order()
+        with self.metrics.stage('hedge'):
+            self.execute_leftover_order()
         
         print("Waiting for fills")
-        time.sleep(2)
+        self.await_fills()
 
         # update opening fills
         print("Updating fills")
-        self.update_fills(is_opening_trade=True)
+        with self.metrics.stage('fill_update'):
+            self.update_fills(is_opening_trade=True)
 
         print("Long Open Fill:")
         print(self.long_open_fill)
@@ -189,47 +161,61 @@ class DeltaNeutralTrade:
 
         # wait for trigger to exit the trade
         print("Waiting for exit condition")
-        self.wait_for_exit_condition()  
+        with self.metrics.stage('exit'):
+            self.wait_for_exit_condition()
 
         # close out of the position and go through same process
         print("Initiating close trade")
         self.initiate_trade(is_opening_trade=False)
         print("Starting to monitor for fills")
-        self.order_status_monitor(is_opening_trade=False)
+        with self.metrics.stage('monitor'):
+            self.order_status_monitor(is_opening_trade=False)
         print("Executing remaining closing order")
-        self.execute_leftover_order()
+        with self.metrics.stage('hedge'):
+            self.execute_leftover_order()
 
         print("Waiting for fills")
-        time.sleep(2)
+        self.await_fills()
 
         print("Updating closing fills")
-        self.update_fills(is_opening_trade=False)
+        with self.metrics.stage('fill_update'):
+            self.update_fills(is_opening_trade=False)
 
         print("Long Close Fill:")
         print(self.long_close_fill)
         print("Short Close Fill:")
         print(self.short_close_fill)
 
+        self._report_fill_wait_saved()
+
         print("Calculating trade pnl")
         print(self.calc_trade_pnl())
+        self._journal('closed', pnl=self.calc_trade_pnl())
         return self.calc_trade_pnl()
     
     def trade_market_orders(self) -> None:
+        self.fill_wait_times = []
+        self.fill_timeouts = []
+        self.fill_ledger.clear_legs()
+
         # check if we want to long spot or long perp
         print("Checking spot vs perp funding")
-        self.long_spot = self.check_spot_vs_perp()  
+        with self.metrics.stage('funding_check'):
+            self.long_spot = self.check_spot_vs_perp()
+        self._journal_start(market_orders=True)
 
         # enter market orders
         print("Initiating opening trade")
         self.initiate_trade_market_order(is_opening_trade=True)
 
-        # wait for fills, assuming 1s should be enough time to update     
+        # wait for fills to show up on the fills endpoint
         print("Waiting for orders to fill")
-        time.sleep(2)
+        self.await_fills()
 
         # update opening fills
         print("Updating fills")
-        self.update_fills(is_opening_trade=True)
+        with self.metrics.stage('fill_update'):
+            self.update_fills(is_opening_trade=True)
 
         print("Long Open Fill:")
         print(self.long_open_fill)
@@ -239,25 +225,30 @@ class DeltaNeutralTrade:
 
         # wait for trigger to exit the trade
         print("Waiting for exit condition")
-        self.wait_for_exit_condition()  
+        with self.metrics.stage('exit'):
+            self.wait_for_exit_condition()
 
         # close out of the position and go through same process
         print("Initiating close trade")
         self.initiate_trade_market_order(is_opening_trade=False)
 
         print("Waiting for fills")
-        time.sleep(2)
+        self.await_fills()
 
         print("Updating closing fills")
-        self.update_fills(is_opening_trade=False)
+        with self.metrics.stage('fill_update'):
+            self.update_fills(is_opening_trade=False)
 
         print("Long Close Fill:")
         print(self.long_close_fill)
         print("Short Close Fill:")
         print(self.short_close_fill)
 
+        self._report_fill_wait_saved()
+
         print("Calculating trade pnl")
         print(self.calc_trade_pnl())
+        self._journal('closed', pnl=self.calc_trade_pnl())
 
         return self.calc_trade_pnl()
 
@@ -268,34 +259,94 @@ class DeltaNeutralTrade:
         Args:
             is_opening_trade (bool): true if opening trade, false if closing
         """
-        long_limit = 0
-        short_limit = float('inf')
+        with self.metrics.stage('quote'):
+            self._select_markets(is_opening_trade)
+            long_price = self._maker_price(self.long_market, "buy")
+            short_price = self._maker_price(self.short_market, "sell")
+
+        with self.metrics.stage('place'):
+            self.long_order, self.short_order = self._place_order_pair(
+                {'market': self.long_market, 'side': "buy", 'price': long_price,
+                 'size': self.trade_size, 'type': 'limit', 'post_only': True},
+                {'market': self.short_market, 'side': "sell", 'price': short_price,
+                 'size': self.trade_size, 'type': 'limit', 'post_only': True})
+        self.maker_chains = [[(self.long_order['id'], 0.0)], [(self.short_order['id'], 0.0)]]
+        self.trade_orders = {self.long_order['id']: self.long_market, self.short_order['id']: self.short_market}
+        self._journal_placed(is_opening_trade)
 
-        # True if we are going long spot and opening, or are short spot and closing
-        if (self.long_spot and is_opening_trade) or (not self.long_spot and not is_opening_trade):
-            self.long_market = self.underlier + "/USD"
-            self.short_market = self.underlier + "-PERP"
-            long_limit = self.get_spot_quote()[0]
-            short_limit = self.get_perp_quote()[1]
-        else:
-            self.long_market = self.underlier + "-PERP"
-            self.short_market = self.underlier + "/USD"
-            long_limit = self.get_perp_quote()[0]
-            short_limit = self.get_spot_quote()[1]
-
-        #place buy order 5bps below screen bid
-        self.long_order = self.ftx_client.place_order(
-            self.long_market, "buy", long_limit*.9995, self.trade_size, 'limit', post_only=True)
-        
         print("Buy order placed")
         print(self.long_order)
-
-        #place sell order 5bps above screen ask
-        self.short_order = self.ftx_client.place_order(
-            self.short_market, "sell", short_limit*1.0005, self.trade_size, 'limit', post_only=True)
-        
         print("Sell order placed")
         print(self.short_order)
+        print("Legs placed " + str(round(self.leg_timing['ack_gap'] * 1000, 3)) + "ms apart")
+
+    def _maker_price(self, market: str, side: str) -> float:
+        """Limit price for a post only order, from the quoter if there is one. Otherwise
+        buy orders go quote_offset (5bps by default) below screen bid and sell orders
+        quote_offset above screen ask
+        """
+        bid, ask = self._market_quote(market)
+        return self._quoted_price(market, side, bid, ask)
+
+    def _quoted_price(self, market: str, side: str, bid: float, ask: float) -> float:
+        if self.quoter is None:
+            return bid*(1 - self.quote_offset) if side == "buy" else ask*(1 + self.quote_offset)
+        bid_size, ask_size = self._top_sizes(market)
+        return self.quoter.quote(market, side, bid, ask, bid_size, ask_size, self.trade_size)
+
+    def _requote_makers(self, is_opening_trade: bool) -> None:
+        """Amend any maker order the market has moved away from to where the quoter would place it now
+        """
+        requoted = False
+        for long_leg, market, side in ((True, self.long_market, "buy"), (False, self.short_market, "sell")):
+            order = self.long_order if long_leg else self.short_order
+            bid, ask = self._market_quote(market)
+            bid_size, ask_size = self._top_sizes(market)
+            price = self.quoter.requote(market, side, order['price'], bid, ask, bid_size, ask_size, self.trade_size)
+            if price is None:
+                continue
+            try:
+                order = self.ftx_client.modify_order(existing_order_id=order['id'], price=price)
+            except Exception as error:
+                # filled or closed while the amend was on the wire, the monitor picks that up
+                print("Requote failed: " + str(error))
+                continue
+            print(side + " order requoted to " + str(price))
+            self.trade_orders[order['id']] = market
+            self._extend_chain(self.maker_chains[0 if long_leg else 1], order)
+            if long_leg:
+                self.long_order = order
+            else:
+                self.short_order = order
+            requoted = True
+        if requoted:
+            self._journal_placed(is_opening_trade)
+
+    def _replace_rejected_makers(self, is_opening_trade: bool, long_order_id: Any, short_order_id: Any) -> None:
+        """Quotes at or inside the touch get cancelled as post only when the market moves
+        while they are on the wire. Legs that closed without filling anything are quoted
+        and placed again instead of being taken for fills
+        """
+        replaced = False
+        for long_leg, order_id, market, side in ((True, long_order_id, self.long_market, "buy"),
+                                                 (False, short_order_id, self.short_market, "sell")):
+            if (self.long_order if long_leg else self.short_order) is not None:
+                continue
+            if self.ftx_client.get_order(order_id)['filledSize'] > 0:
+                continue
+            order = self.ftx_client.place_order(market, side, self._maker_price(market, side), self.trade_size,
+                                                'limit', post_only=True)
+            print(side + " order closed unfilled, placed again")
+            self.trade_orders[order['id']] = market
+            # nothing filled on the rejected chain, the new order starts its own
+            self.maker_chains[0 if long_leg else 1] = [(order['id'], 0.0)]
+            if long_leg:
+                self.long_order = order
+            else:
+                self.short_order = order
+            replaced = True
+        if replaced:
+            self._journal_placed(is_opening_trade)
 
     def initiate_trade_market_order(self, is_opening_trade) -> None:
         """Place opposite sided taker orders
@@ -303,123 +354,612 @@ class DeltaNeutralTrade:
         Args:
             is_opening_trade (bool): true if opening trade, false if closing
         """
-        #True if we are going long spot and opening, or are short spot and closing
-        if (self.long_spot and is_opening_trade) or (not self.long_spot and not is_opening_trade):
-            self.long_market = self.underlier + "/USD"
-            self.short_market = self.underlier + "-PERP"
-        else:
-            self.long_market = self.underlier + "-PERP"
-            self.short_market = self.underlier + "/USD"
+        self._select_markets(is_opening_trade)
+
+        with self.metrics.stage('place'):
+            self.long_order, self.short_order = self._place_order_pair(
+                {'market': self.long_market, 'side': "buy", 'price': None,
+                 'size': self.trade_size, 'type': 'market'},
+                {'market': self.short_market, 'side': "sell", 'price': None,
+                 'size': self.trade_size, 'type': 'market'})
+        self.pending_fills = {self.long_order['id']: (self.long_market, self.trade_size),
+                              self.short_order['id']: (self.short_market, self.trade_size)}
+        self.trade_orders = {self.long_order['id']: self.long_market, self.short_order['id']: self.short_market}
+        self._journal_placed(is_opening_trade)
 
-        self.long_order = self.ftx_client.place_order(
-            self.long_market, "buy", None, self.trade_size, 'market')
-        
         print("Long order placed")
         print(self.long_order)
-
-        self.short_order = self.ftx_client.place_order(
-            self.short_market, "sell", None, self.trade_size, 'market')
-        
         print("Short order placed")
         print(self.short_order)
+        print("Legs placed " + str(round(self.leg_timing['ack_gap'] * 1000, 3)) + "ms apart")
+
+    def _place_order_pair(self, long_order_args: dict, short_order_args: dict) -> Tuple[dict, dict]:
+        """Send both legs of a trade at the same time and return them together.
+        If one leg is rejected the other is cancelled (or unwound if it was a
+        market order) so we are never left holding a single leg
+
+        Args:
+            long_order_args (dict): place_order arguments for the long leg
+            short_order_args (dict): place_order arguments for the short leg
+
+        Raises:
+            LegRejectedError: either leg was rejected
+
+        Returns:
+            tuple containing the long & short orders
+        """
+        long_future = self._leg_executor.submit(self._timed_place_order, long_order_args)
+        short_future = self._leg_executor.submit(self._timed_place_order, short_order_args)
+        long_result, short_result = long_future.result(), short_future.result()
+        self._record_leg_timing(long_result, short_result)
+
+        (long_order, long_error), (short_order, short_error) = long_result[0], short_result[0]
+        if long_error is None and short_error is None:
+            return long_order, short_order
+
+        # leg rejected, take the surviving leg back off
+        if long_error is None:
+            self._unwind_leg(long_order, long_order_args)
+        if short_error is None:
+            self._unwind_leg(short_order, short_order_args)
+        raise LegRejectedError(f"Long leg: {long_error}, short leg: {short_error}")
+
+    def _timed_place_order(self, order_args: dict) -> tuple:
+        """Place a single leg, catching any rejection so the pair can be resolved together
+
+        Returns:
+            tuple containing (order, error), send time & acknowledgement time
+        """
+        sent_at = time.perf_counter()
+        try:
+            result = (self.ftx_client.place_order(**order_args), None)
+        except Exception as error:
+            result = (None, error)
+        return result, sent_at, time.perf_counter()
+
+    def _record_leg_timing(self, long_result: tuple, short_result: tuple) -> None:
+        """Store how far apart the two legs went out and were acknowledged,
+        the ack gap is the window where only one leg is working
+        """
+        self.leg_timing = {
+            'send_gap': abs(long_result[1] - short_result[1]),
+            'ack_gap': abs(long_result[2] - short_result[2]),
+            'elapsed': max(long_result[2], short_result[2]) - min(long_result[1], short_result[1]),
+        }
+
+    def _unwind_leg(self, order: dict, order_args: dict) -> None:
+        """Remove a leg whose pair was rejected, resting orders are cancelled
+        and market orders are offset with an opposite market order
+        """
+        if order_args['type'] == 'market':
+            self.ftx_client.place_order(
+                market=order_args['market'], side="sell" if order_args['side'] == "buy" else "buy",
+                price=None, size=order_args['size'], type='market')
+            print(order_args['side'] + " leg unwound")
+        else:
+            self.ftx_client.cancel_order(order['id'])
+            print(order_args['side'] + " leg cancelled")
+
+    def _select_markets(self, is_opening_trade) -> bool:
+        """Set long_market/short_market for the trade being entered
+
+        Args:
+            is_opening_trade (bool): true if opening trade, false if closing
+
+        Returns:
+            bool: true if the long leg is the spot market
+        """
+        # True if we are going long spot and opening, or are short spot and closing
+        if (self.long_spot and is_opening_trade) or (not self.long_spot and not is_opening_trade):
+            self.long_market = self.underlier + "/USD"
+            self.short_market = self.underlier + "-PERP"
+            return True
+
+        self.long_market = self.underlier + "-PERP"
+        self.short_market = self.underlier + "/USD"
+        return False
 
     def order_status_monitor(self, is_opening_trade) -> None:
         """Function to monitor for fills on open maker orders
+        Waits on pushed order updates when an order stream is connected,
+        otherwise polls the open orders list
 
         Args:
             is_opening_trade (bool): true if opening trade, false if closing
 
         Raises:
-            Exception: Timeout after 100s with no complete fills
+            Exception: Timeout after order_timeout seconds with no complete fills
         """
         # check status at this time interval
-        sleep_time = .1  
+        sleep_time = self.poll_interval
 
-        timeout = sleep_time * 1000
+        timeout = self.order_timeout
+
+        # generation of the stream connection our view of the orders is caught up with
+        stream_generation = None
+        last_requote = self.clock()
 
         while True:
-            
-            #get order list and find our long/short orders, None if they've been filled
-            order_list = self.ftx_client.get_order_status()
-            self.long_order = next((order for order in order_list if order['id'] == self.long_order['id']), None)
-            self.short_order = next((order for order in order_list if order['id'] == self.short_order['id']), None)
+            stream = self.order_stream
+            polled = False
+            long_order_id, short_order_id = self.long_order['id'], self.short_order['id']
+            if stream is not None and stream.connected and stream.generation == stream_generation:
+                # wake as soon as a leg fills, in short slices so a dropped stream falls back to polling
+                wait_start = self.clock()
+                stream.tracker.wait_for_fill((self.long_order['id'], self.short_order['id']), min(1, timeout))
+                timeout -= self.clock() - wait_start
+                self.long_order = self._streamed_order(self.long_order)
+                self.short_order = self._streamed_order(self.short_order)
+            else:
+                # also run once after the stream (re)connects, to pick up anything it missed
+                stream_generation = stream.generation if stream is not None and stream.connected else None
+                polled = True
+
+                #get order list and find our long/short orders, None if they've been filled
+                order_list = self.ftx_client.get_order_status()
+                self.long_order = next((order for order in order_list if order['id'] == self.long_order['id']), None)
+                self.short_order = next((order for order in order_list if order['id'] == self.short_order['id']), None)
+                timeout -= sleep_time
+
+            if self.quoter is not None:
+                self._replace_rejected_makers(is_opening_trade, long_order_id, short_order_id)
 
             # Check if either order has been filled, either None or remainingSize = 0
             if self.long_order is None or self.short_order is None or self.long_order['remainingSize'] == 0 or self.short_order['remainingSize'] == 0:
                 print("At least one trade filled, stopping monitoring process")
                 break
 
-            timeout -= sleep_time
+            if self.quoter is not None and self.clock() - last_requote >= self.quoter.requote_interval:
+                last_requote = self.clock()
+                self._requote_makers(is_opening_trade)
 
             if timeout <= 0:
                 #cancel orders if we somehow timeout (waiting to process or odd market behavior)
-                self.ftx_client.cancel_order(self.long_order['id'])
-                print("Long order cancelled")
-                self.ftx_client.cancel_order(self.short_order['id'])
-                print("Short order cancelled")
+                self._cancel_order_pair(self.long_order['id'], self.short_order['id'])
+                # a close that timed out leaves the position on, resume closes it again
+                self._journal('cancelled' if is_opening_trade else 'close_cancelled')
                 raise Exception("Timeout waiting for order execution")
 
-            time.sleep(sleep_time)
+            if polled and stream_generation is None:
+                self.sleep(sleep_time)
+
+    def _cancel_order_pair(self, long_order_id: Any, short_order_id: Any) -> None:
+        """Cancel both legs at the same time, so nothing between the two cancels
+        can leave one of them resting
+        """
+        futures = [self._leg_executor.submit(self.ftx_client.cancel_order, order_id)
+                   for order_id in (long_order_id, short_order_id)]
+        for name, future in zip(("Long", "Short"), futures):
+            try:
+                future.result()
+                print(name + " order cancelled")
+            except Exception as error:
+                print(name + " order not cancelled: " + str(error))
+
+    def _streamed_order(self, order: dict) -> Optional[dict]:
+        """Latest pushed state of one of our orders, None once it is closed
+        to match it dropping out of the REST open orders list
+
+        Args:
+            order (dict): order as we last saw it
+
+        Returns:
+            dict: latest order state, None if closed
+        """
+        latest = self.order_stream.tracker.get_order(order['id']) or order
+        return None if latest['status'] == 'closed' else latest
 
     def execute_leftover_order(self) -> None:
         """Function to execute any leftover size after one of
         our maker orders was filled. Cancels exsiting order
-        and places a market order for the remaining size
+        and places a market order for the remaining size,
+        or chases it with amends when hedge_mode is 'chase'
         """
+        long_filled = self.long_order is None or self.long_order['remainingSize'] == 0
+        short_filled = self.short_order is None or self.short_order['remainingSize'] == 0
+        if long_filled and short_filled:
+            # both makers filled before either was pulled, there is no leftover
+            self._expect_maker_fills()
+            return
+
+        if self.hedge_mode == 'chase':
+            self.chase_leftover_order()
+            return
+
+        hedge_start = self.clock()
         #if short order has been filled, execute long order
+        if short_filled:
+            leftover = self._cancel_leftover(self.long_order)
+            if leftover <= SIZE_TOLERANCE:
+                self._expect_maker_fills()
+                return
+            self.long_order = self.ftx_client.place_order(self.long_market, "buy", None, leftover, 'market')
+            self._expect_leftover_fills(True, leftover)
+            self._record_hedge('market', 0, leftover, hedge_start)
+        else:
+            leftover = self._cancel_leftover(self.short_order)
+            if leftover <= SIZE_TOLERANCE:
+                self._expect_maker_fills()
+                return
+            self.short_order = self.ftx_client.place_order(self.short_market, "sell", None, leftover, 'market')
+            self._expect_leftover_fills(False, leftover)
+            self._record_hedge('market', 0, leftover, hedge_start)
+
+    def _cancel_leftover(self, order: dict) -> float:
+        """Cancel the maker order that hasn't filled
+
+        Returns:
+            float: size still to hedge, nothing if the order filled while the cancel was on the wire
+        """
+        try:
+            self.ftx_client.cancel_order(order['id'])
+        except Exception as error:
+            print("Cancel failed: " + str(error))
+            return self.ftx_client.get_order(order['id'])['remainingSize']
+        return order['remainingSize']
+
+    def _expect_maker_fills(self) -> None:
+        long_chain, short_chain = self.maker_chains
+        self.pending_fills = {}
+        self._expect_chain_fills(long_chain, self.long_market, self.trade_size)
+        self._expect_chain_fills(short_chain, self.short_market, self.trade_size)
+        self._journal('hedged', **self._journaled_orders())
+        self._record_hedge(self.hedge_mode, 0, 0, self.clock())
+
+    def chase_leftover_order(self) -> None:
+        """Finish the leg whose maker order hasn't filled without paying taker fees where we
+        can: its price is amended to the touch in place (modify_order, one round trip) every
+        time the book moves, and only whatever is still unfilled after chase_deadline seconds
+        is cancelled and taken with a market order
+        """
         if self.short_order is None or self.short_order['remainingSize'] == 0:
-            self.ftx_client.cancel_order(self.long_order['id'])
-            self.long_order = self.ftx_client.place_order(self.long_market, "buy", None, self.long_order['remainingSize'], 'market')
-        elif self.long_order is None or self.long_order['remainingSize'] == 0:
-            self.ftx_client.cancel_order(self.short_order['id'])
-            self.short_order = self.ftx_client.place_order(self.short_market, "sell", None, self.short_order['remainingSize'], 'market')
+            long_leg, order, market, side = True, self.long_order, self.long_market, "buy"
+        else:
+            long_leg, order, market, side = False, self.short_order, self.short_market, "sell"
+
+        hedge_start = self.clock()
+        deadline = hedge_start + self.chase_deadline
+        # carries on from the requotes the maker order went through
+        chain = list(self.maker_chains[0 if long_leg else 1])
+        amends = 0
+        while True:
+            book_version = self.book_cache.version(market) if self.book_cache is not None else None
+            order = self._chased_order_state(order, market, chain[-1][1])
+            leftover = max(order['remainingSize'], 0.0)
+            if leftover <= SIZE_TOLERANCE or order['status'] == 'closed':
+                # filled, or pulled by the exchange (e.g. a post only amend that would have crossed)
+                break
+            if self.clock() >= deadline:
+                self.ftx_client.cancel_order(order['id'])
+                break
 
+            touch = self._touch(market, side)
+            if touch != order['price']:
+                try:
+                    order = self.ftx_client.modify_order(existing_order_id=order['id'], price=touch)
+                except Exception as error:
+                    # filled or closed while the amend was on the wire, the next status check tells which
+                    print("Amend failed: " + str(error))
+                else:
+                    self._extend_chain(chain, order)
+                    amends += 1
+
+            if book_version is not None:
+                self.book_cache.wait_for_update(market, book_version, self.poll_interval)
+            else:
+                self.sleep(self.poll_interval)
+
+        hedge_order = None
+        if leftover > SIZE_TOLERANCE:
+            hedge_order = self.ftx_client.place_order(market, side, None, leftover, 'market')
+        if long_leg:
+            self.long_order = hedge_order or order
+        else:
+            self.short_order = hedge_order or order
+        self._expect_chased_fills(long_leg, chain, leftover, hedge_order)
+        self._record_hedge('chase', amends, leftover, hedge_start)
+
+    def _chased_order_state(self, order: dict, market: str, filled_before: float) -> dict:
+        """Latest state of the order being chased, kept even once it is closed so a fill
+        can be told apart from a cancel
 
-    def update_fills(self, is_opening_trade: Boolean) -> None:
-        """Update current state with trade fills
-        Checks to see if size from latest is expected trade size, otherwise adds the values
-        from the previous fill as well (at most we have 2 orders that have filled)
         Args:
-            is_opening_trade (Boolean): true if opening trade, false if closing trade
+            order (dict): order as we last saw it
+            market (str): market of the order
+            filled_before (float): size filled on the orders it was amended from
+
+        Returns:
+            dict: latest order state
+        """
+        if self.order_stream is not None and self.order_stream.connected:
+            return self.order_stream.tracker.get_order(order['id']) or order
+        latest = next((open_order for open_order in self.ftx_client.get_order_status()
+                       if open_order['id'] == order['id']), None)
+        if latest is not None:
+            return latest
+        filled = filled_before + filled_size(read_fills(self.ftx_client, market, order['id'], order['size']))
+        return dict(order, status='closed', filledSize=filled, remainingSize=self.trade_size - filled)
+
+    def _touch(self, market: str, side: str) -> float:
+        """Best price a post only order on the given side can rest at
         """
+        bid, ask = self._market_quote(market)
+        return bid if side == "buy" else ask
 
-        long_fill = self.process_fills(self.ftx_client.get_fills(self.long_market))
-        short_fill = self.process_fills(self.ftx_client.get_fills(self.short_market))
+    def _market_quote(self, market: str) -> tuple:
+        return self.get_spot_quote() if market == self.underlier + "/USD" else self.get_perp_quote()
 
-        if is_opening_trade:
-            self.long_open_fill = long_fill
-            self.short_open_fill = short_fill
-        else:  
-            #need to swap the order of these because the "long close" is really buying the short market
-            self.long_close_fill = short_fill
-            self.short_close_fill = long_fill
+    def _top_sizes(self, market: str) -> tuple:
+        if self.book_cache is None:
+            return None, None
+        return self.book_cache.top_sizes(market)
+
+    def _extend_chain(self, chain: List[tuple], order: dict) -> None:
+        """Add an amended order to its leg's amend chain. Amends that keep the order id
+        (Bybit perps) leave the chain as it is, the fills stay on the one id
+        """
+        if order['id'] != chain[-1][0]:
+            # what the leg filled before this order, also right for a spot amend on Bybit,
+            # which puts back only what is left as a new order with nothing filled
+            chain.append((order['id'], self.trade_size - order['remainingSize']))
+
+    def _expect_chased_fills(self, long_leg_hedged: bool, chain: List[tuple], leftover: float,
+                             hedge_order: Optional[dict]) -> None:
+        """Work out which fills have to show up after chase_leftover_order: the maker
+        order chain that filled, what each order in the amend chain filled before it was
+        replaced or done, and the market order for the rest if there was one
+
+        Args:
+            long_leg_hedged (bool): true if the long leg was the one chased
+            chain (list): (order id, size filled before it) of every order the leg went through
+            leftover (float): size taken with the market order
+            hedge_order (dict): the market order, None if the chase filled everything
+        """
+        long_chain, short_chain = self.maker_chains
+        if long_leg_hedged:
+            filled_chain, filled_market, hedge_market = short_chain, self.short_market, self.long_market
+        else:
+            filled_chain, filled_market, hedge_market = long_chain, self.long_market, self.short_market
 
-    def process_fills(self, fills):
-        """Function to process list of fills to aggregate all the fills
-        for the latest order
+        self.pending_fills = {}
+        self._expect_chain_fills(filled_chain, filled_market, self.trade_size)
+        self._expect_chain_fills(chain, hedge_market, self.trade_size - leftover)
+        if hedge_order is not None:
+            self.pending_fills[hedge_order['id']] = (hedge_market, leftover)
+            self.trade_orders[hedge_order['id']] = hedge_market
+        self._journal('hedged', **self._journaled_orders())
 
-        There is a chacne this leads to an issue if we get a partial fill on the maker
-        order, then cancel and enter new market order given they would have differ orderIds, 
-        however that case is unlikely and will be revisted in future work
+    def _expect_chain_fills(self, chain: List[tuple], market: str, filled_by_end: float) -> None:
+        """Expect each order of an amend chain to fill what the leg filled between it
+        being placed and it being replaced or done
 
         Args:
-            fills: list of trade fills
+            chain (list): (order id, size filled before it) of every order the leg went through
+            market (str): market of the leg
+            filled_by_end (float): size the whole chain filled
+        """
+        filled_after = [filled_before for _, filled_before in chain[1:]] + [filled_by_end]
+        for (order_id, filled_before), filled_to in zip(chain, filled_after):
+            self.trade_orders[order_id] = market
+            if filled_to - filled_before > SIZE_TOLERANCE:
+                self.pending_fills[order_id] = (market, filled_to - filled_before)
+
+    def _record_hedge(self, mode: str, amends: int, taken: float, hedge_start: float) -> None:
+        """Keep how the leftover leg was finished, to compare hedge modes on
+        """
+        self.hedge_stats = {'mode': mode, 'amends': amends, 'maker_size': self.trade_size - taken,
+                            'taker_size': taken, 'seconds': self.clock() - hedge_start}
+        print("Leftover leg finished by " + mode + ": " + str(round(self.trade_size - taken, 8)) + " as maker, " +
+              str(round(taken, 8)) + " as taker, " + str(amends) + " amends, " +
+              str(round(self.hedge_stats['seconds'] * 1000, 1)) + "ms")
+
+    def _expect_leftover_fills(self, long_leg_hedged: bool, leftover: float) -> None:
+        """Work out which fills have to show up after execute_leftover_order: the maker
+        order chain that filled, whatever the cancelled maker order chain filled before we
+        pulled it, and the market order for the rest
+
+        Args:
+            long_leg_hedged (bool): true if the long leg was finished with a market order
+            leftover (float): size of that market order
+        """
+        long_chain, short_chain = self.maker_chains
+        if long_leg_hedged:
+            filled_chain, filled_market = short_chain, self.short_market
+            cancelled_chain, hedge_order, hedge_market = long_chain, self.long_order, self.long_market
+        else:
+            filled_chain, filled_market = long_chain, self.long_market
+            cancelled_chain, hedge_order, hedge_market = short_chain, self.short_order, self.short_market
+
+        self.pending_fills = {}
+        self._expect_chain_fills(filled_chain, filled_market, self.trade_size)
+        self._expect_chain_fills(cancelled_chain, hedge_market, self.trade_size - leftover)
+        self.pending_fills[hedge_order['id']] = (hedge_market, leftover)
+        self.trade_orders[hedge_order['id']] = hedge_market
+        self._journal('hedged', **self._journaled_orders())
+
+    def await_fills(self) -> None:
+        """Wait for the fills of the orders just executed to be confirmed, in place of
+        a fixed sleep. Gives up after fill_timeout and lets update_fills read what is there
+        """
+        start = self.metrics.clock()
+        try:
+            waited = wait_for_fills(self.ftx_client, self.pending_fills, self.fill_timeout,
+                                    order_stream=self.order_stream, clock=self.clock, sleep=self.sleep,
+                                    fill_ledger=self.fill_ledger)
+        except FillTimeoutError as error:
+            self._record_fill_timeout(error, self.metrics.clock() - start)
+            return
+        self.confirmed_orders = set(self.pending_fills)
+        self._record_fill_wait(waited, self.metrics.clock() - start)
+
+    def _record_fill_wait(self, waited: float, stage_seconds: float) -> None:
+        self.fill_wait_times.append(waited)
+        self.metrics.record_stage('fill_wait', stage_seconds)
+        print("Fills confirmed in " + str(round(waited * 1000, 1)) + "ms")
+
+    def _record_fill_timeout(self, error: FillTimeoutError, stage_seconds: float) -> None:
+        """Timeouts are kept apart from the fill waits, so they don't skew the fill latencies
+        """
+        self.fill_timeouts.append(self.fill_timeout)
+        self.metrics.record_stage('fill_timeout', stage_seconds)
+        print(str(error) + " after " + str(round(self.fill_timeout * 1000, 1)) + "ms, updating fills anyway")
+
+    def fill_wait_saved(self) -> float:
+        """Wall clock time saved over the fixed FIXED_FILL_WAIT sleeps by the fill waits
+        of the current trade, negative if the fills took longer than the sleep allowed
 
         Returns:
-            fill: aggregated fill of the latest order
+            float: seconds saved
+        """
+        return sum(FIXED_FILL_WAIT - waited for waited in self.fill_wait_times + self.fill_timeouts)
+
+    def _report_fill_wait_saved(self) -> None:
+        print("Fill confirmation saved " + str(round(self.fill_wait_saved() * 1000, 1)) +
+              "ms over fixed " + str(FIXED_FILL_WAIT) + "s waits this trade")
+
+
+    def update_fills(self, is_opening_trade: bool) -> None:
+        """Update current state with trade fills
+        Only the fills of the orders sent for this open/close are requested, paging
+        stops once the size each order was expected to fill is accounted for, and orders
+        await_fills already saw complete aren't asked about again. They go into the fill
+        ledger and each leg's fill is the VWAP of all of its orders (e.g. a part filled
+        maker order plus the market order for the rest)
+
+        Args:
+            is_opening_trade (bool): true if opening trade, false if closing trade
         """
-        base_fill = fills.pop(0)
-        additional_fill = fills.pop(0)
+        for order_id, market in self.trade_orders.items():
+            self.fill_ledger.assign(order_id, self._fill_leg(market, is_opening_trade))
+        for order_id, market, expected_size in self._unconfirmed_orders():
+            self.fill_ledger.add_all(read_fills(self.ftx_client, market, order_id, expected_size))
+        self.confirmed_orders = set()
+        self._read_leg_fills(is_opening_trade)
+        self._journal_fills(is_opening_trade)
+
+    def _unconfirmed_orders(self) -> List[tuple]:
+        """(order id, market, expected size) of the orders of this open/close await_fills
+        didn't read in full, the expected size is None if we don't know what to expect
+        """
+        return [(order_id, market, self.pending_fills.get(order_id, (market, None))[1])
+                for order_id, market in self.trade_orders.items() if order_id not in self.confirmed_orders]
+
+    def _fill_leg(self, market: str, is_opening_trade: bool) -> str:
+        """Ledger leg an order on a market counts towards. The "long close" is really
+        buying back the short market, so closing orders on the short market belong to the long leg
+        """
+        if is_opening_trade:
+            return 'long_open' if market == self.long_market else 'short_open'
+        return 'long_close' if market == self.short_market else 'short_close'
+
+    def _read_leg_fills(self, is_opening_trade: bool) -> None:
+        if is_opening_trade:
+            self.long_open_fill = self.fill_ledger.leg_fill('long_open')
+            self.short_open_fill = self.fill_ledger.leg_fill('short_open')
+        else:
+            self.long_close_fill = self.fill_ledger.leg_fill('long_close')
+            self.short_close_fill = self.fill_ledger.leg_fill('short_close')
+
+    def _journal(self, event: str, **data) -> None:
+        if self.journal is not None:
+            self.journal.record(self.trade_id, event, **data)
 
-        #continue popping fills until we hit an orderId that is different from the latest order
-        while(additional_fill['orderId'] == base_fill['orderId']):
-            base_fill['price'] = (base_fill['price'] * base_fill['size'] + additional_fill['price'] * additional_fill['size'])/(base_fill['size'] + additional_fill['size'])
-            base_fill['size'] += additional_fill['size']
-            base_fill['fee'] += additional_fill['fee']
-            additional_fill = fills.pop(0)
+    def _journal_fills(self, is_opening_trade: bool) -> None:
+        if is_opening_trade:
+            self._journal('filled', fills={'long_open': self.long_open_fill, 'short_open': self.short_open_fill})
+        else:
+            self._journal('filled', fills={'long_close': self.long_close_fill, 'short_close': self.short_close_fill})
 
-        return base_fill        
+    def _journal_start(self, market_orders: bool) -> None:
+        if self.journal is not None:
+            self.trade_id = self.journal.new_trade_id(self.underlier)
+            self._journal('started', underlier=self.underlier, trade_size=self.trade_size,
+                          market_orders=market_orders, long_spot=self.long_spot)
 
+    def _journaled_orders(self) -> dict:
+        return {'trade_orders': [[order_id, market] for order_id, market in self.trade_orders.items()],
+                'pending_fills': [[order_id, market, size] for order_id, (market, size) in self.pending_fills.items()]}
+
+    def _journal_placed(self, is_opening_trade: bool) -> None:
+        self._journal('placed', opening=is_opening_trade, long_order=self.long_order['id'],
+                      short_order=self.short_order['id'], maker_chains=self.maker_chains,
+                      **self._journaled_orders())
+
+    def resume(self, state: Dict) -> Optional[float]:
+        """Carry on with a trade another process journaled but didn't finish, from the
+        state TradeJournal.open_trades replayed for it: monitors and hedges maker orders
+        that were working, waits for fills that were expected, holds and closes as
+        trade()/trade_market_orders() would have
+
+        Args:
+            state (dict): journaled state of the trade
+
+        Returns:
+            float: PnL of the trade, None if it was abandoned before any orders went out
+        """
+        self.trade_id = state['trade_id']
+        self.long_spot = state['long_spot']
+        self.fill_wait_times = []
+        self.fill_timeouts = []
+        self.fill_ledger.clear_legs()
+        for leg, fill in state['fills'].items():
+            setattr(self, leg + '_fill', fill)
+        market_orders = state['market_orders']
+        opening = state['stage'] == 'open'
+        print("Resuming trade " + self.trade_id + " at " + state['stage'] + " " + state['step'])
+
+        if state['step'] == 'started':
+            print("No orders were placed, abandoning trade")
+            self._journal('abandoned')
+            return None
+
+        if state['step'] not in ('filled', 'close_cancelled'):
+            self._select_markets(opening)
+            # the monitor polls for the orders' current state before it looks at anything else
+            self.long_order, self.short_order = {'id': state['long_order']}, {'id': state['short_order']}
+            self.maker_chains = self._journaled_maker_chains(state)
+            self.trade_orders = dict(state['trade_orders'])
+            self.pending_fills = dict(state['pending_fills'])
+            self._finish_orders(opening, market_orders, state['step'])
+
+        if opening or state['step'] == 'close_cancelled':
+            if opening:
+                print("Waiting for exit condition")
+                with self.metrics.stage('exit'):
+                    self.wait_for_exit_condition()
+            print("Initiating close trade")
+            if market_orders:
+                self.initiate_trade_market_order(is_opening_trade=False)
+            else:
+                self.initiate_trade(is_opening_trade=False)
+            self._finish_orders(False, market_orders, 'placed')
+
+        print("Calculating trade pnl")
+        pnl = self.calc_trade_pnl()
+        print(pnl)
+        self._journal('closed', pnl=pnl)
+        return pnl
+
+    def _journaled_maker_chains(self, state: Dict) -> List[list]:
+        if state.get('maker_chains') is None:
+            return [[(state['long_order'], 0.0)], [(state['short_order'], 0.0)]]
+        return [[tuple(link) for link in chain] for chain in state['maker_chains']]
+
+    def _finish_orders(self, is_opening_trade: bool, market_orders: bool, step: str) -> None:
+        """Remaining steps of an open or close from the journaled step on
+        """
+        if step == 'placed' and not market_orders:
+            print("Starting to monitor for fills")
+            with self.metrics.stage('monitor'):
+                self.order_status_monitor(is_opening_trade)
+            print("Executing remaining order")
+            with self.metrics.stage('hedge'):
+                self.execute_leftover_order()
+        print("Waiting for fills")
+        self.await_fills()
+        print("Updating fills")
+        with self.metrics.stage('fill_update'):
+            self.update_fills(is_opening_trade)
 
     def wait_for_exit_condition(self) -> None:
         """
@@ -432,7 +972,7 @@ class DeltaNeutralTrade:
         Returns:
             None
         """
-        time.sleep(10)
+        self.sleep(10)
         return
 
     def calc_trade_pnl(self) -> float:
@@ -448,18 +988,31 @@ class DeltaNeutralTrade:
 
         return (long_trade_pnl - long_fee_pnl + short_trade_pnl - short_fee_pnl)
 
-    def check_spot_vs_perp(self) -> Boolean:
+    def check_spot_vs_perp(self) -> bool:
         """Function to check perp funding rates vs
         spot market borrow/lend rates to determine if
         we should go long spot/short perp or short spot/long perp
 
         Returns: 
-            Boolean: true if long spot, false if short spot
+            bool: true if long spot, false if short spot
         """
         spot_borrow = self.get_spot_borrow_rate()
         spot_lend = self.get_spot_lending_rate()
         perp_funding = self.get_perp_funding_rate()
 
+        return self._choose_long_spot(spot_borrow, spot_lend, perp_funding)
+
+    def _choose_long_spot(self, spot_borrow: float, spot_lend: float, perp_funding: float) -> bool:
+        """Compare the funding pnl of both directions given the current rates
+
+        Args:
+            spot_borrow (float): spot borrow rate
+            spot_lend (float): spot lending rate
+            perp_funding (float): perp funding rate
+
+        Returns:
+            bool: true if long spot, false if short spot
+        """
         # assume we can lend asset, pay funding on the perp
         long_spot_funding_pnl = self.trade_size * (spot_lend + perp_funding)
 
@@ -476,6 +1029,9 @@ class DeltaNeutralTrade:
         Returns:
             float: borrow rate
         """
+        if self.rate_store is not None:
+            return self.rate_store.borrow_rate(self.underlier)
+
         borrow_list = self.ftx_client.get_borrow_rates()
 
         #returned object is a list of dictionaries, convert it into a readable dict
@@ -490,6 +1046,9 @@ class DeltaNeutralTrade:
         Returns:
             float: lending rate
         """
+        if self.rate_store is not None:
+            return self.rate_store.lending_rate(self.underlier)
+
         lending_list = self.ftx_client.get_lending_rates()
 
         lending_dict = {x['coin']: [x['previous'], x['estimate']] for x in lending_list}
@@ -510,6 +1069,9 @@ class DeltaNeutralTrade:
         Returns:
             tuple containing current bid & ask
         """
+        cached_quote = self._cached_quote(self.underlier + "/USD")
+        if cached_quote is not None:
+            return cached_quote
         spot_market = self.ftx_client.get_single_market(self.underlier + "/USD")
         return (spot_market['bid'], spot_market['ask'])
 
@@ -519,34 +1081,30 @@ class DeltaNeutralTrade:
         Returns:
             tuple containing current bid & ask
         """
+        cached_quote = self._cached_quote(self.underlier + "-PERP")
+        if cached_quote is not None:
+            return cached_quote
         perp_market = self.ftx_client.get_future(self.underlier + "-PERP")
         return (perp_market['bid'], perp_market['ask'])
 
-config = dotenv_values(".env")
-
-FTX_API_KEY = config['FTX_API_KEY']
-FTX_API_SECRET = config['FTX_API_SECRET']
-SUBACCOUNT_NAME=config['SUBACCOUNT_NAME']
-
-ftx_client = FtxClient(api_key=FTX_API_KEY, api_secret=FTX_API_SECRET, subaccount_name=SUBACCOUNT_NAME)
-trade_size = .01
-trade_object = DeltaNeutralTrade("ETH", ftx_client, trade_size)
-
-# print(ftx_client.get_balances())
-# print(ftx_client.get_positions())
-
-# print(ftx_client.place_order("ETH/USD", "sell", None, .06, 'market'))
-# print(ftx_client.place_order("ETH-PERP", "buy", None, .05, 'market'))
+    def _cached_quote(self, market: str) -> Optional[tuple]:
+        """Get bid/ask from the streamed book if we have a fresh one
 
-# print(ftx_client.place_order("ETH/USD", "buy", None, .01, 'market'))
-# print(ftx_client.place_order("ETH-PERP", "sell", None, .01, 'market'))
+        Args:
+            market (str): market name
 
+        Returns:
+            tuple containing current bid & ask, None if there is no usable cached book
+        """
+        if self.book_cache is None:
+            return None
+        try:
+            return self.book_cache.quote(market, self.max_quote_age)
+        except StaleQuoteError as error:
+            print(str(error) + ", quoting from REST")
+            return None
 
-print("Running strategy")
-strategy_pnl = trade_object.trade()
-print("Running market orders only")
-market_order_pnl = trade_object.trade_market_orders()
 
-print("Results:")
-print("Strategy PnL: " + str(round(strategy_pnl, 5)))
-print("Market Order PnL: " + str(round(market_order_pnl, 5)))
\ No newline at end of file
+if __name__ == '__main__':
+    from cli import main
+    main()
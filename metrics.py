@@ -0,0 +1,179 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional, Dict, Iterator, List
+
+# histogram bucket upper bounds in seconds, doubling from 10us to ~170s
+BUCKET_BOUNDS = [.00001 * 2 ** i for i in range(25)]
+
+REQUEST_PHASES = ('queue', 'sign', 'network', 'decode', 'total')
+
+
+def endpoint_name(method: str, path: str) -> str:
+    """Name a request by endpoint rather than by its exact path, so e.g. every
+    cancel lands in one histogram
+
+    Args:
+        method (str): http method
+        path (str): path below the api endpoint, e.g. 'orders/123'
+
+    Returns:
+        str: e.g. 'DELETE orders/{id}'
+    """
+    parts = path.split('?')[0].strip('/').split('/')
+    if parts[0] in ('markets', 'futures') and len(parts) > 1:
+        # spot market names have a slash in them, e.g. markets/ETH/USD
+        name_length = 2 if parts[0] == 'markets' and '-' not in parts[1] and len(parts) > 2 else 1
+        parts = [parts[0], '{market}'] + parts[1 + name_length:]
+    return method + ' ' + '/'.join('{id}' if part.isdigit() else part for part in parts)
+
+
+class LatencyHistogram:
+    """
+    Count of samples per log-spaced bucket plus exact count/sum/min/max,
+    percentiles are read off the buckets
+    """
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds: float) -> None:
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Upper bound of the bucket the given percentile falls in, capped at the max seen
+
+        Args:
+            percent (float): 0-100
+
+        Returns:
+            float: seconds, None without samples
+        """
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS + [self.max], self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        """count plus mean/min/p50/p90/p99/max in milliseconds
+        """
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000,
+            'min_ms': self.min * 1000,
+            'p50_ms': self.percentile(50) * 1000,
+            'p90_ms': self.percentile(90) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class Metrics:
+    """
+    Latency histograms for every REST endpoint (split into rate limit queueing,
+    signing, network and decoding) and for every stage of a trade.
+    Safe to read from another thread while a run is in progress
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter) -> None:
+        """Initialize metrics
+
+        Args:
+            clock (callable): returns seconds, what stages are timed with (a virtual clock in backtests)
+        """
+        self.clock = clock
+        self._requests = {}
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record_request(self, endpoint: str, phases: Dict[str, float]) -> None:
+        """Record one request
+
+        Args:
+            endpoint (str): endpoint_name of the request
+            phases (dict): phase name -> seconds, see REQUEST_PHASES
+        """
+        with self._lock:
+            histograms = self._requests.setdefault(endpoint, {})
+            for phase, seconds in phases.items():
+                histograms.setdefault(phase, LatencyHistogram()).record(seconds)
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._stages.setdefault(stage, LatencyHistogram()).record(seconds)
+
+    @contextmanager
+    def stage(self, stage: str) -> Iterator[None]:
+        """Time the block as a stage of a trade, also inside coroutines
+        """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record_stage(stage, self.clock() - start)
+
+    def request_histogram(self, endpoint: str, phase: str = 'total') -> Optional[LatencyHistogram]:
+        return self._requests.get(endpoint, {}).get(phase)
+
+    def stage_histogram(self, stage: str) -> Optional[LatencyHistogram]:
+        return self._stages.get(stage)
+
+    def endpoints(self) -> List[str]:
+        return list(self._requests)
+
+    def summary(self) -> Dict[str, Dict]:
+        """Everything recorded so far
+
+        Returns:
+            dict: 'requests' -> endpoint -> phase -> histogram summary
+                and 'stages' -> stage -> histogram summary
+        """
+        with self._lock:
+            return {
+                'requests': {endpoint: {phase: histogram.summary() for phase, histogram in phases.items()}
+                             for endpoint, phases in self._requests.items()},
+                'stages': {stage: histogram.summary() for stage, histogram in self._stages.items()},
+            }
+
+    def export_json(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def format_summary(self) -> str:
+        """Render the summary for printing at the end of a run
+        """
+        summary = self.summary()
+        header = f"{'count':>7}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}"
+
+        def row(name, stats):
+            if not stats['count']:
+                return f"{name:<40}{0:>7}"
+            return (f"{name:<40}{stats['count']:>7}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+                    f"{stats['p90_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+        lines = [f"{'stage (ms)':<40}" + header]
+        lines += [row(stage, stats) for stage, stats in summary['stages'].items()]
+        lines.append('')
+        lines.append(f"{'request (ms)':<40}" + header)
+        for endpoint, phases in sorted(summary['requests'].items()):
+            lines.append(row(endpoint, phases['total']))
+            lines += [row('  ' + phase, phases[phase]) for phase in REQUEST_PHASES
+                      if phase != 'total' and phase in phases]
+        return '\n'.join(lines)
@@ -0,0 +1,189 @@
+import threading
+import time
+import zlib
+from collections import defaultdict
+from itertools import zip_longest
+from typing import Optional, Dict, List, Tuple
+
+
+class StaleQuoteError(Exception):
+    """
+    Raised when a cached book is missing, out of sync or older than the caller allows
+    """
+
+
+def book_checksum(bids: List[list], asks: List[list]) -> int:
+    """FTX orderbook checksum, crc32 over the top 100 levels interleaved bid/ask
+    as price:size, formatted the way the exchange formats floats
+
+    Args:
+        bids: [price, size] levels, best first
+        asks: [price, size] levels, best first
+
+    Returns:
+        int: checksum
+    """
+    checksum_data = [':'.join([f'{float(order[0])}:{float(order[1])}' for order in (bid, ask) if order])
+                     for (bid, ask) in zip_longest(bids[:100], asks[:100])]
+    return zlib.crc32(':'.join(checksum_data).encode())
+
+
+class OrderBook:
+    """
+    L2 book for one market built from an orderbook partial plus updates.
+    Best bid/ask are worked out once per message so reads cost nothing
+    """
+
+    def __init__(self, market: str) -> None:
+        self.market = market
+        self.bids = {}
+        self.asks = {}
+        self.best_bid = None
+        self.best_ask = None
+        self.updated_at = None
+        self.synced = False
+
+    def apply(self, data: Dict) -> bool:
+        """Apply a partial or update message
+
+        Args:
+            data (dict): `data` of an orderbook channel message
+
+        Returns:
+            bool: true if the book still matches the exchange checksum
+        """
+        if data['action'] == 'partial':
+            self.bids = {price: size for price, size in data['bids']}
+            self.asks = {price: size for price, size in data['asks']}
+        else:
+            for side, levels in ((self.bids, data['bids']), (self.asks, data['asks'])):
+                for price, size in levels:
+                    if size == 0:
+                        side.pop(price, None)
+                    else:
+                        side[price] = size
+
+        self.best_bid = max(self.bids) if self.bids else None
+        self.best_ask = min(self.asks) if self.asks else None
+        self.updated_at = time.monotonic()
+        self.synced = self.checksum() == data['checksum']
+        return self.synced
+
+    def levels(self, depth: int = 100) -> Tuple[List[list], List[list]]:
+        """Sorted [price, size] levels of both sides, best first
+
+        Args:
+            depth (int): number of levels per side
+
+        Returns:
+            tuple containing bid levels & ask levels
+        """
+        bids = sorted(self.bids.items(), reverse=True)[:depth]
+        asks = sorted(self.asks.items())[:depth]
+        return [list(level) for level in bids], [list(level) for level in asks]
+
+    def checksum(self) -> int:
+        return book_checksum(*self.levels())
+
+    def age(self) -> float:
+        """Seconds since the last message for this book, inf if none yet
+        """
+        return float('inf') if self.updated_at is None else time.monotonic() - self.updated_at
+
+
+class OrderBookCache:
+    """
+    In-process books for every market subscribed on the orderbook channel.
+    The websocket client feeds it and asks for a resync whenever a checksum fails
+    """
+
+    def __init__(self) -> None:
+        self.books = {}
+        self.checksum_failures = 0
+        # market -> messages applied, so callers can wait for the book to move
+        self._versions = defaultdict(int)
+        self._updated = threading.Condition()
+
+    def on_message(self, message: Dict) -> bool:
+        """Apply an orderbook channel message
+
+        Args:
+            message (dict): orderbook channel message
+
+        Returns:
+            bool: false if the book is out of sync and needs a fresh partial
+        """
+        market = message['market']
+        book = self.books.get(market)
+        if book is None:
+            book = self.books[market] = OrderBook(market)
+        if message['data']['action'] != 'partial' and not book.synced:
+            # updates on top of a broken book are meaningless, wait for the partial
+            return False
+        if not book.apply(message['data']):
+            self.checksum_failures += 1
+            return False
+        with self._updated:
+            self._versions[market] += 1
+            self._updated.notify_all()
+        return True
+
+    def version(self, market: str) -> int:
+        """Number of messages applied to a market's book so far, see wait_for_update
+        """
+        return self._versions[market]
+
+    def wait_for_update(self, market: str, version: int, timeout: float) -> bool:
+        """Block until the book for a market has changed since version
+
+        Args:
+            market (str): market name
+            version (int): version(market) as of the quote the caller last acted on
+            timeout (float): seconds to wait at most
+
+        Returns:
+            bool: false if the book didn't change before the timeout
+        """
+        with self._updated:
+            return self._updated.wait_for(lambda: self._versions[market] != version, timeout)
+
+    def invalidate(self) -> None:
+        """Mark every book out of sync, e.g. after the connection dropped
+        """
+        for book in self.books.values():
+            book.synced = False
+
+    def quote(self, market: str, max_age: Optional[float] = None) -> Tuple[float, float]:
+        """Current best bid/ask for a market
+
+        Args:
+            market (str): market name
+            max_age (float): refuse books with no message in this many seconds
+
+        Raises:
+            StaleQuoteError: no book, book out of sync or older than max_age
+
+        Returns:
+            tuple containing current bid & ask
+        """
+        book = self.books.get(market)
+        if book is None or not book.synced:
+            raise StaleQuoteError(f"No synced book for {market}")
+        age = book.age()
+        if max_age is not None and age > max_age:
+            raise StaleQuoteError(f"{market} book is {round(age, 3)}s old")
+        return (book.best_bid, book.best_ask)
+
+    def top_sizes(self, market: str) -> Tuple[Optional[float], Optional[float]]:
+        """Size at the best bid & ask of a market, Nones if we have no synced book
+        """
+        book = self.books.get(market)
+        if book is None or not book.synced:
+            return None, None
+        return book.bids.get(book.best_bid), book.asks.get(book.best_ask)
+
+    def age(self, market: str) -> float:
+        """Seconds since the book for a market last changed, inf if we have no book
+        """
+        book = self.books.get(market)
+        return float('inf') if book is None else book.age()
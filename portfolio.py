@@ -0,0 +1,228 @@
+import asyncio
+import time
+from typing import Optional, Dict, Iterable
+
+from async_client import AsyncFtxClient
+from async_trade import AsyncDeltaNeutralTrade
+from fills import read_fills_async
+from orderbook import OrderBookCache
+from rates import RateStore
+from streams import OrderTracker, FtxWebsocketClient
+
+# seconds fill polls reach back past the previous one, for exchange/local clock skew
+FILL_WINDOW_SLACK = 5
+
+
+class _PolledOrderTracker(OrderTracker):
+    """
+    OrderTracker that remembers what is being waited on, so the poller only
+    asks about orders and fills some trade actually needs
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.watched = set()
+        self.fill_waits = 0
+
+    def watch(self, order_ids: Iterable) -> None:
+        self.watched.update(order_ids)
+
+    async def wait_for_fill_async(self, order_ids: Iterable, timeout: float) -> Optional[dict]:
+        order_ids = list(order_ids)
+        self.watch(order_ids)
+        return await super().wait_for_fill_async(order_ids, timeout)
+
+    async def wait_for_sizes_async(self, expected_sizes: Dict, timeout: float) -> bool:
+        self.fill_waits += 1
+        try:
+            return await super().wait_for_sizes_async(expected_sizes, timeout)
+        finally:
+            self.fill_waits -= 1
+
+    def close_order(self, order_id) -> None:
+        """Mark a watched order closed once it drops out of the open orders list
+        """
+        self.watched.discard(order_id)
+        last_seen = self.get_order(order_id) or {'id': order_id, 'remainingSize': None}
+        self.on_order(dict(last_seen, status='closed'))
+
+
+class SharedOrderPoller:
+    """
+    Single polling loop standing in for an order stream across a whole portfolio.
+    Open orders are fetched once per interval for every trade together (plus recent
+    fills while any trade is waiting on them) and fed into one tracker, so trades
+    monitor through it the same way they would through FtxWebsocketClient and
+    adding a trade doesn't add requests
+    """
+
+    def __init__(self, ftx_client: AsyncFtxClient, interval: float = .1) -> None:
+        """Initialize poller
+
+        Args:
+            ftx_client (AsyncFtxClient): async ftx client object
+            interval (float): seconds between polls
+        """
+        self.ftx_client = ftx_client
+        self.interval = interval
+        self.tracker = _PolledOrderTracker()
+        self.connected = False
+        self.generation = 0
+        self.polls = 0
+        self._task = None
+        # fills are polled from here on, each poll moves it up to when the one before started
+        self._fills_since = time.time() - FILL_WINDOW_SLACK
+
+    async def connect(self) -> 'SharedOrderPoller':
+        """Start polling as a task on the current event loop
+        """
+        self._task = asyncio.ensure_future(self.run())
+        self.generation += 1
+        self.connected = True
+        return self
+
+    async def close(self) -> None:
+        self.connected = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception as error:
+                print("Order poll failed: " + str(error))
+            await asyncio.sleep(self.interval)
+
+    async def poll(self) -> None:
+        """Fetch open orders (and the fills since the last poll) once for everything being waited on
+        """
+        watched = set(self.tracker.watched)
+        want_fills = self.tracker.fill_waits > 0
+        if not watched and not want_fills:
+            return
+
+        self.polls += 1
+        started = time.time()
+        # only the fills since the last poll, paged, so a busy account can't push ours off the first page
+        requests = [self.ftx_client.get_order_status() if watched else asyncio.sleep(0, []),
+                    read_fills_async(self.ftx_client, start_time=self._fills_since) if want_fills
+                    else asyncio.sleep(0, [])]
+        order_list, fills = await asyncio.gather(*requests)
+        if want_fills:
+            self._fills_since = started - FILL_WINDOW_SLACK
+
+        for fill in fills:
+            self.tracker.on_fill(fill)
+        open_orders = {order['id']: order for order in order_list}
+        for order_id in watched:
+            if order_id in open_orders:
+                self.tracker.on_order(open_orders[order_id])
+            else:
+                self.tracker.close_order(order_id)
+
+
+class Portfolio:
+    """
+    Runs the whole trade lifecycle for many underliers at once on one event loop.
+    Every trade shares one AsyncFtxClient (and its connection pool), one RateStore
+    and one order feed, either the order stream passed in or a SharedOrderPoller,
+    so monitoring, exit checks and fill updates of all trades are multiplexed
+    on the loop instead of each trade blocking a thread of its own
+    """
+
+    def __init__(self, ftx_client: AsyncFtxClient, trade_sizes: Dict[str, float],
+                 order_stream: Optional[FtxWebsocketClient] = None, book_cache: Optional[OrderBookCache] = None,
+                 rate_store: Optional[RateStore] = None, market_orders: bool = False,
+                 poll_interval: float = .1, trade_class: type = AsyncDeltaNeutralTrade,
+                 trade_kwargs: Optional[Dict] = None) -> None:
+        """Initialize portfolio
+
+        Args:
+            ftx_client (AsyncFtxClient): async ftx client object shared by every trade
+            trade_sizes (dict): underlier -> trade size
+            order_stream (FtxWebsocketClient): optional orders/fills stream, a shared
+                poller is used without one
+            book_cache (OrderBookCache): optional streamed books to quote from, books for
+                every underlier are subscribed if this is order_stream.books
+            rate_store (RateStore): rate store to share, one is made if not given
+            market_orders (bool): trade with market orders only instead of maker orders
+            poll_interval (float): seconds between polls of the shared poller
+            trade_class (type): AsyncDeltaNeutralTrade or a subclass of it
+            trade_kwargs (dict): more arguments for every trade, e.g. a shared journal
+        """
+        self.ftx_client = ftx_client
+        self.market_orders = market_orders
+        self.rate_store = rate_store or RateStore(ftx_client)
+        self.order_feed = order_stream or SharedOrderPoller(ftx_client, poll_interval)
+        self._owns_feed = order_stream is None
+
+        if order_stream is not None and book_cache is order_stream.books:
+            for underlier in trade_sizes:
+                order_stream.subscribe_orderbook(underlier + "/USD")
+                order_stream.subscribe_orderbook(underlier + "-PERP")
+
+        self.trades = {underlier: trade_class(underlier, ftx_client, size, order_stream=self.order_feed,
+                                              book_cache=book_cache, rate_store=self.rate_store,
+                                              **(trade_kwargs or {}))
+                       for underlier, size in trade_sizes.items()}
+        self.pnl = {}
+        self.errors = {}
+
+    async def run(self) -> Dict[str, float]:
+        """Run every trade to completion concurrently, a trade that fails doesn't
+        stop the others and its error ends up in self.errors
+
+        Returns:
+            dict: underlier -> PnL of the trades that completed
+        """
+        if self._owns_feed:
+            await self.order_feed.connect()
+        try:
+            await asyncio.gather(*[self._run_trade(underlier, trade) for underlier, trade in self.trades.items()])
+        finally:
+            if self._owns_feed:
+                await self.order_feed.close()
+        return self.pnl
+
+    async def _run_trade(self, underlier: str, trade: AsyncDeltaNeutralTrade) -> None:
+        try:
+            if self.market_orders:
+                self.pnl[underlier] = await trade.trade_market_orders()
+            else:
+                self.pnl[underlier] = await trade.trade()
+        except Exception as error:
+            print(underlier + " trade failed: " + str(error))
+            self.errors[underlier] = error
+
+
+async def run_portfolio(ftx_client: AsyncFtxClient, trade_sizes: Dict[str, float]) -> None:
+    portfolio = Portfolio(ftx_client, trade_sizes)
+    pnl = await portfolio.run()
+
+    print("Results:")
+    for underlier, trade_pnl in pnl.items():
+        print(underlier + " PnL: " + str(round(trade_pnl, 5)))
+    for underlier, error in portfolio.errors.items():
+        print(underlier + " failed: " + str(error))
+    print("Rate store: " + str(portfolio.rate_store.stats()))
+    print("Rate limiter: " + str(ftx_client.rate_limiter.stats()))
+    print(ftx_client.metrics.format_summary())
+
+
+if __name__ == '__main__':
+    from dotenv import dotenv_values
+
+    config = dotenv_values(".env")
+
+    async def main():
+        async with AsyncFtxClient(api_key=config['FTX_API_KEY'], api_secret=config['FTX_API_SECRET'],
+                                  subaccount_name=config['SUBACCOUNT_NAME']) as ftx_client:
+            await run_portfolio(ftx_client, {"ETH": .01, "BTC": .001, "SOL": .1})
+
+    asyncio.run(main())
@@ -0,0 +1,205 @@
+"""
+Adaptive maker quotes: how far from the touch each post only order goes is set
+from the live spread, recent volatility and the size queued at the touch
+instead of a fixed offset, and orders the market has moved away from are
+re-quoted. Every decision is kept (and optionally appended to a json lines
+log) with everything it was made from, so a run can be replayed through a
+quoter with other parameters
+"""
+import math
+import time
+from collections import defaultdict, deque
+from typing import Optional, Dict, List, Iterable, Iterator, Callable, Tuple
+
+from codec import json_dumps, json_loads
+
+
+class AdaptiveQuoter:
+    """
+    Fills come quickest at the touch, and quicker still just inside it when the
+    queue at the touch is deep, so that is where orders go unless the market is
+    moving fast enough to cross the spread before the order lands, which would
+    get it rejected as post only. Then the order is backed off the touch by the
+    move expected over the time it takes to land, less the spread that already
+    protects it. Volatility is measured per market from the quotes the quoter sees
+    """
+
+    def __init__(self, horizon: float = .1, reject_z: float = 2.0, max_offset: float = .001,
+                 volatility_window: float = 60, deep_queue: float = 10, improve_fraction: float = .5,
+                 improve_min_spread: float = .0002, requote_threshold: float = .0002,
+                 requote_interval: float = 1, log_path: Optional[str] = None,
+                 clock: Callable[[], float] = time.time, keep: int = 10000) -> None:
+        """Initialize quoter
+
+        Args:
+            horizon (float): seconds from reading the quote to the order resting on the book, about an RTT
+            reject_z (float): standard deviations of price move over the horizon the order is kept clear of
+            max_offset (float): furthest fraction an order is placed from the touch
+            volatility_window (float): seconds of quotes volatility is measured over
+            deep_queue (float): size at the touch, in multiples of the order size, above which the
+                order steps inside the spread rather than joining the back of the queue
+            improve_fraction (float): fraction of the spread an order steps inside by
+            improve_min_spread (float): narrowest spread, as a fraction of mid, worth stepping inside
+            requote_threshold (float): fraction the price we would quote now can move away from a
+                resting order before it is re-quoted
+            requote_interval (float): seconds between re-quote checks of resting orders
+            log_path (str): json lines file every decision is appended to
+            clock (callable): returns time in seconds, a backtest's virtual clock in backtests
+            keep (int): decisions kept in memory
+        """
+        self.horizon = horizon
+        self.reject_z = reject_z
+        self.max_offset = max_offset
+        self.volatility_window = volatility_window
+        self.deep_queue = deep_queue
+        self.improve_fraction = improve_fraction
+        self.improve_min_spread = improve_min_spread
+        self.requote_threshold = requote_threshold
+        self.requote_interval = requote_interval
+        self.clock = clock
+
+        self.decisions = deque(maxlen=keep)
+        # market -> (time, log mid) of the quotes seen within volatility_window
+        self._mids = defaultdict(deque)
+        self._log = open(log_path, 'ab') if log_path else None
+
+    def __enter__(self) -> 'AdaptiveQuoter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def observe(self, market: str, bid: float, ask: float, at: Optional[float] = None) -> None:
+        """Add a quote to the market's volatility estimate
+        """
+        at = self.clock() if at is None else at
+        mids = self._mids[market]
+        mids.append((at, math.log((bid + ask) / 2)))
+        while mids and at - mids[0][0] > self.volatility_window:
+            mids.popleft()
+
+    def volatility(self, market: str) -> float:
+        """Standard deviation of log mid changes per square root second over the window, 0 without history
+        """
+        mids = self._mids.get(market)
+        if not mids or len(mids) < 2 or mids[-1][0] <= mids[0][0]:
+            return 0.0
+        variance = sum((b[1] - a[1]) ** 2 for a, b in zip(mids, list(mids)[1:]))
+        return math.sqrt(variance / (mids[-1][0] - mids[0][0]))
+
+    def offset(self, market: str, side: str, bid: float, ask: float, bid_size: Optional[float] = None,
+               ask_size: Optional[float] = None, size: Optional[float] = None) -> Tuple[float, Dict]:
+        """Fraction of the touch to place an order away from, negative inside the spread
+
+        Returns:
+            tuple containing the offset & what it was worked out from
+        """
+        mid = (bid + ask) / 2
+        spread = (ask - bid) / mid
+        volatility = self.volatility(market)
+        # the spread already keeps a touch order from crossing, back off by whatever the expected move exceeds it by
+        safety = max(0.0, self.reject_z * volatility * math.sqrt(self.horizon) - spread)
+        queue = bid_size if side == "buy" else ask_size
+        improve = 0.0
+        if (safety == 0 and queue is not None and size and queue > self.deep_queue * size and
+                spread >= self.improve_min_spread):
+            improve = spread * self.improve_fraction
+        offset = min(self.max_offset, safety) - improve
+        return offset, {'volatility': volatility, 'spread': spread, 'safety': safety, 'improve': improve}
+
+    @staticmethod
+    def price(side: str, bid: float, ask: float, offset: float) -> float:
+        return bid * (1 - offset) if side == "buy" else ask * (1 + offset)
+
+    def quote(self, market: str, side: str, bid: float, ask: float, bid_size: Optional[float] = None,
+              ask_size: Optional[float] = None, size: Optional[float] = None, at: Optional[float] = None) -> float:
+        """Price for a new post only order
+
+        Args:
+            market (str): market name
+            side (str): buy or sell
+            bid (float): best bid
+            ask (float): best ask
+            bid_size (float): size at the best bid, if known
+            ask_size (float): size at the best ask, if known
+            size (float): size of the order
+            at (float): time of the quote, now by default
+
+        Returns:
+            float: limit price
+        """
+        at = self.clock() if at is None else at
+        self.observe(market, bid, ask, at)
+        offset, inputs = self.offset(market, side, bid, ask, bid_size, ask_size, size)
+        price = self.price(side, bid, ask, offset)
+        self._decide(dict(inputs, kind='quote', time=at, market=market, side=side, bid=bid, ask=ask,
+                          bid_size=bid_size, ask_size=ask_size, size=size, offset=offset, price=price))
+        return price
+
+    def requote(self, market: str, side: str, order_price: float, bid: float, ask: float,
+                bid_size: Optional[float] = None, ask_size: Optional[float] = None, size: Optional[float] = None,
+                at: Optional[float] = None) -> Optional[float]:
+        """New price for a resting order if the market has moved away from it. Orders the
+        market moved towards are left alone, they are about to fill
+
+        Args:
+            order_price (float): the order's current price
+            see quote for the rest
+
+        Returns:
+            float: price to amend the order to, None to leave it
+        """
+        at = self.clock() if at is None else at
+        self.observe(market, bid, ask, at)
+        offset, inputs = self.offset(market, side, bid, ask, bid_size, ask_size, size)
+        price = self.price(side, bid, ask, offset)
+        if side == "buy":
+            moved_away = price > order_price * (1 + self.requote_threshold)
+        else:
+            moved_away = price < order_price * (1 - self.requote_threshold)
+        self._decide(dict(inputs, kind='requote', time=at, market=market, side=side, bid=bid, ask=ask,
+                          bid_size=bid_size, ask_size=ask_size, size=size, offset=offset, price=price,
+                          order_price=order_price, requote=moved_away))
+        return price if moved_away else None
+
+    def _decide(self, decision: Dict) -> None:
+        self.decisions.append(decision)
+        if self._log is not None:
+            self._log.write(json_dumps(decision) + b'\n')
+            self._log.flush()
+
+
+def read_decisions(path: str) -> Iterator[Dict]:
+    """Decisions from a quoter's log, a torn last line is skipped
+    """
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.endswith(b'\n'):
+                yield json_loads(line)
+
+
+def replay_decisions(decisions: Iterable[Dict], quoter: AdaptiveQuoter) -> List[Tuple[Dict, Dict]]:
+    """Make the logged decisions again with another quoter, e.g. one with different
+    parameters. The same parameters reproduce the log
+
+    Args:
+        decisions (list): logged decisions, in the order they were made
+        quoter (AdaptiveQuoter): quoter to replay them through
+
+    Returns:
+        list of (logged decision, replayed decision)
+    """
+    replayed = []
+    for decision in decisions:
+        inputs = {key: decision[key] for key in ('market', 'side', 'bid', 'ask', 'bid_size', 'ask_size', 'size')}
+        if decision['kind'] == 'quote':
+            quoter.quote(at=decision['time'], **inputs)
+        else:
+            quoter.requote(order_price=decision['order_price'], at=decision['time'], **inputs)
+        replayed.append((decision, quoter.decisions[-1]))
+    return replayed
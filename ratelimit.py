@@ -0,0 +1,163 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from typing import Callable, Optional, Dict, Any
+
+# priority classes, lower goes first
+CANCEL = 0  # cancels and hedging/unwinding market orders
+PLACE = 1  # new and modified resting orders
+DATA = 2  # quotes, rates, order status, fills
+
+PRIORITY_NAMES = {CANCEL: 'cancel', PLACE: 'place', DATA: 'data'}
+
+
+def request_priority(method: str, path: str, body: Optional[Dict[str, Any]] = None) -> int:
+    """Priority class of a REST request
+
+    Args:
+        method (str): http method
+        path (str): path below the api endpoint, e.g. 'orders'
+        body (dict): json body, if any
+
+    Returns:
+        int: CANCEL, PLACE or DATA
+    """
+    if method == 'DELETE':
+        return CANCEL
+    if method == 'POST' and path.startswith('orders'):
+        # market orders only go out to finish or unwind a hedge, they can't wait behind new quotes
+        if body is not None and body.get('type') == 'market':
+            return CANCEL
+        return PLACE
+    return DATA
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every request of a client. When requests have to wait
+    they are let through by priority class (cancels and hedges, then order
+    placement, then market data) and in arrival order within a class, so a busy
+    polling loop can never hold up a cancel.
+    Use acquire from threads (FtxClient) and acquire_async from coroutines
+    (AsyncFtxClient), not both on the same limiter
+    """
+
+    def __init__(self, rate: float = 150, burst: int = 30, clock: Callable[[], float] = time.monotonic) -> None:
+        """Initialize rate limiter
+
+        Args:
+            rate (float): requests per second allowed on average
+            burst (int): requests that can go out back to back after a quiet spell
+            clock (callable): returns monotonic time in seconds
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._turn = None
+        self._stats = {priority: {'requests': 0, 'queued': 0, 'max_queued': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+                       for priority in PRIORITY_NAMES}
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _next_token_in(self) -> float:
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def _ready(self, ticket: tuple) -> bool:
+        self._refill()
+        return self._queue[0] == ticket and self._tokens >= 1
+
+    def _enqueue(self, priority: int) -> tuple:
+        ticket = (priority, next(self._seq))
+        heapq.heappush(self._queue, ticket)
+        stats = self._stats[priority]
+        stats['queued'] += 1
+        stats['max_queued'] = max(stats['max_queued'], stats['queued'])
+        return ticket
+
+    def _dequeue(self, ticket: tuple, waited: Optional[float]) -> None:
+        """Take a ticket off the queue, waited is None if it gave up without a token
+        """
+        if self._queue[0] == ticket:
+            heapq.heappop(self._queue)
+        else:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+        stats = self._stats[ticket[0]]
+        stats['queued'] -= 1
+        if waited is not None:
+            self._tokens -= 1
+            stats['requests'] += 1
+            stats['total_wait'] += waited
+            stats['max_wait'] = max(stats['max_wait'], waited)
+
+    def acquire(self, priority: int = DATA) -> float:
+        """Block until a request of this priority may be sent
+
+        Args:
+            priority (int): CANCEL, PLACE or DATA
+
+        Returns:
+            float: seconds waited
+        """
+        start = self.clock()
+        with self._condition:
+            ticket = self._enqueue(priority)
+            waited = None
+            try:
+                while not self._ready(ticket):
+                    # only the head of the queue waits on the bucket, the rest wait their turn
+                    self._condition.wait(self._next_token_in() if self._queue[0] == ticket else None)
+                waited = self.clock() - start
+            finally:
+                self._dequeue(ticket, waited)
+                self._condition.notify_all()
+        return waited
+
+    async def acquire_async(self, priority: int = DATA) -> float:
+        """Coroutine version of acquire
+        """
+        start = self.clock()
+        if self._turn is None:
+            self._turn = asyncio.Event()
+        ticket = self._enqueue(priority)
+        waited = None
+        try:
+            while not self._ready(ticket):
+                turn = self._turn
+                try:
+                    await asyncio.wait_for(turn.wait(), self._next_token_in() if self._queue[0] == ticket else None)
+                except asyncio.TimeoutError:
+                    pass
+            waited = self.clock() - start
+        finally:
+            self._dequeue(ticket, waited)
+            # wake everyone waiting so the new head of the queue takes over
+            self._turn.set()
+            self._turn = asyncio.Event()
+        return waited
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Requests sent, current and deepest queue and wait times per priority class
+        """
+        with self._condition:
+            return {
+                PRIORITY_NAMES[priority]: {
+                    'requests': stats['requests'],
+                    'queued': stats['queued'],
+                    'max_queued': stats['max_queued'],
+                    'avg_wait': stats['total_wait'] / stats['requests'] if stats['requests'] else 0.0,
+                    'max_wait': stats['max_wait'],
+                }
+                for priority, stats in self._stats.items()
+            }
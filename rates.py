@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, List
+
+
+class RateStore:
+    """
+    Spot borrow and lending rates for every coin, indexed by coin.
+    Both lists are fetched together and kept until the next hourly funding
+    boundary, so any number of DeltaNeutralTrade objects can share one store
+    and only the first lookup each hour costs a round trip.
+    Use borrow_rate/lending_rate with an FtxClient and the _async versions
+    with an AsyncFtxClient
+    """
+
+    def __init__(self, ftx_client: object, clock: Callable[[], float] = time.time) -> None:
+        """Initialize rate store
+
+        Args:
+            ftx_client (object): ftx client object used to fetch the rates
+            clock (callable): returns the current epoch time in seconds
+        """
+        self.ftx_client = ftx_client
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+
+        # coin -> [previous, estimate]
+        self._borrow = {}
+        self._lending = {}
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        self._async_lock = None
+
+    def borrow_rate(self, coin: str) -> float:
+        """Upcoming borrow rate for a coin
+
+        Args:
+            coin (str): coin to look up
+
+        Returns:
+            float: borrow rate
+        """
+        with self._lock:
+            if not self._lookup():
+                self.load(self.ftx_client.get_borrow_rates(), self.ftx_client.get_lending_rates())
+            return self._borrow[coin][1]
+
+    def lending_rate(self, coin: str) -> float:
+        """Upcoming lending rate for a coin
+
+        Args:
+            coin (str): coin to look up
+
+        Returns:
+            float: lending rate
+        """
+        with self._lock:
+            if not self._lookup():
+                self.load(self.ftx_client.get_borrow_rates(), self.ftx_client.get_lending_rates())
+            return self._lending[coin][1]
+
+    async def borrow_rate_async(self, coin: str) -> float:
+        await self._refresh_async()
+        return self._borrow[coin][1]
+
+    async def lending_rate_async(self, coin: str) -> float:
+        await self._refresh_async()
+        return self._lending[coin][1]
+
+    async def _refresh_async(self) -> None:
+        # concurrent lookups on an expired store share a single refresh
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            if not self._lookup():
+                self.load(*await asyncio.gather(self.ftx_client.get_borrow_rates(),
+                                                self.ftx_client.get_lending_rates()))
+
+    def _lookup(self) -> bool:
+        """Count a lookup, true if the stored rates are still current
+        """
+        if self.clock() < self._expires_at:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def load(self, borrow_list: List[dict], lending_list: List[dict]) -> None:
+        """Replace the stored rates, they stay valid until the next top of the hour
+
+        Args:
+            borrow_list: result of get_borrow_rates
+            lending_list: result of get_lending_rates
+        """
+        self._borrow = {x['coin']: [x['previous'], x['estimate']] for x in borrow_list}
+        self._lending = {x['coin']: [x['previous'], x['estimate']] for x in lending_list}
+        self._expires_at = (self.clock() // 3600 + 1) * 3600
+
+    def stats(self) -> Dict[str, float]:
+        """Lookup counters. Every lookup used to cost a request of its own,
+        now a miss costs two and a hit costs none
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'requests_saved': self.hits - self.misses,
+        }
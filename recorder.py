@@ -0,0 +1,200 @@
+"""
+Append-only columnar store for what the clients pull: quotes, rate snapshots,
+order states and fills. Every table is a directory with one flat binary file
+per column, so readers memory-map exactly the columns they scan
+"""
+import math
+import os
+import threading
+import time
+from typing import Optional, Dict, Any, Iterator, List, Sequence
+
+import numpy as np
+
+from metrics import endpoint_name
+
+TABLES = {
+    'quotes': [('time', 'f8'), ('market', 'S16'), ('bid', 'f8'), ('ask', 'f8'),
+               ('bid_size', 'f8'), ('ask_size', 'f8')],
+    # kind is borrow, lending or funding
+    'rates': [('time', 'f8'), ('coin', 'S16'), ('kind', 'S8'), ('previous', 'f8'), ('estimate', 'f8')],
+    'orders': [('time', 'f8'), ('order_id', 'i8'), ('market', 'S16'), ('side', 'S4'), ('type', 'S8'),
+               ('status', 'S16'), ('price', 'f8'), ('size', 'f8'), ('filled_size', 'f8'),
+               ('remaining_size', 'f8'), ('avg_fill_price', 'f8')],
+    'fills': [('time', 'f8'), ('fill_id', 'i8'), ('order_id', 'i8'), ('market', 'S16'), ('side', 'S4'),
+              ('price', 'f8'), ('size', 'f8'), ('fee', 'f8'), ('liquidity', 'S8')],
+}
+
+
+def _number(value: Any) -> float:
+    return math.nan if value is None else float(value)
+
+
+class Recorder:
+    """
+    Buffers records per table and appends them to the column files every
+    flush_every records (and on flush/close). Duplicate fills and unchanged
+    order states, which repeated polling returns over and over, are only
+    recorded once. Safe to share between threads
+    """
+
+    def __init__(self, directory: str, flush_every: int = 1000) -> None:
+        """Initialize recorder, appending to whatever is in the directory already
+
+        Args:
+            directory (str): where the table directories go, created if missing
+            flush_every (int): records buffered per table before they are written
+        """
+        self.directory = directory
+        self.flush_every = flush_every
+        self._buffers = {table: [] for table in TABLES}
+        self._seen_fills = set()
+        self._order_states = {}
+        self._lock = threading.Lock()
+        for table in TABLES:
+            os.makedirs(os.path.join(directory, table), exist_ok=True)
+
+    def __enter__(self) -> 'Recorder':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _append(self, table: str, row: tuple) -> None:
+        with self._lock:
+            buffer = self._buffers[table]
+            buffer.append(row)
+            if len(buffer) >= self.flush_every:
+                self._write(table)
+
+    def _write(self, table: str) -> None:
+        rows = self._buffers[table]
+        if not rows:
+            return
+        records = np.array(rows, dtype=TABLES[table])
+        for column, _ in TABLES[table]:
+            with open(os.path.join(self.directory, table, column + '.bin'), 'ab') as f:
+                records[column].tofile(f)
+        self._buffers[table] = []
+
+    def flush(self) -> None:
+        with self._lock:
+            for table in TABLES:
+                self._write(table)
+
+    def close(self) -> None:
+        self.flush()
+
+    def record_quote(self, market: str, bid: Optional[float], ask: Optional[float],
+                     bid_size: Optional[float] = None, ask_size: Optional[float] = None,
+                     at: Optional[float] = None) -> None:
+        self._append('quotes', (time.time() if at is None else at, market.encode(), _number(bid), _number(ask),
+                                _number(bid_size), _number(ask_size)))
+
+    def record_rate(self, coin: str, kind: str, previous: Optional[float], estimate: Optional[float],
+                    at: Optional[float] = None) -> None:
+        self._append('rates', (time.time() if at is None else at, coin.encode(), kind.encode(),
+                               _number(previous), _number(estimate)))
+
+    def record_order(self, order: Dict, at: Optional[float] = None) -> None:
+        state = (order.get('status'), order.get('filledSize'), order.get('price'), order.get('size'))
+        with self._lock:
+            if self._order_states.get(order['id']) == state:
+                return
+            self._order_states[order['id']] = state
+        self._append('orders', (time.time() if at is None else at, order['id'], order['market'].encode(),
+                                order['side'].encode(), order['type'].encode(), order['status'].encode(),
+                                _number(order.get('price')), _number(order.get('size')),
+                                _number(order.get('filledSize')), _number(order.get('remainingSize')),
+                                _number(order.get('avgFillPrice'))))
+
+    def record_fill(self, fill: Dict, at: Optional[float] = None) -> None:
+        with self._lock:
+            if fill['id'] in self._seen_fills:
+                return
+            self._seen_fills.add(fill['id'])
+        self._append('fills', (time.time() if at is None else at, fill['id'], fill['orderId'],
+                               fill['market'].encode(), fill['side'].encode(), _number(fill['price']),
+                               _number(fill['size']), _number(fill['fee']),
+                               (fill.get('liquidity') or '').encode()))
+
+    def record_response(self, method: str, path: str, result: Any) -> None:
+        """Record whatever is worth keeping from a client response
+
+        Args:
+            method (str): http method
+            path (str): path below the api endpoint
+            result: decoded result of the response
+        """
+        endpoint = endpoint_name(method, path)
+        if endpoint in ('GET markets/{market}', 'GET futures/{market}'):
+            self.record_quote(result['name'], result.get('bid'), result.get('ask'),
+                              result.get('bidSize'), result.get('askSize'))
+        elif endpoint == 'GET futures':
+            for future in result:
+                self.record_quote(future['name'], future.get('bid'), future.get('ask'),
+                                  future.get('bidSize'), future.get('askSize'))
+        elif endpoint in ('GET spot_margin/borrow_rates', 'GET spot_margin/lending_rates'):
+            kind = 'borrow' if 'borrow' in endpoint else 'lending'
+            for rate in result:
+                self.record_rate(rate['coin'], kind, rate.get('previous'), rate.get('estimate'))
+        elif endpoint == 'GET futures/{market}/stats':
+            self.record_rate(path.split('?')[0].split('/')[1], 'funding', None, result.get('nextFundingRate'))
+        elif endpoint in ('POST orders', 'POST orders/{id}/modify'):
+            self.record_order(result)
+        elif endpoint == 'GET orders':
+            for order in result:
+                self.record_order(order)
+        elif endpoint == 'GET fills':
+            for fill in result:
+                self.record_fill(fill)
+
+
+def read_table(directory: str, table: str, columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """Memory-map the columns of a recorded table, nothing is read until it is used
+
+    Args:
+        directory (str): recorder directory
+        table (str): one of TABLES
+        columns (list): columns to map, all by default
+
+    Returns:
+        dict: column -> read only array, all the same length
+    """
+    dtypes = dict(TABLES[table])
+    columns = list(columns or dtypes)
+    paths = {column: os.path.join(directory, table, column + '.bin') for column in columns}
+    # a crash mid flush can leave some columns a few rows longer than others
+    length = min(os.path.getsize(path) // np.dtype(dtypes[column]).itemsize if os.path.exists(path) else 0
+                 for column, path in paths.items())
+    if length == 0:
+        return {column: np.empty(0, dtype=dtypes[column]) for column in columns}
+    return {column: np.memmap(path, dtype=dtypes[column], mode='r', shape=(length,))
+            for column, path in paths.items()}
+
+
+def quote_events(directory: str, markets: Optional[List[str]] = None,
+                 chunk_size: int = 65536) -> Iterator[tuple]:
+    """Recorded quotes as backtest events, read chunk by chunk off the mapped columns.
+    REST quotes carry no sizes, unknown sizes become infinite so maker orders
+    in a replay only fill once the price moves through them
+
+    Args:
+        directory (str): recorder directory
+        markets (list): markets to replay, all by default
+        chunk_size (int): rows converted at a time
+
+    Returns:
+        iterator of (time, market, 'quote', bid, bid_size, ask, ask_size) events
+    """
+    quotes = read_table(directory, 'quotes')
+    wanted = None if markets is None else np.array([market.encode() for market in markets], dtype='S16')
+    for start in range(0, len(quotes['time']), chunk_size):
+        chunk = {column: np.asarray(values[start:start + chunk_size]) for column, values in quotes.items()}
+        keep = np.ones(len(chunk['time']), dtype=bool) if wanted is None else np.isin(chunk['market'], wanted)
+        keep &= ~(np.isnan(chunk['bid']) | np.isnan(chunk['ask']))
+        bid_size = np.where(np.isnan(chunk['bid_size']), np.inf, chunk['bid_size'])
+        ask_size = np.where(np.isnan(chunk['ask_size']), np.inf, chunk['ask_size'])
+        for i in np.flatnonzero(keep):
+            yield (float(chunk['time'][i]), chunk['market'][i].decode(), 'quote', float(chunk['bid'][i]),
+                   float(bid_size[i]), float(chunk['ask'][i]), float(ask_size[i]))
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from typing import Optional, Dict, List, Tuple
+
+import numpy as np
+
+from async_client import AsyncFtxClient
+
+CARRY_DTYPE = np.dtype([
+    ('coin', 'U16'),
+    ('borrow', 'f8'),
+    ('lend', 'f8'),
+    ('funding', 'f8'),
+    ('long_spot_carry', 'f8'),
+    ('short_spot_carry', 'f8'),
+    ('best_carry', 'f8'),
+    ('long_spot', '?'),
+])
+
+
+def align_rates(borrow_list: List[dict], lending_list: List[dict],
+                funding_rates: Dict[str, float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Line up borrow, lending and perp funding rates by coin, only coins
+    that have all three make it in
+
+    Args:
+        borrow_list: result of get_borrow_rates
+        lending_list: result of get_lending_rates
+        funding_rates: coin -> next perp funding rate
+
+    Returns:
+        tuple containing coin, borrow, lending & funding arrays
+    """
+    borrow = {x['coin']: x['estimate'] for x in borrow_list}
+    lending = {x['coin']: x['estimate'] for x in lending_list}
+    coins = sorted(coin for coin in funding_rates if coin in borrow and coin in lending)
+    return (np.array(coins, dtype='U16'),
+            np.fromiter((borrow[coin] for coin in coins), dtype='f8', count=len(coins)),
+            np.fromiter((lending[coin] for coin in coins), dtype='f8', count=len(coins)),
+            np.fromiter((funding_rates[coin] for coin in coins), dtype='f8', count=len(coins)))
+
+
+def rank_carry(coins: np.ndarray, borrow: np.ndarray, lend: np.ndarray, funding: np.ndarray,
+               allow_short_spot: bool = False) -> np.ndarray:
+    """Carry of both directions for every coin at once, ranked best first.
+    Same formulas as DeltaNeutralTrade.check_spot_vs_perp, per unit of size
+
+    Args:
+        coins: coin names
+        borrow: spot borrow rates
+        lend: spot lending rates
+        funding: perp funding rates
+        allow_short_spot (bool): rank on the better of both directions, otherwise on
+            long spot only since the strategy can't short spot yet
+
+    Returns:
+        structured array of CARRY_DTYPE sorted by carry, best first
+    """
+    table = np.empty(len(coins), dtype=CARRY_DTYPE)
+    table['coin'] = coins
+    table['borrow'] = borrow
+    table['lend'] = lend
+    table['funding'] = funding
+
+    # lend the spot we hold and pay funding on the short perp
+    table['long_spot_carry'] = lend + funding
+    # borrow spot to short it, receive funding on the long perp
+    table['short_spot_carry'] = -funding - borrow
+
+    if allow_short_spot:
+        table['long_spot'] = table['long_spot_carry'] >= table['short_spot_carry']
+        table['best_carry'] = np.where(table['long_spot'], table['long_spot_carry'], table['short_spot_carry'])
+    else:
+        table['long_spot'] = True
+        table['best_carry'] = table['long_spot_carry']
+
+    return table[np.argsort(-table['best_carry'], kind='stable')]
+
+
+def format_table(table: np.ndarray, limit: Optional[int] = 20) -> str:
+    """Render a ranked carry table for printing
+    """
+    lines = [f"{'coin':<10}{'side':<12}{'carry':>12}{'borrow':>12}{'lend':>12}{'funding':>12}"]
+    for row in table[:limit]:
+        side = 'long spot' if row['long_spot'] else 'short spot'
+        lines.append(f"{row['coin']:<10}{side:<12}{row['best_carry']:>12.6f}{row['borrow']:>12.6f}"
+                     f"{row['lend']:>12.6f}{row['funding']:>12.6f}")
+    return '\n'.join(lines)
+
+
+class CarryScanner:
+    """
+    Finds the best spot vs perp carry across every listed coin. Rates for all
+    markets are pulled concurrently over one AsyncFtxClient and ranked in a
+    single vectorized pass
+    """
+
+    def __init__(self, ftx_client: AsyncFtxClient, allow_short_spot: bool = False) -> None:
+        """Initialize scanner
+
+        Args:
+            ftx_client (AsyncFtxClient): async ftx client object
+            allow_short_spot (bool): rank short spot/long perp as well as long spot/short perp
+        """
+        self.ftx_client = ftx_client
+        self.allow_short_spot = allow_short_spot
+        self.last_scan_time = None
+
+    async def fetch(self) -> Tuple[List[dict], List[dict], Dict[str, float]]:
+        """Pull borrow rates, lending rates and the next funding rate of every perp
+
+        Returns:
+            tuple containing borrow list, lending list & coin -> funding rate
+        """
+        borrow_list, lending_list, futures = await asyncio.gather(
+            self.ftx_client.get_borrow_rates(),
+            self.ftx_client.get_lending_rates(),
+            self.ftx_client.get_all_futures(),
+        )
+
+        # only perps whose coin can be borrowed and lent are worth a stats request
+        borrowable = {x['coin'] for x in borrow_list} & {x['coin'] for x in lending_list}
+        perps = [future for future in futures
+                 if future['type'] == 'perpetual' and future['underlying'] in borrowable]
+        stats = await asyncio.gather(*[self.ftx_client.get_future_stats(future['name']) for future in perps])
+
+        funding_rates = {future['underlying']: stat['nextFundingRate'] for future, stat in zip(perps, stats)}
+        return borrow_list, lending_list, funding_rates
+
+    async def scan(self) -> np.ndarray:
+        """Fetch every rate and rank the carry of every coin
+
+        Returns:
+            structured array of CARRY_DTYPE sorted by carry, best first
+        """
+        start = time.perf_counter()
+        table = rank_carry(*align_rates(*await self.fetch()), allow_short_spot=self.allow_short_spot)
+        self.last_scan_time = time.perf_counter() - start
+        return table
+
+
+async def run_scanner(ftx_client: AsyncFtxClient, interval: float = 5) -> None:
+    scanner = CarryScanner(ftx_client)
+    while True:
+        table = await scanner.scan()
+        print(format_table(table))
+        print(f"{len(table)} markets scanned in {round(scanner.last_scan_time * 1000, 1)}ms\n")
+        await asyncio.sleep(interval)
+
+
+if __name__ == '__main__':
+    from dotenv import dotenv_values
+
+    config = dotenv_values(".env")
+
+    ftx_client = AsyncFtxClient(api_key=config['FTX_API_KEY'], api_secret=config['FTX_API_SECRET'],
+                                subaccount_name=config['SUBACCOUNT_NAME'])
+    asyncio.run(run_scanner(ftx_client))
@@ -0,0 +1,136 @@
+import asyncio
+import random
+from typing import Optional, Dict, List, Tuple
+
+from fills import SIZE_TOLERANCE
+from local_exchange import LocalFtxExchange
+
+
+class SimulatedExchange(LocalFtxExchange):
+    """
+    LocalFtxExchange that behaves like a market, for benchmarking whole trades:
+    every request pays a round trip time plus random jitter, resting orders fill
+    on their own after a random time (sometimes in two parts), market orders pay
+    slippage over the touch and every fill is charged the maker or taker fee
+    """
+
+    def __init__(self, rtt: float = .05, jitter: float = .01, maker_fill_time: float = 1.0,
+                 maker_fill_probability: float = 1.0, partial_fill_probability: float = 0.0,
+                 taker_slippage: float = 0.0, maker_fee: float = .0002, taker_fee: float = .0007,
+                 seed: Optional[int] = None, **kwargs) -> None:
+        """Initialize the simulated exchange
+
+        Args:
+            rtt (float): mean round trip time of a request in seconds
+            jitter (float): standard deviation of the round trip time in seconds
+            maker_fill_time (float): mean seconds before a resting order fills (exponentially distributed)
+            maker_fill_probability (float): chance a resting order fills at all before it is cancelled
+            partial_fill_probability (float): chance a resting order fills in two parts
+            taker_slippage (float): fraction market orders fill beyond the touch
+            maker_fee (float): fee rate charged on resting order fills
+            taker_fee (float): fee rate charged on market order fills
+            seed (int): seed for the random network and fill behavior, for repeatable runs
+            **kwargs: passed on to LocalFtxExchange
+        """
+        super().__init__(latency=rtt, **kwargs)
+        self.jitter = jitter
+        self.maker_fill_time = maker_fill_time
+        self.maker_fill_probability = maker_fill_probability
+        self.partial_fill_probability = partial_fill_probability
+        self.taker_slippage = taker_slippage
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.random = random.Random(seed)
+
+        # order id -> mid price of its market when the order arrived, to measure slippage against
+        self.arrival_mids = {}
+
+    async def _network_delay(self) -> None:
+        delay = max(0.0, self.random.gauss(self.latency, self.jitter)) / 2
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _quote(self, market: str) -> Dict:
+        return self.markets.get(market) or self.futures[market]
+
+    def _order_placed(self, order: Dict) -> None:
+        quote = self._quote(order['market'])
+        self.arrival_mids[order['id']] = (quote['bid'] + quote['ask']) / 2
+
+        if order['type'] == 'market':
+            if order['side'] == 'buy':
+                price = quote['ask'] * (1 + self.taker_slippage)
+            else:
+                price = quote['bid'] * (1 - self.taker_slippage)
+            self.fill_order(order['id'], price=price)
+        elif self.random.random() < self.maker_fill_probability:
+            size = None
+            if self.random.random() < self.partial_fill_probability:
+                size = order['size'] * self.random.uniform(.1, .9)
+            self._schedule_fill(order['id'], size)
+
+    def _schedule_fill(self, order_id: int, size: Optional[float]) -> None:
+        delay = self.random.expovariate(1 / self.maker_fill_time) if self.maker_fill_time else 0
+        self._loop.call_later(delay, self._maker_fill, order_id, size)
+
+    def _maker_fill(self, order_id: int, size: Optional[float]) -> None:
+        # the order may have been cancelled in the meantime
+        order = self.orders[order_id]
+        if order['status'] == 'closed':
+            return
+        self.fill_order(order_id, size)
+        if size is not None:
+            self._schedule_fill(order_id, None)
+
+    def fill_order(self, order_id: int, size: Optional[float] = None, price: Optional[float] = None,
+                   fee: Optional[float] = None) -> Dict:
+        """LocalFtxExchange.fill_order, charging the maker or taker fee unless a fee is given
+        """
+        order = self.orders[order_id]
+        if fee is None:
+            size = order['remainingSize'] if size is None else size
+            price = order['price'] if price is None else price
+            fee = size * price * (self.taker_fee if order['type'] == 'market' else self.maker_fee)
+        return super().fill_order(order_id, size, price, fee)
+
+    def slippage(self, fills: List[Dict]) -> float:
+        """What the fills cost against the mid price when each order arrived,
+        negative when resting orders earned the spread
+
+        Args:
+            fills (list): fills of orders sent to this exchange
+
+        Returns:
+            float: slippage in quote currency
+        """
+        cost = 0.0
+        for fill in fills:
+            direction = 1 if fill['side'] == 'buy' else -1
+            cost += direction * (fill['price'] - self.arrival_mids[fill['orderId']]) * fill['size']
+        return cost
+
+
+def unhedged_intervals(fills: List[Dict], tolerance: float = SIZE_TOLERANCE) -> List[Tuple[float, Optional[float]]]:
+    """Periods the fills of a trade leave a net position open, i.e. one leg has
+    filled and the other hasn't caught up yet
+
+    Args:
+        fills (list): fills of both legs of one underlier
+        tolerance (float): net size still counted as flat
+
+    Returns:
+        list: (start, end) fill times of every unhedged period, end is None if still open
+    """
+    intervals = []
+    net = 0.0
+    start = None
+    for fill in sorted(fills, key=lambda fill: fill['time']):
+        net += fill['size'] if fill['side'] == 'buy' else -fill['size']
+        if abs(net) > tolerance and start is None:
+            start = fill['time']
+        elif abs(net) <= tolerance and start is not None:
+            intervals.append((start, fill['time']))
+            start = None
+    if start is not None:
+        intervals.append((start, None))
+    return intervals
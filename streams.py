@@ -0,0 +1,332 @@
+import asyncio
+import hmac
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Optional, Dict, List, Iterable
+
+import aiohttp
+
+from fills import SIZE_TOLERANCE
+from orderbook import OrderBookCache
+
+
+class OrderTracker:
+    """
+    Latest state of every order and the fills seen on the private `orders`/`fills`
+    channels. Can be waited on from a plain thread or from a coroutine
+    """
+
+    def __init__(self) -> None:
+        self._orders = {}
+        self._fills = defaultdict(list)
+        self._fill_ids = set()
+        self._condition = threading.Condition()
+        self._async_waiters = set()
+
+    def on_order(self, order: dict) -> None:
+        with self._condition:
+            self._orders[order['id']] = order
+            self._notify()
+
+    def on_fill(self, fill: dict) -> None:
+        with self._condition:
+            # a fill can reach us twice, e.g. pushed and then polled
+            if fill.get('id') is not None:
+                if fill['id'] in self._fill_ids:
+                    return
+                self._fill_ids.add(fill['id'])
+            self._fills[fill['orderId']].append(fill)
+            self._notify()
+
+    def _notify(self) -> None:
+        self._condition.notify_all()
+        for loop, event in list(self._async_waiters):
+            loop.call_soon_threadsafe(event.set)
+
+    def watch(self, order_ids: Iterable) -> None:
+        """Ask for updates of the given orders, every order is pushed here so there is nothing to do
+        """
+
+    def get_order(self, order_id) -> Optional[dict]:
+        """Latest pushed state of an order, None if we haven't seen an update for it
+        """
+        return self._orders.get(order_id)
+
+    def get_fills(self, order_id) -> List[dict]:
+        return list(self._fills.get(order_id, ()))
+
+    def filled_order(self, order_ids: Iterable) -> Optional[dict]:
+        """First of the given orders that is no longer working, None if all are still open.
+        Same test as the order dropping out of the REST open orders list, an order
+        that was closed any other way also counts
+        """
+        for order_id in order_ids:
+            order = self._orders.get(order_id)
+            if order is not None and (order['remainingSize'] == 0 or order['status'] == 'closed'):
+                return order
+        return None
+
+    def filled_size(self, order_id) -> float:
+        """Total size of the fills pushed for an order so far
+        """
+        return sum(fill['size'] for fill in self._fills.get(order_id, ()))
+
+    def sizes_filled(self, expected_sizes: Dict[Any, float]) -> bool:
+        """True once every order has fills adding up to its expected size
+        """
+        return all(self.filled_size(order_id) >= size - SIZE_TOLERANCE
+                   for order_id, size in expected_sizes.items())
+
+    def wait_for_sizes(self, expected_sizes: Dict[Any, float], timeout: float) -> bool:
+        """Block until the fills of every order add up to its expected size
+
+        Args:
+            expected_sizes (dict): order id -> size
+            timeout (float): seconds to wait at most
+
+        Returns:
+            bool: true if all sizes are filled
+        """
+        return self.wait_until(lambda: self.sizes_filled(expected_sizes), timeout)
+
+    async def wait_for_sizes_async(self, expected_sizes: Dict[Any, float], timeout: float) -> bool:
+        """Coroutine version of wait_for_sizes
+        """
+        return await self.wait_until_async(lambda: self.sizes_filled(expected_sizes), timeout)
+
+    def wait_until(self, predicate: Callable[[], bool], timeout: float) -> bool:
+        """Block until predicate is true, it is checked again on every pushed update
+
+        Args:
+            predicate (callable): condition on the tracker's state
+            timeout (float): seconds to wait at most
+
+        Returns:
+            bool: result of the last check of predicate
+        """
+        with self._condition:
+            return self._condition.wait_for(predicate, timeout)
+
+    async def wait_until_async(self, predicate: Callable[[], bool], timeout: float) -> bool:
+        """Coroutine version of wait_until
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        self._async_waiters.add(waiter)
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                waiter[1].clear()
+                result = predicate()
+                remaining = deadline - time.monotonic()
+                if result or remaining <= 0:
+                    return result
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._async_waiters.discard(waiter)
+
+    def wait_for_fill(self, order_ids: Iterable, timeout: float) -> Optional[dict]:
+        """Block until one of the given orders is filled (or otherwise closed)
+
+        Args:
+            order_ids: ids of the orders to watch
+            timeout (float): seconds to wait at most
+
+        Returns:
+            dict: the filled order, None on timeout
+        """
+        order_ids = list(order_ids)
+        self.wait_until(lambda: self.filled_order(order_ids) is not None, timeout)
+        return self.filled_order(order_ids)
+
+    async def wait_for_fill_async(self, order_ids: Iterable, timeout: float) -> Optional[dict]:
+        """Coroutine version of wait_for_fill
+        """
+        order_ids = list(order_ids)
+        await self.wait_until_async(lambda: self.filled_order(order_ids) is not None, timeout)
+        return self.filled_order(order_ids)
+
+
+class FtxWebsocketClient:
+    """
+    Authenticated connection to the FTX websocket API, subscribes to our
+    `orders` and `fills` channels and feeds them into an OrderTracker, and to the
+    `orderbook` channel of any markets given, which feeds an OrderBookCache.
+    Reconnects on its own; `generation` goes up on every (re)connect so callers
+    know when updates may have been missed and a REST check is due
+    """
+    _ENDPOINT = 'wss://ftx.com/ws/'
+
+    def __init__(self, api_key=None, api_secret=None, subaccount_name=None, endpoint=None,
+                 markets: Iterable[str] = (), ping_interval: float = 15, reconnect_delay: float = 1) -> None:
+        self._endpoint = endpoint or self._ENDPOINT
+        self._markets = list(markets)
+        self._api_key = api_key
+        self._api_secret = api_secret
+        self._subaccount_name = subaccount_name
+        self._ping_interval = ping_interval
+        self._reconnect_delay = reconnect_delay
+
+        self.tracker = OrderTracker()
+        self.books = OrderBookCache()
+        self._resyncing = set()
+        self.connected = False
+        self.generation = 0
+
+        self._ws = None
+        self._task = None
+        self._stopping = False
+        self._stop_event = None
+        self._loop = None
+        self._thread = None
+        self._subscribed = threading.Event()
+
+    def start(self, timeout: float = 10) -> 'FtxWebsocketClient':
+        """Run the connection on its own event loop in a background thread,
+        for use by the blocking DeltaNeutralTrade. Waits for the first subscription
+        """
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.run())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        self._subscribed.wait(timeout)
+        return self
+
+    def stop(self) -> None:
+        """Close a connection started with start()
+        """
+        if self._thread is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), self._loop).result()
+        self._thread.join()
+        self._thread = None
+
+    async def connect(self, timeout: float = 10) -> 'FtxWebsocketClient':
+        """Run the connection as a task on the current event loop, for use by
+        AsyncDeltaNeutralTrade. Waits for the first subscription
+        """
+        self._task = asyncio.ensure_future(self.run())
+        deadline = time.monotonic() + timeout
+        while not self.connected and time.monotonic() < deadline and not self._task.done():
+            await asyncio.sleep(.01)
+        return self
+
+    async def close(self) -> None:
+        self._stopping = True
+        if self._stop_event is not None:
+            self._stop_event.set()
+        if self._ws is not None:
+            await self._ws.close()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def run(self) -> None:
+        """Connect, subscribe and dispatch messages until close() is called
+        """
+        self._stopping = False
+        self._stop_event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        async with aiohttp.ClientSession() as session:
+            while not self._stopping:
+                try:
+                    async with session.ws_connect(self._endpoint, heartbeat=self._ping_interval) as ws:
+                        self._ws = ws
+                        for market in self._markets:
+                            await ws.send_json({'op': 'subscribe', 'channel': 'orderbook', 'market': market})
+                        if self._api_key:
+                            await self._login(ws)
+                            await ws.send_json({'op': 'subscribe', 'channel': 'orders'})
+                            await ws.send_json({'op': 'subscribe', 'channel': 'fills'})
+                        else:
+                            # market data only, nothing else to wait for
+                            self._on_connected()
+                        await self._read(ws)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    print("Websocket error: " + str(error))
+                finally:
+                    self._ws = None
+                    self.connected = False
+                    self.books.invalidate()
+                    self._resyncing.clear()
+                if not self._stopping:
+                    try:
+                        await asyncio.wait_for(self._stop_event.wait(), self._reconnect_delay)
+                    except asyncio.TimeoutError:
+                        pass
+
+    async def _login(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        ts = int(time.time() * 1000)
+        args = {
+            'key': self._api_key,
+            'sign': hmac.new(self._api_secret.encode(), f'{ts}websocket_login'.encode(), 'sha256').hexdigest(),
+            'time': ts,
+        }
+        if self._subaccount_name:
+            args['subaccount'] = self._subaccount_name
+        await ws.send_json({'op': 'login', 'args': args})
+
+    def subscribe_orderbook(self, market: str) -> None:
+        """Start keeping a book for another market, safe to call from any thread
+
+        Args:
+            market (str): market name
+        """
+        if market in self._markets:
+            return
+        self._markets.append(market)
+        if self._ws is not None:
+            self._loop.call_soon_threadsafe(asyncio.ensure_future, self._ws.send_json(
+                {'op': 'subscribe', 'channel': 'orderbook', 'market': market}))
+
+    async def _read(self, ws: aiohttp.ClientWebSocketResponse) -> None:
+        async for message in ws:
+            if message.type != aiohttp.WSMsgType.TEXT:
+                break
+            resync_market = self._handle(message.json())
+            if resync_market is not None:
+                # resubscribing makes the exchange send a fresh partial
+                print("Orderbook checksum mismatch, resyncing " + resync_market)
+                await ws.send_json({'op': 'unsubscribe', 'channel': 'orderbook', 'market': resync_market})
+                await ws.send_json({'op': 'subscribe', 'channel': 'orderbook', 'market': resync_market})
+
+    def _on_connected(self) -> None:
+        self.generation += 1
+        self.connected = True
+        self._subscribed.set()
+
+    def _handle(self, message: Dict) -> Optional[str]:
+        """Dispatch one message
+
+        Returns:
+            str: market whose book needs a resync, if any
+        """
+        if message.get('channel') == 'orderbook' and message['type'] in ('partial', 'update'):
+            market = message['market']
+            if self.books.on_message(message):
+                self._resyncing.discard(market)
+            elif message['data']['action'] == 'partial' or market not in self._resyncing:
+                # updates that land while waiting for the new partial don't trigger another resync
+                self._resyncing.add(market)
+                return market
+        elif message['type'] == 'subscribed':
+            if message['channel'] == 'fills':
+                # orders is subscribed first, so both channels are live now
+                self._on_connected()
+        elif message['type'] == 'update':
+            if message['channel'] == 'orders':
+                self.tracker.on_order(message['data'])
+            elif message['channel'] == 'fills':
+                self.tracker.on_fill(message['data'])
+        elif message['type'] == 'error':
+            raise aiohttp.ClientError(f"{message.get('code')} {message.get('msg')}")
+        elif message['type'] == 'info' and message.get('code') == 20001:
+            # exchange is restarting its websocket servers, reconnect
+            raise aiohttp.ClientError(message.get('msg'))
+        return None
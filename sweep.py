@@ -0,0 +1,278 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Dict, Iterable, List, Sequence, Union
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from backtest import Backtest, Event, read_events, synthetic_events
+
+# where the events come from: a csv path for read_events, or synthetic_events arguments
+EventSource = Union[str, Dict]
+
+TIMEOUT_ERROR = "Timeout waiting for order execution"
+
+# events of the source each worker process replays, loaded once per process
+_worker_events = None
+
+
+def load_events(source: EventSource) -> List[Event]:
+    if isinstance(source, str):
+        return list(read_events(source))
+    return list(synthetic_events(**source))
+
+
+def parameter_grid(quote_offsets: Sequence[float], poll_intervals: Sequence[float],
+                   order_timeouts: Sequence[float]) -> List[Dict[str, float]]:
+    """Every combination of the given DeltaNeutralTrade parameters
+    """
+    return [{'quote_offset': quote_offset, 'poll_interval': poll_interval, 'order_timeout': order_timeout}
+            for quote_offset, poll_interval, order_timeout in
+            itertools.product(quote_offsets, poll_intervals, order_timeouts)]
+
+
+def market_arrays(events: Iterable[Event], market: str) -> Dict[str, np.ndarray]:
+    """Quotes and trades of one market as arrays
+
+    Returns:
+        dict: quote_time, bid, ask, trade_time, trade_price and trade_side (1 buy aggressor, -1 sell)
+    """
+    quotes, trades = [], []
+    for event in events:
+        if event[1] != market:
+            continue
+        if event[2] == 'quote':
+            quotes.append((event[0], event[3], event[5]))
+        else:
+            trades.append((event[0], event[4], 1 if event[3] == 'buy' else -1))
+    quotes = np.array(quotes, dtype=float).reshape(-1, 3)
+    trades = np.array(trades, dtype=float).reshape(-1, 3)
+    return {'quote_time': quotes[:, 0], 'bid': quotes[:, 1], 'ask': quotes[:, 2],
+            'trade_time': trades[:, 0], 'trade_price': trades[:, 1], 'trade_side': trades[:, 2]}
+
+
+def _bucketed(arrays: Dict[str, np.ndarray], times: np.ndarray, dt: float) -> Dict[str, np.ndarray]:
+    """Touch at the start of every bucket plus the lowest price anything sold at (sell
+    aggressors and asks) and highest price anything bought at (buy aggressors and bids) in it
+    """
+    quote_index = np.maximum(np.searchsorted(arrays['quote_time'], times, 'right') - 1, 0)
+    low = np.full(len(times), np.inf)
+    high = np.full(len(times), -np.inf)
+
+    quote_bucket = ((arrays['quote_time'] - times[0]) // dt).astype(int)
+    np.minimum.at(low, quote_bucket, arrays['ask'])
+    np.maximum.at(high, quote_bucket, arrays['bid'])
+    trade_bucket = ((arrays['trade_time'] - times[0]) // dt).astype(int)
+    sells = arrays['trade_side'] < 0
+    np.minimum.at(low, trade_bucket[sells], arrays['trade_price'][sells])
+    np.maximum.at(high, trade_bucket[~sells], arrays['trade_price'][~sells])
+    return {'bid': arrays['bid'][quote_index], 'ask': arrays['ask'][quote_index], 'low': low, 'high': high}
+
+
+def _buckets_to_fill(extremes: np.ndarray, starts: np.ndarray, window: int, limits: np.ndarray,
+                     buy: bool) -> np.ndarray:
+    """Buckets after each start until the price first trades through each limit, window if it doesn't
+
+    Args:
+        extremes (np.ndarray): per bucket low (buy orders) or high (sell orders)
+        starts (np.ndarray): start buckets
+        window (int): buckets to look ahead
+        limits (np.ndarray): starts x offsets limit prices
+        buy (bool): limits are buy orders
+
+    Returns:
+        np.ndarray: starts x offsets bucket counts, 1 is the bucket right after the start
+    """
+    ahead = sliding_window_view(extremes, window + 1)[starts][:, 1:]
+    if buy:
+        best = np.minimum.accumulate(ahead, axis=1)
+        return np.stack([(best > limits[:, [i]]).sum(axis=1) for i in range(limits.shape[1])], axis=1) + 1
+    best = np.maximum.accumulate(ahead, axis=1)
+    return np.stack([(best < limits[:, [i]]).sum(axis=1) for i in range(limits.shape[1])], axis=1) + 1
+
+
+def fast_filter(events: Iterable[Event], quote_offsets: Sequence[float], poll_intervals: Sequence[float],
+                order_timeouts: Sequence[float], underlier: str = 'ETH', trade_size: float = .01,
+                rtt: float = .05, maker_fee: float = .0002, taker_fee: float = .0007,
+                samples: int = 500) -> List[Dict[str, float]]:
+    """Vectorized first pass over a whole grid, to pick the combinations worth a full replay.
+    Opens a long spot/short perp trade at evenly spaced start times, a maker order counts
+    as filled as soon as the price trades through it (no queue), the other leg is then
+    hedged at the touch once the next poll notices. Savings are against market orders on
+    both legs at the start, including fees
+
+    Args:
+        events (iterable): events covering the underlier's spot market and perp
+        quote_offsets (list): maker order offsets to try
+        poll_intervals (list): monitor poll intervals to try
+        order_timeouts (list): monitor timeouts to try
+        underlier (str): underlier to trade
+        trade_size (float): size of the trade
+        rtt (float): seconds from noticing a fill to the hedge executing
+        maker_fee (float): fee rate on maker fills
+        taker_fee (float): fee rate on market orders
+        samples (int): start times to average over
+
+    Returns:
+        list: a dict per combination with quote_offset, poll_interval, order_timeout, fill_rate,
+            timeout_rate, mean_fill_time and expected_savings (per attempt), best savings first
+    """
+    events = list(events)
+    spot = market_arrays(events, underlier + '/USD')
+    perp = market_arrays(events, underlier + '-PERP')
+    offsets = np.asarray(quote_offsets, dtype=float)
+    polls = np.asarray(poll_intervals, dtype=float)
+    timeouts = np.asarray(order_timeouts, dtype=float)
+
+    dt = float(polls.min())
+    start_time = max(spot['quote_time'][0], perp['quote_time'][0])
+    end_time = max(spot['quote_time'][-1], perp['quote_time'][-1])
+    times = np.arange(start_time, end_time + dt, dt)
+    window = int(np.ceil((timeouts.max() + polls.max() + rtt) / dt))
+    if len(times) <= window + 1:
+        raise Exception("Not enough data for the longest timeout")
+    spot = _bucketed(spot, times, dt)
+    perp = _bucketed(perp, times, dt)
+    starts = np.linspace(0, len(times) - window - 2, min(samples, len(times) - window - 1)).astype(int)
+
+    # long spot bid*(1 - offset), short perp ask*(1 + offset), as initiate_trade quotes them
+    buy_limits = spot['bid'][starts, None] * (1 - offsets[None, :])
+    sell_limits = perp['ask'][starts, None] * (1 + offsets[None, :])
+    buy_buckets = _buckets_to_fill(spot['low'], starts, window, buy_limits, buy=True)
+    sell_buckets = _buckets_to_fill(perp['high'], starts, window, sell_limits, buy=False)
+    buy_first = buy_buckets <= sell_buckets
+    fill_time = np.minimum(buy_buckets, sell_buckets) * dt  # starts x offsets
+
+    # starts x offsets x polls: bucket the hedge executes in
+    noticed = np.ceil(fill_time[:, :, None] / polls[None, None, :] - 1e-9) * polls[None, None, :]
+    hedge_at = np.minimum(starts[:, None, None] + np.round((noticed + rtt) / dt).astype(int), len(times) - 1)
+
+    fee_saving = (taker_fee - maker_fee) * spot['bid'][starts, None, None]
+    # spot filled first: bought under the ask, sell the perp at whatever its bid is by then
+    spot_first = (spot['ask'][starts, None] - buy_limits)[:, :, None] + \
+        perp['bid'][hedge_at] - perp['bid'][starts, None, None]
+    # perp filled first: sold over the bid, buy spot at whatever its ask is by then
+    perp_first = (sell_limits - perp['bid'][starts, None])[:, :, None] + \
+        spot['ask'][starts, None, None] - spot['ask'][hedge_at]
+    savings = (np.where(buy_first[:, :, None], spot_first, perp_first) + fee_saving) * trade_size
+
+    # starts x offsets x polls x timeouts
+    filled = np.broadcast_to(fill_time[:, :, None, None] <= timeouts[None, None, None, :],
+                             savings.shape + timeouts.shape)
+    fill_rate = filled.mean(axis=0)
+    expected_savings = (savings[:, :, :, None] * filled).mean(axis=0)
+    # mean over the starts that filled, NaN where none did (nanmean would warn about those)
+    fill_counts = filled.sum(axis=0)
+    fill_time_sums = np.where(filled, noticed[:, :, :, None], 0.0).sum(axis=0)
+    mean_fill_time = np.where(fill_counts > 0, fill_time_sums / np.maximum(fill_counts, 1), np.nan)
+
+    results = []
+    for (i, offset), (j, poll), (k, timeout) in itertools.product(enumerate(offsets), enumerate(polls),
+                                                                 enumerate(timeouts)):
+        results.append({
+            'quote_offset': float(offset),
+            'poll_interval': float(poll),
+            'order_timeout': float(timeout),
+            'fill_rate': float(fill_rate[i, j, k]),
+            'timeout_rate': float(1 - fill_rate[i, j, k]),
+            'mean_fill_time': float(mean_fill_time[i, j, k]),
+            'expected_savings': float(expected_savings[i, j, k]),
+        })
+    return sorted(results, key=lambda result: -result['expected_savings'])
+
+
+def _init_worker(source: EventSource) -> None:
+    global _worker_events
+    _worker_events = load_events(source)
+
+
+def _replay(task: Dict) -> Dict:
+    """Full replay of one combination in a worker process, market_orders tasks are the baseline
+    """
+    params = task['params']
+    backtest = Backtest(_worker_events, market_orders=task['market_orders'],
+                        trade_kwargs=params, **task['backtest_kwargs'])
+    summary = backtest.run(task['max_round_trips'])
+    completed = [round_trip for round_trip in backtest.round_trips if round_trip['error'] is None]
+    timeouts = sum(1 for round_trip in backtest.round_trips if round_trip['error'] == TIMEOUT_ERROR)
+    return dict(params, market_orders=task['market_orders'], round_trips=summary['round_trips'],
+                completed=summary['completed'], failed=summary['failed'],
+                timeout_rate=timeouts / summary['round_trips'] if summary['round_trips'] else None,
+                # two maker waits (open & close) per round trip
+                mean_fill_time=sum(round_trip['monitor_seconds'] for round_trip in completed) / 2 / len(completed)
+                if completed else None,
+                mean_fees=sum(round_trip['fees'] for round_trip in completed) / len(completed) if completed else None,
+                mean_pnl=summary['mean_pnl'])
+
+
+def sweep(source: EventSource, grid: List[Dict[str, float]], workers: Optional[int] = None,
+          max_round_trips: Optional[int] = None, **backtest_kwargs) -> List[Dict]:
+    """Replay the events for every combination of the grid across a process pool,
+    plus once with market orders as the baseline to compare against
+
+    Args:
+        source (str or dict): csv path or synthetic_events arguments, loaded once per worker
+        grid (list): DeltaNeutralTrade parameter dicts, e.g. from parameter_grid
+        workers (int): processes to use, all cores by default
+        max_round_trips (int): stop each replay after this many round trips
+        **backtest_kwargs: passed on to Backtest, e.g. rtt or tick_size
+
+    Returns:
+        list: a dict per combination with its parameters, round_trips, completed, failed,
+            timeout_rate, mean_fill_time, mean_fees, mean_pnl, fee_savings and
+            pnl_vs_market (per completed round trip against the baseline), best pnl_vs_market first
+    """
+    tasks = [{'params': params, 'market_orders': False, 'max_round_trips': max_round_trips,
+              'backtest_kwargs': backtest_kwargs} for params in grid]
+    tasks.append({'params': {}, 'market_orders': True, 'max_round_trips': max_round_trips,
+                  'backtest_kwargs': backtest_kwargs})
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(source,)) as executor:
+        results = list(executor.map(_replay, tasks))
+
+    baseline = results.pop()
+    for result in results:
+        result['fee_savings'] = baseline['mean_fees'] - result['mean_fees'] \
+            if None not in (baseline['mean_fees'], result['mean_fees']) else None
+        result['pnl_vs_market'] = result['mean_pnl'] - baseline['mean_pnl'] \
+            if None not in (baseline['mean_pnl'], result['mean_pnl']) else None
+    return sorted(results, key=lambda result: -float('inf') if result['pnl_vs_market'] is None
+                  else -result['pnl_vs_market'])
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Sweep quote offset, poll interval & timeout over replayed data")
+    parser.add_argument('events', nargs='?', help='csv of events, synthetic events are generated without one')
+    parser.add_argument('--hours', type=float, default=6, help='length of the synthetic replay')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--offsets', type=float, nargs='+', default=[.0001, .0002, .0005, .001, .002])
+    parser.add_argument('--poll-intervals', type=float, nargs='+', default=[.05, .1, .25, .5, 1])
+    parser.add_argument('--timeouts', type=float, nargs='+', default=[10, 30, 100, 300])
+    parser.add_argument('--top', type=int, default=10, help='combinations from the fast pass to replay in full')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--rtt', type=float, default=.05)
+    parser.add_argument('--output', help='write fast pass and replay results json here')
+    args = parser.parse_args()
+
+    source = args.events or {'seconds': args.hours * 3600, 'seed': args.seed}
+    candidates = fast_filter(load_events(source), args.offsets, args.poll_intervals, args.timeouts, rtt=args.rtt)
+    print(f"Fast pass over {len(candidates)} combinations, replaying the best {args.top}")
+    grid = [{key: candidate[key] for key in ('quote_offset', 'poll_interval', 'order_timeout')}
+            for candidate in candidates[:args.top]]
+    results = sweep(source, grid, workers=args.workers, rtt=args.rtt)
+
+    print(f"{'offset':>8}{'poll':>7}{'timeout':>9}{'trips':>7}{'timeouts':>10}{'fill s':>9}"
+          f"{'fee saved':>11}{'vs market':>11}")
+    for result in results:
+        print(f"{result['quote_offset']:>8.4f}{result['poll_interval']:>7.2f}{result['order_timeout']:>9.0f}"
+              f"{result['round_trips']:>7}{result['timeout_rate'] or 0:>10.2%}{result['mean_fill_time'] or 0:>9.2f}"
+              f"{result['fee_savings'] or 0:>11.5f}{result['pnl_vs_market'] or 0:>11.5f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'fast_pass': candidates, 'replays': results}, f, indent=2)
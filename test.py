@@ -1,8 +1,39 @@
 from textwrap import fill
+import asyncio
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 import threading
 import time
-from main import DeltaNeutralTrade, FtxClient
+import warnings
+import numpy as np
+from main import DeltaNeutralTrade, FtxClient, LegRejectedError
+from async_client import AsyncFtxClient
+from async_trade import AsyncDeltaNeutralTrade
+from local_exchange import LocalFtxExchange
+from local_bybit import LocalBybitExchange
+from bybit_client import AsyncBybitClient, split_order_id
+from exchange import AsyncExchange
+from streams import FtxWebsocketClient
+from orderbook import OrderBookCache, StaleQuoteError, book_checksum
+from rates import RateStore
+from scanner import CarryScanner, align_rates, rank_carry
+from fills import FILLS_PAGE_SIZE, FillLedger, FillTimeoutError, iter_fills, read_fills, read_fills_async, wait_for_fills
+from portfolio import Portfolio
+from ratelimit import CANCEL, PLACE, DATA, RateLimiter, request_priority
+from metrics import LatencyHistogram, endpoint_name
+from simulator import SimulatedExchange, unhedged_intervals
+from backtest import Backtest, ReplayExchange, ReplayFinished, synthetic_events
+from sweep import fast_filter, parameter_grid, sweep
+from recorder import Recorder, quote_events, read_table
+from journal import TradeJournal
+from flatten import flatten, flatten_async
+from quoting import AdaptiveQuoter, read_decisions, replay_decisions
+import cli
 
 
 
@@ -124,7 +155,8 @@ class TestTradingStrategyWithMockClient(unittest.TestCase):
         self.ftx_client.set_order_status(0,10,0,1074.9,1,10,0,1075.8)
         self.trade.execute_leftover_order()
 
-        self.ftx_client.set_fills(0, 1074.9, -0.5, 10, 1, 1075.8, 0.3, 10)
+        # closing sell on ETH/USD is order 1, closing buy on ETH-PERP is order 0
+        self.ftx_client.set_fills(1, 1074.9, -0.5, 10, 0, 1075.8, 0.3, 10)
         self.trade.update_fills(False)
 
         #Expected pnl should be:
@@ -134,8 +166,1509 @@ class TestTradingStrategyWithMockClient(unittest.TestCase):
         # -> -34 + 31.4 = -2.6
         self.assertAlmostEqual(self.trade.calc_trade_pnl(), -2.6)
 
+    def test_legs_placed_concurrently(self):
+        self.trade.long_spot = True
+        self.ftx_client.set_latency(.05)
+        self.trade.initiate_trade(True)
+
+        # second leg goes out before the first one is acknowledged
+        self.assertLess(self.trade.leg_timing['send_gap'], .05)
+        self.assertLess(self.trade.leg_timing['elapsed'], .1)
+        self.assertEqual(self.trade.long_order['id'], 0)
+        self.assertEqual(self.trade.short_order['id'], 1)
+
+    def test_rejected_leg_cancels_other(self):
+        self.trade.long_spot = True
+        self.ftx_client.set_rejected_market("ETH-PERP")
+
+        with self.assertRaises(LegRejectedError):
+            self.trade.initiate_trade(True)
+        self.assertEqual(self.ftx_client.cancelled, [0])
+
+    def test_rejected_market_leg_unwinds_other(self):
+        self.trade.long_spot = True
+        self.ftx_client.set_rejected_market("ETH/USD")
+
+        with self.assertRaises(LegRejectedError):
+            self.trade.initiate_trade_market_order(True)
+        self.assertEqual(self.ftx_client.placed[-1], ("ETH-PERP", "buy", None, 10, 'market'))
+
+    def test_execute_leftover_expects_maker_and_market_fills(self):
+        self.trade.long_spot = True
+        self.trade.initiate_trade(True)
+        # short maker order filled, long maker order got 6 of 10 before we pulled it
+        self.trade.short_order = None
+        self.trade.long_order = {'id': 0, 'remainingSize': 4}
+        self.ftx_client.set_order(2, 4, 3, 10)
+        self.trade.execute_leftover_order()
+
+        self.assertEqual(self.ftx_client.placed[-1], ("ETH/USD", "buy", None, 4, 'market'))
+        self.assertEqual(self.trade.pending_fills, {1: ("ETH-PERP", 10), 0: ("ETH/USD", 6), 2: ("ETH/USD", 4)})
+
+
+class TestAsyncClientWithLocalExchange(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange(latency=.05).start()
+        self.ftx_client = AsyncFtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+        self.trade = AsyncDeltaNeutralTrade("ETH", self.ftx_client, 10)
+
+    async def asyncTearDown(self):
+        await self.ftx_client.close()
+
+    def tearDown(self):
+        self.exchange.stop()
+
+    async def test_matches_sync_client(self):
+        sync_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+        self.assertEqual(await self.ftx_client.get_future("ETH-PERP"), sync_client.get_future("ETH-PERP"))
+        self.assertEqual(await self.ftx_client.get_single_market("ETH/USD"), sync_client.get_single_market("ETH/USD"))
+        self.assertEqual(await self.ftx_client.get_borrow_rates(), sync_client.get_borrow_rates())
+        self.assertEqual(await self.ftx_client.get_positions(), sync_client.get_positions())
+
+    async def test_bad_signature_raises(self):
+        client = AsyncFtxClient(api_key='key', api_secret='wrong', endpoint=self.exchange.url)
+        with self.assertRaisesRegex(Exception, 'Not logged in'):
+            await client.get_balances()
+        await client.close()
+
+    async def test_pre_trade_is_one_round_trip(self):
+        # warm the pool so connection setup isn't counted
+        await asyncio.gather(*[self.ftx_client.get_balances() for _ in range(5)])
+        self.exchange.max_in_flight = 0
+
+        start = time.monotonic()
+        spot_quote, perp_quote = await self.trade.pre_trade()
+        elapsed = time.monotonic() - start
+
+        self.assertTrue(self.trade.long_spot)
+        self.assertEqual(spot_quote, (1078.4, 1078.9))
+        self.assertEqual(perp_quote, (1078.8, 1078.9))
+        self.assertEqual(self.exchange.max_in_flight, 5)
+        self.assertLess(elapsed, 2 * self.exchange.latency)
+
+    async def test_monitor_and_execute_leftover(self):
+        quotes = await self.trade.pre_trade()
+        await self.trade.initiate_trade(True, quotes=quotes)
+        self.assertEqual(self.trade.long_order['price'], 1078.4 * .9995)
+        self.assertEqual(self.trade.short_order['price'], 1078.9 * 1.0005)
+
+        self.exchange.fill_order(self.trade.short_order['id'])
+        await self.trade.order_status_monitor(True)
+        self.assertIsNone(self.trade.short_order)
+
+        await self.trade.execute_leftover_order()
+        self.assertEqual(self.trade.long_order['type'], 'market')
+        self.assertEqual(self.trade.long_order['remainingSize'], 0)
+        self.assertEqual(self.exchange.fills[-1]['price'], 1078.9)
+
+    async def test_flatten_is_three_round_trips(self):
+        sync_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+        sync_client.place_order("ETH/USD", "buy", None, 3, 'market')
+        sync_client.place_order("ETH-PERP", "sell", None, 3, 'market')
+        sync_client.place_order("ETH-PERP", "sell", 2000, 3, 'limit')
+
+        start = time.monotonic()
+        report = await flatten_async(self.ftx_client)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(report['errors'], [])
+        self.assertEqual(len(report['orders']), 2)
+        self.assertEqual(self.exchange.positions[0]['netSize'], 0)
+        self.assertLess(elapsed, 4 * self.exchange.latency + .05)
+        # positions and balances are only read once the cancel has come back
+        sent = {(method, path.split('?')[0]): at for method, path, at in self.exchange.requests}
+        self.assertGreaterEqual(min(sent['GET', '/api/positions'], sent['GET', '/api/wallet/balances']),
+                                sent['DELETE', '/api/orders'] + self.exchange.latency)
+
+    async def test_timeout_cancels_both_legs_when_one_cancel_fails(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = TradeJournal(directory + '/trades.journal')
+            trade = AsyncDeltaNeutralTrade("ETH", self.ftx_client, 10, journal=journal, poll_interval=.02,
+                                           order_timeout=.05)
+            trade.long_spot = True
+            trade._journal_start(market_orders=False)
+            await trade.initiate_trade(True)
+            long_id, short_id = trade.long_order['id'], trade.short_order['id']
+            cancel_order = self.ftx_client.cancel_order
+
+            async def long_leg_just_filled(order_id):
+                if order_id == long_id:
+                    raise Exception('Order already closed')
+                return await cancel_order(order_id)
+
+            self.ftx_client.cancel_order = long_leg_just_filled
+            with self.assertRaisesRegex(Exception, 'Timeout waiting for order execution'):
+                await trade.order_status_monitor(True)
+
+            self.assertEqual(self.exchange.orders[short_id]['status'], 'closed')
+            self.assertEqual(journal.open_trades(), {})
+            journal.close()
+
+    async def test_rejected_leg_cancels_other(self):
+        self.trade.long_spot = True
+        self.exchange.rejected_markets.add("ETH-PERP")
+
+        with self.assertRaisesRegex(LegRejectedError, 'Order rejected'):
+            await self.trade.initiate_trade(True)
+        self.assertEqual([order['status'] for order in self.exchange.orders.values()], ['closed'])
+        self.assertLess(self.trade.leg_timing['send_gap'], self.exchange.latency)
+
+
+class ExchangeConformance:
+    """
+    What the async strategy engine needs from an exchange adapter, run against
+    each adapter and its local stand-in by the test cases below
+    """
+    exchange_type = LocalFtxExchange
+
+    def make_client(self, api_secret='secret') -> object:
+        raise NotImplementedError
+
+    def exchange_order_id(self, order_id) -> int:
+        """Id the stand-in knows an order returned by the adapter by
+        """
+        raise NotImplementedError
+
+    def setUp(self):
+        self.exchange = self.exchange_type().start()
+        self.client = self.make_client()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    def tearDown(self):
+        self.exchange.stop()
+
+    async def test_quotes_and_rates(self):
+        self.assertIsInstance(self.client, AsyncExchange)
+        spot, perp, stats, borrow_rates = await asyncio.gather(
+            self.client.get_single_market("ETH/USD"), self.client.get_future("ETH-PERP"),
+            self.client.get_future_stats("ETH-PERP"), self.client.get_borrow_rates())
+
+        self.assertEqual((spot['name'], spot['bid'], spot['ask']), ("ETH/USD", 1078.4, 1078.9))
+        self.assertEqual((perp['name'], perp['bid'], perp['ask']), ("ETH-PERP", 1078.8, 1078.9))
+        self.assertAlmostEqual(stats['nextFundingRate'], .003)
+        self.assertIn('ETH', [rate['coin'] for rate in borrow_rates])
+
+    async def test_resting_order_lifecycle(self):
+        for market in ("ETH/USD", "ETH-PERP"):
+            order = await self.client.place_order(market, "buy", 1070, 2, post_only=True)
+            self.assertEqual((order['market'], order['side'], order['price'], order['remainingSize']),
+                             (market, "buy", 1070, 2))
+            self.assertNotEqual(order['status'], 'closed')
+            self.assertIn(order['id'], [open_order['id'] for open_order in await self.client.get_order_status()])
+
+            self.exchange.fill_order(self.exchange_order_id(order['id']), .5)
+            order = await self.client.get_order(order['id'])
+            self.assertEqual((order['filledSize'], order['remainingSize'], order['avgFillPrice']), (.5, 1.5, 1070))
+
+            order = await self.client.modify_order(existing_order_id=order['id'], price=1071)
+            self.assertEqual((order['market'], order['price'], order['remainingSize']), (market, 1071, 1.5))
+
+            await self.client.cancel_order(order['id'])
+            self.assertEqual((await self.client.get_order(order['id']))['status'], 'closed')
+            self.assertNotIn(order['id'], [open_order['id'] for open_order in await self.client.get_order_status()])
+
+    async def test_market_orders_fill_at_touch(self):
+        spot_order, perp_order = await asyncio.gather(
+            self.client.place_order("ETH/USD", "buy", None, 1, 'market'),
+            self.client.place_order("ETH-PERP", "sell", None, 1, 'market'))
+        spot_fills, perp_fills = await asyncio.gather(
+            self.client.get_fills("ETH/USD", order_id=spot_order['id']),
+            self.client.get_fills("ETH-PERP", order_id=perp_order['id']))
+
+        for fills, order, side, price in ((spot_fills, spot_order, "buy", 1078.9),
+                                          (perp_fills, perp_order, "sell", 1078.8)):
+            self.assertEqual([(fill['orderId'], fill['side'], fill['price'], fill['size'], fill['liquidity'])
+                              for fill in fills], [(order['id'], side, price, 1, 'taker')])
+        self.assertEqual([(position['future'], position['netSize']) for position in await self.client.get_positions()],
+                         [("ETH-PERP", -1)])
+        balances = {balance['coin']: balance['total'] for balance in await self.client.get_balances()}
+        self.assertEqual((balances['ETH'], balances['USD']), (1, -1078.9))
+
+    async def test_fills_are_read_across_pages(self):
+        self.exchange.fills_page_size = 2
+        for market, side, price in (("ETH-PERP", "sell", 1090), ("ETH/USD", "buy", 1070)):
+            order = await self.client.place_order(market, side, price, 5, post_only=True)
+            for _ in range(5):
+                self.exchange.fill_order(self.exchange_order_id(order['id']), 1)
+                # apart by more than the millisecond bybit times fills to
+                await asyncio.sleep(.002)
+            # later fills of other orders on the market, bybit spot fills can't be asked for by order
+            for _ in range(2):
+                await self.client.place_order(market, side, None, 1, 'market')
+                await asyncio.sleep(.002)
+
+            fills = await read_fills_async(self.client, market, order['id'], size=5, page_size=2)
+            self.assertEqual(len({fill['id'] for fill in fills}), 5)
+            self.assertEqual({fill['orderId'] for fill in fills}, {order['id']})
+            self.assertEqual([fill['time'] for fill in fills], sorted((fill['time'] for fill in fills), reverse=True))
+
+    async def test_fills_of_every_market_are_read_across_pages(self):
+        # what the shared order poller reads: no market, a full page of spot fills newer than a perp fill
+        spot_order, perp_order = await asyncio.gather(
+            self.client.place_order("ETH/USD", "buy", 1070, FILLS_PAGE_SIZE + 20, post_only=True),
+            self.client.place_order("ETH-PERP", "sell", 1090, 2, post_only=True))
+        now = time.time()
+        fill_times = [(perp_order, now - 10)] + [(spot_order, now - 5 + i * .01) for i in range(FILLS_PAGE_SIZE + 20)]
+        for order, fill_time in fill_times + [(perp_order, now)]:
+            self.exchange.fill_order(self.exchange_order_id(order['id']), 1)['time'] = fill_time
+
+        fills = await read_fills_async(self.client, start_time=now - 60)
+        self.assertEqual(len({fill['id'] for fill in fills}), FILLS_PAGE_SIZE + 22)
+        self.assertEqual(sum(fill['market'] == "ETH-PERP" for fill in fills), 2)
+
+    async def test_cancel_orders_by_market(self):
+        await asyncio.gather(self.client.place_order("ETH/USD", "buy", 1070, 1, post_only=True),
+                             self.client.place_order("ETH-PERP", "sell", 1090, 1, post_only=True))
+
+        await self.client.cancel_orders("ETH-PERP")
+        self.assertEqual([order['market'] for order in await self.client.get_order_status()], ["ETH/USD"])
+        await self.client.cancel_orders()
+        self.assertEqual(await self.client.get_order_status(), [])
+
+    async def test_errors_raise(self):
+        self.exchange.rejected_markets.add("ETH-PERP")
+        with self.assertRaisesRegex(Exception, 'Order rejected'):
+            await self.client.place_order("ETH-PERP", "sell", 1090, 1)
+
+        client = self.make_client(api_secret='wrong')
+        with self.assertRaisesRegex(Exception, 'Not logged in'):
+            await client.get_balances()
+        await client.close()
+
+    async def test_market_order_trade(self):
+        pnl = await NoWaitExitTrade("ETH", self.client, 1).trade_market_orders()
+        # long spot at the ask, out at the bid, the perp the other way round
+        self.assertAlmostEqual(pnl, (1078.4 - 1078.9) + (1078.8 - 1078.9))
+        self.assertEqual(self.exchange.positions[0]['netSize'], 0)
+
+    async def test_resumes_journaled_trade(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = TradeJournal(directory + '/trades.journal')
+            trade = AsyncDeltaNeutralTrade("ETH", self.client, 1, journal=journal)
+            trade.long_spot = True
+            trade._journal_start(market_orders=True)
+            await trade.initiate_trade_market_order(True)
+            # process dies here, a new one picks it up
+            journal.close()
+
+            journal = TradeJournal(directory + '/trades.journal')
+            (state,) = journal.open_trades().values()
+            self.assertEqual(state['step'], 'placed')
+            pnl = await NoWaitExitTrade("ETH", self.client, 1, journal=journal).resume(state)
+            self.assertAlmostEqual(pnl, (1078.4 - 1078.9) + (1078.8 - 1078.9))
+            self.assertEqual(journal.open_trades(), {})
+            journal.close()
+
+    async def test_maker_trade_hedges_leftover(self):
+        trade = AsyncDeltaNeutralTrade("ETH", self.client, 1)
+        quotes = await trade.pre_trade()
+        await trade.initiate_trade(True, quotes=quotes)
+        self.assertAlmostEqual(trade.long_order['price'], 1078.4 * .9995)
+
+        self.exchange.fill_order(self.exchange_order_id(trade.short_order['id']))
+        await trade.order_status_monitor(True)
+        self.assertIsNone(trade.short_order)
+
+        await trade.execute_leftover_order()
+        self.assertEqual((trade.long_order['type'], trade.long_order['remainingSize']), ('market', 0))
+        self.assertEqual(self.exchange.fills[-1]['price'], 1078.9)
+
+    async def chase_leftover_leg(self, long_spot, long_market, touch):
+        trade = AsyncDeltaNeutralTrade("ETH", self.client, 2, hedge_mode='chase', chase_deadline=5, poll_interval=.02)
+        trade.long_spot = long_spot
+        await trade.initiate_trade(True)
+        self.exchange.fill_order(self.exchange_order_id(trade.short_order['id']))
+        self.exchange.fill_order(self.exchange_order_id(trade.long_order['id']), .5)
+        await trade.order_status_monitor(True)
+
+        async def fill_at_the_touch():
+            while True:
+                await asyncio.sleep(.02)
+                order = next((order for order in self.exchange.orders.values()
+                              if order['market'] == long_market and order['status'] != 'closed'), None)
+                if order is not None and order['price'] == touch:
+                    self.exchange.fill_order(order['id'])
+                    return
+
+        await asyncio.gather(trade.execute_leftover_order(), fill_at_the_touch())
+        await trade.await_fills()
+        await trade.update_fills(True)
+
+        self.assertEqual((trade.hedge_stats['amends'], trade.hedge_stats['taker_size']), (1, 0))
+        self.assertEqual(trade.fill_timeouts, [])
+        self.assertEqual(sum(size for market, size in trade.pending_fills.values() if market == long_market), 2)
+        self.assertEqual(trade.long_open_fill['size'], 2)
+        self.assertAlmostEqual(trade.long_open_fill['price'], (.5 * touch * .9995 + 1.5 * touch) / 2)
+        self.assertTrue(all(fill['liquidity'] == 'maker' for fill in self.exchange.fills))
+
+    async def test_chase_amends_leftover_leg_to_the_touch(self):
+        await self.chase_leftover_leg(True, "ETH/USD", 1078.4)
+
+    async def test_chase_amends_leftover_perp_leg_to_the_touch(self):
+        # bybit amends perp orders in place, the order keeps its id and its fills
+        await self.chase_leftover_leg(False, "ETH-PERP", 1078.8)
+
+    async def test_quoter_places_and_requotes_makers(self):
+        quoter = AdaptiveQuoter(requote_interval=0)
+        trade = AsyncDeltaNeutralTrade("ETH", self.client, 1, quoter=quoter, poll_interval=.02, order_timeout=5)
+        trade.long_spot = True
+        await trade.initiate_trade(True)
+        self.assertEqual((trade.long_order['price'], trade.short_order['price']), (1078.4, 1078.9))
+        first_long_id = trade.long_order['id']
+
+        self.exchange.markets['ETH/USD'].update(bid=1080, ask=1080.5)
+        await trade._requote_makers(True)
+        self.assertGreater(trade.long_order['price'], 1078.4)
+        self.assertLess(trade.long_order['price'], 1080)
+        self.assertEqual(trade.maker_chains[0][-1][0], trade.long_order['id'])
+        self.assertIn(first_long_id, trade.trade_orders)
+        self.assertEqual([decision['kind'] for decision in quoter.decisions],
+                         ['quote', 'quote', 'requote', 'requote'])
+
+        # the exchange pulls the requoted order as post only, the monitor places it again
+        rejected_id = trade.long_order['id']
+        self.exchange.orders[self.exchange_order_id(rejected_id)]['status'] = 'closed'
+        asyncio.get_running_loop().call_later(.2, self.exchange.fill_order,
+                                              self.exchange_order_id(trade.short_order['id']))
+        await trade.order_status_monitor(True)
+        self.assertIsNone(trade.short_order)
+        self.assertNotIn(trade.long_order['id'], (first_long_id, rejected_id))
+        self.assertNotEqual(trade.long_order['status'], 'closed')
+        self.assertEqual(trade.maker_chains[0][-1][0], trade.long_order['id'])
+
+    async def test_flatten(self):
+        await asyncio.gather(self.client.place_order("ETH/USD", "buy", None, 3, 'market'),
+                             self.client.place_order("ETH-PERP", "sell", None, 3, 'market'),
+                             self.client.place_order("ETH-PERP", "sell", 2000, 3))
+
+        report = await flatten_async(self.client)
+        self.assertEqual((report['errors'], len(report['orders'])), ([], 2))
+        self.assertEqual(self.exchange.positions[0]['netSize'], 0)
+        self.assertEqual(next(balance for balance in self.exchange.balances if balance['coin'] == 'ETH')['total'], 0)
+        self.assertEqual(await self.client.get_order_status(), [])
+
+
+class TestFtxAdapterConformance(ExchangeConformance, unittest.IsolatedAsyncioTestCase):
+    def make_client(self, api_secret='secret'):
+        return AsyncFtxClient(api_key='key', api_secret=api_secret, endpoint=self.exchange.url)
+
+    def exchange_order_id(self, order_id):
+        return order_id
+
+
+class TestBybitAdapterConformance(ExchangeConformance, unittest.IsolatedAsyncioTestCase):
+    exchange_type = LocalBybitExchange
+
+    def make_client(self, api_secret='secret'):
+        return AsyncBybitClient(api_key='key', api_secret=api_secret, endpoint=self.exchange.url)
+
+    def exchange_order_id(self, order_id):
+        return int(split_order_id(order_id)[1])
+
+    async def test_spot_market_orders_are_ioc_limits_through_the_touch(self):
+        order = await self.client.place_order("ETH/USD", "sell", None, 1, 'market')
+        self.assertEqual(order['type'], 'market')
+        self.assertEqual(self.exchange.orders[self.exchange_order_id(order['id'])]['price'], 1076.24)
+        self.assertEqual(self.exchange.fills[-1]['price'], 1078.4)
+
+        self.exchange.markets["ETH/USD"]['bid'] = 1070
+        order = await self.client.place_order("ETH/USD", "sell", 1075, 1, ioc=True)
+        self.assertEqual((order['status'], order['filledSize']), ('closed', 0))
+
+
+class TestFillLedger(unittest.TestCase):
+    def fill(self, fill_id, order_id, price, size, fee=0.0, market="ETH/USD"):
+        return {'id': fill_id, 'orderId': order_id, 'market': market, 'price': price, 'size': size, 'fee': fee}
+
+    def test_duplicates_ignored(self):
+        ledger = FillLedger()
+        self.assertEqual(ledger.add_all([self.fill(1, 10, 100, 1), self.fill(2, 10, 102, 3)]), 2)
+        self.assertEqual(ledger.add_all([self.fill(2, 10, 102, 3), self.fill(3, 11, 99, 1)]), 1)
+
+        self.assertEqual(ledger.order_fill(10), {'orderId': 10, 'size': 4, 'price': 101.5, 'fee': 0.0})
+        self.assertEqual(len(ledger.fills_for_market("ETH/USD")), 3)
+        self.assertIsNone(ledger.order_fill(12))
+
+    def test_leg_spans_maker_and_market_orders(self):
+        ledger = FillLedger()
+        ledger.add(self.fill(1, 10, 100, 6, fee=-.06))
+        # assigning after the fact picks up what is already recorded
+        ledger.assign(10, 'long_open')
+        ledger.assign(11, 'long_open')
+        ledger.add(self.fill(2, 11, 105, 4, fee=.2))
+
+        leg = ledger.leg_fill('long_open')
+        self.assertEqual(leg['size'], 10)
+        self.assertAlmostEqual(leg['price'], 102)
+        self.assertAlmostEqual(leg['fee'], .14)
+        self.assertEqual(leg['orderIds'], [10, 11])
+        self.assertIsNone(ledger.leg_fill('short_open'))
+
+    def test_reassigned_order_keeps_old_fills_on_old_leg(self):
+        ledger = FillLedger()
+        ledger.assign(10, 'long_open')
+        ledger.add(self.fill(1, 10, 100, 1))
+        ledger.assign(10, 'short_close')
+        ledger.add(self.fill(2, 10, 90, 1))
+
+        self.assertEqual(ledger.leg_fill('long_open')['price'], 100)
+        self.assertEqual(ledger.leg_fill('short_close')['price'], 90)
+
+
+class TestFillPagingWithLocalExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+        self.exchange.fills_page_size = 3
+        self.ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+        # a busy account: ten fills of our order among forty of other orders, two at every timestamp
+        for i in range(50):
+            order_id = 7 if i % 5 == 0 else 100 + i
+            self.exchange.fills.append({'id': i, 'orderId': order_id, 'market': "ETH-PERP", 'side': "buy",
+                                        'price': 1000.0 + i, 'size': 1.0, 'fee': 0.0, 'time': 1000.0 + i // 2})
+
+    def tearDown(self):
+        self.exchange.stop()
+
+    def fills_requests(self):
+        return len([request for request in self.exchange.requests if request[1].startswith('/api/fills')])
+
+    def test_pages_through_an_order(self):
+        fills = read_fills(self.ftx_client, "ETH-PERP", 7, page_size=3)
+        self.assertEqual([fill['id'] for fill in fills], list(range(45, -1, -5)))
+        # each page starts with the last fill of the one before
+        self.assertEqual(self.fills_requests(), 5)
+
+    def test_stops_once_size_is_accounted_for(self):
+        fills = read_fills(self.ftx_client, "ETH-PERP", 7, size=4, page_size=3)
+        # the second page overshoots, the rest are never asked for
+        self.assertEqual([fill['id'] for fill in fills], [45, 40, 35, 30, 25])
+        self.assertEqual(self.fills_requests(), 2)
+
+    def test_time_window_with_shared_timestamps(self):
+        fills = list(iter_fills(self.ftx_client, "ETH-PERP", start_time=1010, end_time=1019, page_size=3))
+        self.assertEqual([fill['id'] for fill in fills], list(range(39, 19, -1)))
+
+    def test_update_fills_reads_past_the_first_page(self):
+        self.exchange.fills_page_size = FILLS_PAGE_SIZE
+        self.exchange.fills += [{'id': 100 + i, 'orderId': 8, 'market': "ETH-PERP", 'side': "sell", 'price': 1000.0,
+                                 'size': .1, 'fee': 0.0, 'time': 2000.0 + i} for i in range(FILLS_PAGE_SIZE + 20)]
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, FILLS_PAGE_SIZE / 10 + 2)
+        trade.long_spot = True
+        trade._select_markets(True)
+        trade.trade_orders = {8: "ETH-PERP"}
+        trade.pending_fills = {8: ("ETH-PERP", trade.trade_size)}
+        trade.update_fills(True)
+        self.assertAlmostEqual(trade.short_open_fill['size'], trade.trade_size)
+        self.assertEqual(self.fills_requests(), 2)
+
+
+class TestFillWaitWithLocalExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+        self.ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+
+    def tearDown(self):
+        self.exchange.stop()
+
+    def test_market_orders_confirmed_without_fixed_wait(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10)
+        trade.long_spot = True
+        trade.initiate_trade_market_order(True)
+        trade.await_fills()
+
+        self.assertLess(trade.fill_wait_times[0], .5)
+        self.assertGreater(trade.fill_wait_saved(), 1.5)
+        self.assertEqual(self.ftx_client.get_fills("ETH/USD", order_id=trade.long_order['id'])[0]['size'], 10)
+
+    def test_fills_confirmed_by_the_wait_are_not_read_again(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10)
+        trade.long_spot = True
+        trade.initiate_trade_market_order(True)
+        trade.await_fills()
+        requests = len(self.exchange.requests)
+        trade.update_fills(True)
+
+        self.assertEqual(len(self.exchange.requests), requests)
+
+        self.assertEqual((trade.long_open_fill['size'], trade.short_open_fill['size']), (10, 10))
+        self.assertEqual(trade.confirmed_orders, set())
+
+    def test_fill_timeout_is_kept_apart_from_fill_waits(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, fill_timeout=.1)
+        order = self.ftx_client.place_order("ETH-PERP", "sell", 1090, 10, 'limit')
+        trade.pending_fills = {order['id']: ("ETH-PERP", 10)}
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            trade.await_fills()
+
+        self.assertEqual((trade.fill_wait_times, trade.fill_timeouts), ([], [.1]))
+        self.assertIsNone(trade.metrics.stage_histogram('fill_wait'))
+        self.assertEqual(trade.metrics.stage_histogram('fill_timeout').count, 1)
+        self.assertNotIn("Fills confirmed", output.getvalue())
+
+    def test_leg_fill_covers_part_filled_maker_order(self):
+        for _ in range(200):
+            # unrelated account history
+            self.ftx_client.place_order("ETH/USD", "buy", None, 1, 'market')
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10)
+        trade.long_spot = True
+        trade.initiate_trade(True)
+
+        self.exchange.fill_order(trade.short_order['id'], price=1080)
+        self.exchange.fill_order(trade.long_order['id'], size=6, price=1078)
+        trade.order_status_monitor(True)
+        trade.long_order = self.ftx_client.get_order_status()[0]
+        trade.execute_leftover_order()
+        trade.update_fills(True)
+
+        # 6 @ 1078 on the maker order, 4 @ 1078.9 on the market order
+        self.assertEqual(trade.long_open_fill['size'], 10)
+        self.assertAlmostEqual(trade.long_open_fill['price'], (6 * 1078 + 4 * 1078.9) / 10)
+        self.assertEqual(len(trade.long_open_fill['orderIds']), 2)
+        self.assertEqual(trade.short_open_fill['price'], 1080)
+        fills_requests = [request[1] for request in self.exchange.requests if request[1].startswith('/api/fills')]
+        self.assertTrue(all('orderId=' in path for path in fills_requests))
+
+    def _open_order(self, market):
+        return next(order for order in self.exchange.orders.values()
+                    if order['market'] == market and order['status'] != 'closed')
+
+    def test_chase_amends_leftover_leg_to_the_touch(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, hedge_mode='chase', chase_deadline=5,
+                                  poll_interval=.02)
+        trade.long_spot = True
+        trade.initiate_trade(True)
+        self.exchange.fill_order(trade.short_order['id'], price=1080)
+        self.exchange.fill_order(trade.long_order['id'], size=4)
+        trade.order_status_monitor(True)
+        threading.Timer(.2, lambda: self.exchange.fill_order(self._open_order("ETH/USD")['id'])).start()
+        trade.execute_leftover_order()
+        trade.await_fills()
+        trade.update_fills(True)
+
+        self.assertEqual(trade.hedge_stats['amends'], 1)
+        self.assertEqual(trade.hedge_stats['taker_size'], 0)
+        # 4 before the amend, 6 at the bid after it
+        self.assertEqual(trade.long_open_fill['size'], 10)
+        self.assertAlmostEqual(trade.long_open_fill['price'], (4 * 1078.4 * .9995 + 6 * 1078.4) / 10)
+        self.assertEqual(len(trade.long_open_fill['orderIds']), 2)
+        self.assertTrue(all(fill['liquidity'] == 'maker' for fill in self.exchange.fills))
+
+    def test_chase_takes_what_is_left_at_the_deadline(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, hedge_mode='chase', chase_deadline=.2,
+                                  poll_interval=.02)
+        trade.long_spot = True
+        trade.initiate_trade(True)
+        self.exchange.fill_order(trade.short_order['id'], price=1080)
+        trade.order_status_monitor(True)
+        trade.execute_leftover_order()
+        trade.await_fills()
+        trade.update_fills(True)
+
+        self.assertEqual(trade.hedge_stats['taker_size'], 10)
+        self.assertGreaterEqual(trade.hedge_stats['seconds'], .2)
+        self.assertEqual(trade.long_open_fill['size'], 10)
+        self.assertEqual(trade.long_open_fill['price'], 1078.9)
+
+    def test_waits_for_the_whole_size(self):
+        order = self.ftx_client.place_order("ETH-PERP", "sell", 1080, 10, 'limit')
+        self.exchange.fill_order(order['id'], size=4)
+        threading.Timer(.2, self.exchange.fill_order, [order['id'], 6]).start()
+
+        waited = wait_for_fills(self.ftx_client, {order['id']: ("ETH-PERP", 10)}, timeout=2)
+        self.assertGreaterEqual(waited, .2)
+        self.assertLess(waited, 1)
+
+    def test_deadline(self):
+        order = self.ftx_client.place_order("ETH-PERP", "sell", 1080, 10, 'limit')
+        self.exchange.fill_order(order['id'], size=4)
+        with self.assertRaises(FillTimeoutError):
+            wait_for_fills(self.ftx_client, {order['id']: ("ETH-PERP", 10)}, timeout=.2)
+
+
+class TestFlattenWithLocalExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+        self.exchange.list_underlier('BTC', spot_quote=(20000, 20001), perp_quote=(20001, 20002))
+        self.ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+
+    def tearDown(self):
+        self.exchange.stop()
+
+    def test_cancel_orders_by_market(self):
+        spot_order = self.ftx_client.place_order("ETH/USD", "buy", 1000, 1, 'limit')
+        perp_order = self.ftx_client.place_order("ETH-PERP", "sell", 2000, 1, 'limit')
+        self.ftx_client.cancel_orders("ETH-PERP")
+        self.assertEqual([order['id'] for order in self.ftx_client.get_order_status()], [spot_order['id']])
+        self.ftx_client.cancel_orders()
+        self.assertEqual(self.ftx_client.get_order_status(), [])
+        self.assertEqual(self.exchange.orders[perp_order['id']]['status'], 'closed')
+
+    def test_flatten_every_underlier(self):
+        for coin, size in (("ETH", 2), ("BTC", .1)):
+            self.ftx_client.place_order(coin + "/USD", "buy", None, size, 'market')
+            self.ftx_client.place_order(coin + "-PERP", "sell", None, size, 'market')
+            self.ftx_client.place_order(coin + "-PERP", "sell", 50000, size, 'limit', post_only=True)
+
+        report = flatten(self.ftx_client)
+
+        self.assertEqual(report['errors'], [])
+        self.assertEqual(sorted((order['market'], order['side']) for order in report['orders']),
+                         [("BTC-PERP", "buy"), ("BTC/USD", "sell"), ("ETH-PERP", "buy"), ("ETH/USD", "sell")])
+        self.assertEqual(self.ftx_client.get_order_status(), [])
+        self.assertTrue(all(abs(position['netSize']) < 1e-9 for position in self.ftx_client.get_positions()))
+        self.assertTrue(all(abs(balance['total']) < 1e-9 for balance in self.ftx_client.get_balances()
+                            if balance['coin'] != 'USD'))
+
+    def test_flatten_only_given_underliers(self):
+        for coin in ("ETH", "BTC"):
+            self.ftx_client.place_order(coin + "-PERP", "sell", None, 1, 'market')
+        report = flatten(self.ftx_client, underliers=["BTC"])
+        self.assertEqual([order['market'] for order in report['orders']], ["BTC-PERP"])
+        self.assertEqual({position['future']: position['netSize'] for position in self.exchange.positions},
+                         {"ETH-PERP": -1, "BTC-PERP": 0})
+
+
+class TestAdaptiveQuoter(unittest.TestCase):
+    def test_joins_or_steps_inside_touch_when_calm(self):
+        quoter = AdaptiveQuoter()
+        self.assertEqual(quoter.quote("ETH/USD", "buy", 1078.4, 1078.9, at=0), 1078.4)
+        # 20x our size queued at the ask, step half the spread inside it
+        price = quoter.quote("ETH/USD", "sell", 1078.4, 1078.9, 5, 20, size=1, at=1)
+        self.assertAlmostEqual(price, 1078.9 * (1 - .5 * .5 / 1078.65))
+        self.assertGreater(price, 1078.4)
+
+    def test_backs_off_when_volatile(self):
+        quoter = AdaptiveQuoter(max_offset=.01)
+        for i in range(20):
+            mid = 1000 + (10 if i % 2 else -10)
+            quoter.quote("ETH-PERP", "buy", mid - .1, mid + .1, at=i * .1)
+        decision = quoter.decisions[-1]
+        self.assertGreater(decision['safety'], 0)
+        self.assertLess(decision['price'], decision['bid'])
+
+    def test_requotes_only_when_market_moves_away(self):
+        quoter = AdaptiveQuoter()
+        self.assertIsNone(quoter.requote("ETH/USD", "buy", 1078.4, 1078.0, 1078.4, at=0))
+        # the jump itself counts as volatility, so the new price keeps back from the bid
+        price = quoter.requote("ETH/USD", "buy", 1078.4, 1080, 1080.5, at=1)
+        self.assertGreater(price, 1078.4 * 1.0002)
+        self.assertLess(price, 1080)
+
+    def test_log_replays(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = directory + '/quotes.jsonl'
+            with AdaptiveQuoter(log_path=path) as quoter:
+                for i in range(10):
+                    mid = 1000 + i % 3
+                    quoter.quote("ETH-PERP", "buy", mid - .05, mid + .05, 5, 5, 1, at=i * .1)
+                quoter.requote("ETH-PERP", "buy", 999, 1002, 1002.1, at=1)
+            decisions = list(read_decisions(path))
+
+        self.assertEqual(len(decisions), 11)
+        for logged, replayed in replay_decisions(decisions, AdaptiveQuoter()):
+            self.assertEqual(logged['price'], replayed['price'])
+        replayed = replay_decisions(decisions, AdaptiveQuoter(reject_z=0))
+        self.assertNotEqual([logged['price'] for logged, _ in replayed], [new['price'] for _, new in replayed])
+
+
+class TestAdaptiveQuotesWithLocalExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+        self.ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+
+    def tearDown(self):
+        self.exchange.stop()
+
+    def test_quotes_at_touch_and_requotes_moved_away_order(self):
+        quoter = AdaptiveQuoter(requote_interval=0)
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, quoter=quoter, poll_interval=.02, order_timeout=5)
+        trade.long_spot = True
+        trade.initiate_trade(True)
+        self.assertEqual(trade.long_order['price'], 1078.4)
+        self.assertEqual(trade.short_order['price'], 1078.9)
+        first_long_id = trade.long_order['id']
+
+        self.exchange.markets['ETH/USD'].update(bid=1080, ask=1080.5)
+        trade._requote_makers(True)
+        self.assertGreater(trade.long_order['price'], 1078.4)
+        self.assertLess(trade.long_order['price'], 1080)
+        self.assertNotEqual(trade.long_order['id'], first_long_id)
+        self.assertEqual(trade.maker_chains[0][-1][0], trade.long_order['id'])
+        self.assertIn(first_long_id, trade.trade_orders)
+        self.assertEqual([decision['kind'] for decision in quoter.decisions],
+                         ['quote', 'quote', 'requote', 'requote'])
+
+        threading.Timer(.1, self.exchange.fill_order, [trade.long_order['id']]).start()
+        trade.order_status_monitor(True)
+        self.assertIsNone(trade.long_order)
+
+    def test_fills_before_a_requote_are_expected_on_the_old_order(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 2, quoter=AdaptiveQuoter(requote_interval=0),
+                                  poll_interval=.02, order_timeout=5, fill_timeout=2)
+        trade.long_spot = True
+        trade.initiate_trade(True)
+        first_long_id, short_id = trade.long_order['id'], trade.short_order['id']
+        self.exchange.fill_order(first_long_id, .5)
+        self.exchange.markets['ETH/USD'].update(bid=1080, ask=1080.5)
+        trade._requote_makers(True)
+        self.assertNotEqual(trade.long_order['id'], first_long_id)
+
+        self.exchange.fill_order(short_id)
+        trade.order_status_monitor(True)
+        trade.execute_leftover_order()
+        trade.await_fills()
+
+        self.assertEqual(trade.pending_fills, {short_id: ("ETH-PERP", 2), first_long_id: ("ETH/USD", .5),
+                                               trade.long_order['id']: ("ETH/USD", 1.5)})
+        self.assertEqual(trade.fill_timeouts, [])
 
+        trade.update_fills(True)
+        self.assertAlmostEqual(trade.long_open_fill['size'], 2)
 
+    def test_post_only_cancel_is_placed_again(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, quoter=AdaptiveQuoter(), poll_interval=.02,
+                                  order_timeout=5)
+        trade.long_spot = True
+        trade.initiate_trade(True)
+        rejected_id = trade.long_order['id']
+        # the exchange pulled it as post only
+        self.exchange.orders[rejected_id]['status'] = 'closed'
+        threading.Timer(.2, self.exchange.fill_order, [trade.short_order['id']]).start()
+        trade.order_status_monitor(True)
+
+        self.assertIsNone(trade.short_order)
+        self.assertNotEqual(trade.long_order['id'], rejected_id)
+        self.assertEqual(trade.long_order['status'], 'open')
+        self.assertEqual(trade.maker_chains[0][-1][0], trade.long_order['id'])
+
+
+class TestSimulatedExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = SimulatedExchange(rtt=.02, jitter=.005, maker_fill_time=.1, taker_slippage=.001,
+                                          seed=1).start()
+        self.ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+
+    def tearDown(self):
+        self.exchange.stop()
+
+    def test_unhedged_intervals(self):
+        fills = [{'side': 'buy', 'size': 1, 'time': 1}, {'side': 'sell', 'size': .4, 'time': 2},
+                 {'side': 'sell', 'size': .6, 'time': 3}, {'side': 'sell', 'size': 1, 'time': 5}]
+        self.assertEqual(unhedged_intervals(fills), [(1, 3), (5, None)])
+
+    def test_maker_orders_fill_with_fee(self):
+        order = self.ftx_client.place_order("ETH-PERP", "sell", 1080, 10, 'limit')
+        wait_for_fills(self.ftx_client, {order['id']: ("ETH-PERP", 10)}, timeout=5)
+
+        fill = self.ftx_client.get_fills("ETH-PERP", order_id=order['id'])[0]
+        self.assertAlmostEqual(fill['fee'], 1080 * 10 * self.exchange.maker_fee)
+        # sold 1.15 above the 1078.85 mid
+        self.assertAlmostEqual(self.exchange.slippage([fill]), -11.5)
+
+    def test_market_order_trade(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 1)
+        trade.long_spot = True
+        trade.initiate_trade_market_order(True)
+        trade.await_fills()
+        trade.update_fills(True)
+
+        self.assertAlmostEqual(trade.long_open_fill['price'], 1078.9 * 1.001)
+        self.assertAlmostEqual(trade.long_open_fill['fee'], 1078.9 * 1.001 * self.exchange.taker_fee)
+        self.assertEqual(len(unhedged_intervals(self.exchange.fills)), 1)
+        self.assertIsNotNone(unhedged_intervals(self.exchange.fills)[0][1])
+
+
+class TestReplayExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = ReplayExchange([
+            (0, 'ETH/USD', 'quote', 1078.4, 5, 1078.9, 5),
+            (0, 'ETH-PERP', 'quote', 1078.8, 5, 1078.9, 5),
+            (1, 'ETH-PERP', 'trade', 'sell', 1078.8, 3, None),
+            (2, 'ETH-PERP', 'trade', 'sell', 1078.8, 4, None),
+            (3, 'ETH-PERP', 'trade', 'sell', 1078.7, 1, None),
+            (100, 'ETH-PERP', 'quote', 1078.8, 5, 1078.9, 5),
+        ], rtt=.1)
+
+    def test_fills_by_queue_position(self):
+        order = self.exchange.place_order("ETH-PERP", "buy", 1078.8, 5, 'limit', post_only=True)
+        self.assertAlmostEqual(self.exchange.clock(), .1)
+
+        # 5 queued ahead, the first trade only eats into them
+        self.exchange.sleep(1)
+        self.assertEqual(self.exchange.get_fills("ETH-PERP", order_id=order['id']), [])
+        self.exchange.sleep(1)
+        self.assertAlmostEqual(self.exchange.get_fills("ETH-PERP", order_id=order['id'])[0]['size'], 2)
+        # traded through, the rest fills
+        self.exchange.sleep(1)
+        fills = self.exchange.get_fills("ETH-PERP", order_id=order['id'])
+        self.assertAlmostEqual(sum(fill['size'] for fill in fills), 5)
+        self.assertTrue(all(fill['price'] == 1078.8 and fill['liquidity'] == 'maker' for fill in fills))
+        self.assertEqual(self.exchange.get_order_status(), [])
+
+    def test_improving_order_is_first_in_queue(self):
+        order = self.exchange.place_order("ETH-PERP", "sell", 1078.85, 2, 'limit', post_only=True)
+        self.exchange.sleep(1)
+        self.assertEqual(self.exchange.get_order_status()[0]['id'], order['id'])
+        self.exchange.place_order("ETH-PERP", "buy", None, 2, 'market')
+        self.assertEqual(self.exchange.fills[-1]['price'], 1078.9)
+        self.assertAlmostEqual(self.exchange.fills[-1]['fee'], 2 * 1078.9 * self.exchange.taker_fee)
+
+    def test_post_only_order_that_would_take_is_cancelled(self):
+        order = self.exchange.place_order("ETH/USD", "buy", 1079, 1, 'limit', post_only=True)
+        self.assertEqual(order['status'], 'closed')
+        self.assertEqual(self.exchange.fills, [])
+
+    def test_replay_finished(self):
+        with self.assertRaises(ReplayFinished):
+            self.exchange.sleep(200)
+
+    def test_backtest_round_trips(self):
+        summary = Backtest(synthetic_events(seconds=600, seed=1)).run()
+        self.assertGreater(summary['completed'], 10)
+        self.assertLessEqual(summary['virtual_seconds'], 600)
+        summary = Backtest(synthetic_events(seconds=600, seed=1), market_orders=True).run(max_round_trips=5)
+        self.assertEqual(summary['completed'], 5)
+        # crossing the spread on both legs both ways
+        self.assertLess(summary['mean_pnl'], 0)
+
+
+class TestSweep(unittest.TestCase):
+    def test_fast_filter(self):
+        with warnings.catch_warnings():
+            # combinations that never fill have a NaN fill time, not a warning
+            warnings.simplefilter('error')
+            results = fast_filter(synthetic_events(seconds=900, seed=2), [.0002, .001, .005], [.1, 1], [5, 60])
+        self.assertEqual(len(results), 12)
+        fill_rates = {(result['quote_offset'], result['poll_interval'], result['order_timeout']): result['fill_rate']
+                      for result in results}
+        # further from the touch fills less often, waiting longer fills more often
+        self.assertGreaterEqual(fill_rates[(.0002, .1, 60)], fill_rates[(.005, .1, 60)])
+        self.assertGreaterEqual(fill_rates[(.001, .1, 60)], fill_rates[(.001, .1, 5)])
+        self.assertEqual(fill_rates[(.001, .1, 60)], fill_rates[(.001, 1, 60)])
+
+    def test_sweep_replays_every_combination(self):
+        grid = parameter_grid([.0002, .001], [.1], [100])
+        results = sweep({'seconds': 300, 'seed': 1}, grid, workers=1, max_round_trips=3)
+        self.assertEqual(sorted(result['quote_offset'] for result in results), [.0002, .001])
+        for result in results:
+            self.assertEqual(result['round_trips'], 3)
+            self.assertIsNotNone(result['pnl_vs_market'])
+
+
+class TestRecorderWithLocalExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.recorder = Recorder(self.directory.name, flush_every=2)
+        self.ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url,
+                                    recorder=self.recorder)
+
+    def tearDown(self):
+        self.exchange.stop()
+        self.directory.cleanup()
+
+    def test_records_responses(self):
+        self.ftx_client.get_single_market("ETH/USD")
+        self.ftx_client.get_future("ETH-PERP")
+        self.ftx_client.get_borrow_rates()
+        self.ftx_client.get_future_stats("ETH-PERP")
+        order = self.ftx_client.place_order("ETH-PERP", "sell", None, 2, 'market')
+        # polled twice, recorded once
+        self.ftx_client.get_fills("ETH-PERP")
+        self.ftx_client.get_fills("ETH-PERP", order_id=order['id'])
+        self.recorder.close()
+
+        quotes = read_table(self.directory.name, 'quotes')
+        self.assertIsInstance(quotes['bid'], np.memmap)
+        self.assertEqual(list(quotes['market']), [b'ETH/USD', b'ETH-PERP'])
+        self.assertEqual(list(quotes['ask']), [1078.9, 1078.9])
+        rates = read_table(self.directory.name, 'rates', ['kind', 'estimate'])
+        self.assertEqual(list(rates['kind']), [b'borrow', b'funding'])
+        self.assertEqual(rates['estimate'][1], .003)
+        fills = read_table(self.directory.name, 'fills')
+        self.assertEqual(list(fills['order_id']), [order['id']])
+        self.assertEqual(fills['price'][0], 1078.8)
+        self.assertEqual(len(read_table(self.directory.name, 'orders')['order_id']), 1)
+
+    def test_appends_and_replays(self):
+        for _ in range(3):
+            self.ftx_client.get_single_market("ETH/USD")
+        self.recorder.close()
+        # not flushed yet
+        Recorder(self.directory.name).record_quote("ETH-PERP", 1078.8, 1078.9)
+        self.assertEqual(len(read_table(self.directory.name, 'quotes')['time']), 3)
+
+        recorder = Recorder(self.directory.name)
+        recorder.record_quote("ETH-PERP", 1078.8, 1078.9, at=time.time() + 1)
+        recorder.close()
+        events = list(quote_events(self.directory.name))
+        self.assertEqual(len(events), 4)
+        exchange = ReplayExchange(events, rtt=0)
+        self.assertEqual(exchange.get_single_market("ETH/USD")['bid'], 1078.4)
+        # recorded without sizes
+        self.assertEqual(events[-1][4], float('inf'))
+
+
+class NoWaitExitSyncTrade(DeltaNeutralTrade):
+    def wait_for_exit_condition(self) -> None:
+        return
+
+
+class TestTradeJournalWithLocalExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+        self.ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name + '/trades.journal'
+        self.journal = TradeJournal(self.path, sync_every=4, sync_interval=60)
+
+    def tearDown(self):
+        self.journal.close()
+        self.exchange.stop()
+        self.directory.cleanup()
+
+    def test_replays_open_trades(self):
+        for trade_id in ('a', 'b'):
+            self.journal.record(trade_id, 'started', underlier='ETH', trade_size=1, market_orders=True,
+                                long_spot=True)
+        self.journal.record('a', 'placed', opening=True, long_order=1, short_order=2,
+                            trade_orders=[[1, 'ETH/USD'], [2, 'ETH-PERP']],
+                            pending_fills=[[1, 'ETH/USD', 1], [2, 'ETH-PERP', 1]])
+        self.journal.record('b', 'abandoned')
+        self.assertEqual(self.journal.syncs, 1)
+        self.journal.sync()
+        with open(self.path, 'ab') as f:
+            # died mid write
+            f.write(b'{"trade": "a", "event": "fill')
+
+        trades = self.journal.open_trades()
+        self.assertEqual(list(trades), ['a'])
+        self.assertEqual(trades['a']['step'], 'placed')
+        self.assertEqual(trades['a']['pending_fills'], {1: ('ETH/USD', 1), 2: ('ETH-PERP', 1)})
+
+        self.journal.compact()
+        self.journal.record('a', 'cancelled')
+        self.journal.close()
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 3)
+        self.assertEqual(TradeJournal(self.path).open_trades(), {})
+
+    def test_resumes_trade_placed_before_restart(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, journal=self.journal)
+        trade.long_spot = True
+        trade._journal_start(market_orders=True)
+        trade.initiate_trade_market_order(True)
+        trade._leg_executor.shutdown()
+        # process dies here, a new one picks it up
+        self.journal.close()
+
+        journal = TradeJournal(self.path)
+        (state,) = journal.open_trades().values()
+        self.assertEqual(state['step'], 'placed')
+        resumed = NoWaitExitSyncTrade(state['underlier'], self.ftx_client, state['trade_size'], journal=journal)
+        pnl = resumed.resume(state)
+        resumed._leg_executor.shutdown()
+
+        self.assertIsNotNone(pnl)
+        self.assertEqual(resumed.long_open_fill['size'], 10)
+        self.assertEqual(resumed.short_close_fill['size'], 10)
+        self.assertEqual(journal.open_trades(), {})
+        # nothing was scanned to find the trade's fills
+        fills_requests = [request[1] for request in self.exchange.requests if request[1].startswith('/api/fills')]
+        self.assertTrue(all('orderId=' in path for path in fills_requests))
+        journal.close()
+
+    def test_resume_closes_again_after_close_timeout(self):
+        trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, journal=self.journal, order_timeout=.1,
+                                  poll_interval=.02)
+        trade.long_spot = True
+        trade._journal_start(market_orders=False)
+        trade.initiate_trade_market_order(True)
+        trade.await_fills()
+        trade.update_fills(True)
+        trade.initiate_trade(False)
+        with self.assertRaisesRegex(Exception, 'Timeout'):
+            trade.order_status_monitor(False)
+        trade._leg_executor.shutdown()
+        self.journal.close()
+
+        journal = TradeJournal(self.path)
+        (state,) = journal.open_trades().values()
+        self.assertEqual((state['stage'], state['step']), ('close', 'close_cancelled'))
+        resumed = NoWaitExitSyncTrade(state['underlier'], self.ftx_client, state['trade_size'], journal=journal,
+                                      poll_interval=.02)
+        threading.Timer(.2, lambda: [self.exchange.fill_order(order['id']) for order in
+                                     list(self.exchange.orders.values()) if order['status'] != 'closed']).start()
+        pnl = resumed.resume(state)
+        resumed._leg_executor.shutdown()
+
+        self.assertIsNotNone(pnl)
+        self.assertEqual((resumed.long_close_fill['size'], resumed.short_close_fill['size']), (10, 10))
+        self.assertEqual(self.exchange.positions[0]['netSize'], 0)
+        self.assertEqual(journal.open_trades(), {})
+        journal.close()
+
+
+class TestOrderStreamWithLocalExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+        self.ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+        self.order_stream = FtxWebsocketClient(api_key='key', api_secret='secret', endpoint=self.exchange.ws_url,
+                                               reconnect_delay=60).start()
+        self.trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, order_stream=self.order_stream)
+        self.trade.long_spot = True
+
+    def tearDown(self):
+        self.order_stream.stop()
+        self.exchange.stop()
+
+    def order_polls(self):
+        return len([request for request in self.exchange.requests if request[:2] == ('GET', '/api/orders')])
+
+    def test_monitor_wakes_on_pushed_fill(self):
+        self.assertTrue(self.order_stream.connected)
+        self.trade.initiate_trade(True)
+        short_id = self.trade.short_order['id']
+
+        threading.Timer(.3, self.exchange.fill_order, [short_id]).start()
+        self.trade.order_status_monitor(True)
+
+        # woke within milliseconds of the fill rather than on the next poll
+        self.assertLess(time.time() - self.exchange.fills[-1]['time'], .05)
+        self.assertIsNone(self.trade.short_order)
+        self.assertEqual(self.trade.long_order['remainingSize'], 10)
+        self.assertEqual(self.order_stream.tracker.get_fills(short_id)[0]['size'], 10)
+        # only the catch-up poll after connecting, the rest came off the stream
+        self.assertEqual(self.order_polls(), 1)
+
+        self.trade.execute_leftover_order()
+        self.assertEqual(self.trade.long_order['type'], 'market')
+
+        # pushed fills are already in, the fills endpoint is only asked once per order
+        self.trade.await_fills()
+        self.assertLess(self.trade.fill_wait_times[0], .5)
+        self.assertEqual(len([request for request in self.exchange.requests if request[1].startswith('/api/fills')]), 2)
+
+    def test_falls_back_to_polling_when_stream_drops(self):
+        self.trade.initiate_trade(True)
+        self.exchange.disconnect_websockets()
+        while self.order_stream.connected:
+            time.sleep(.01)
+
+        threading.Timer(.3, self.exchange.fill_order, [self.trade.long_order['id']]).start()
+        self.trade.order_status_monitor(True)
+
+        self.assertIsNone(self.trade.long_order)
+        self.assertGreater(self.order_polls(), 1)
+
+    def test_bad_login_is_not_connected(self):
+        order_stream = FtxWebsocketClient(api_key='key', api_secret='wrong', endpoint=self.exchange.ws_url,
+                                          reconnect_delay=60).start(timeout=.5)
+        self.assertFalse(order_stream.connected)
+        order_stream.stop()
+
+
+class TestAsyncOrderStreamWithLocalExchange(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+
+    def tearDown(self):
+        self.exchange.stop()
+
+    async def test_monitor_wakes_on_pushed_fill(self):
+        ftx_client = AsyncFtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+        order_stream = await FtxWebsocketClient(api_key='key', api_secret='secret',
+                                                endpoint=self.exchange.ws_url).connect()
+        trade = AsyncDeltaNeutralTrade("ETH", ftx_client, 10, order_stream=order_stream)
+        trade.long_spot = True
+        await trade.initiate_trade(True)
+
+        asyncio.get_running_loop().call_later(.3, self.exchange.fill_order, trade.long_order['id'])
+        await trade.order_status_monitor(True)
+
+        self.assertIsNone(trade.long_order)
+        self.assertEqual(trade.short_order['remainingSize'], 10)
+
+        await trade.execute_leftover_order()
+        await trade.await_fills()
+        self.assertLess(trade.fill_wait_times[0], .5)
+        await order_stream.close()
+        await ftx_client.close()
+
+
+class TestOrderBookCache(unittest.TestCase):
+    def book_message(self, action, bids, asks, checksum):
+        return {'channel': 'orderbook', 'market': 'ETH-PERP', 'type': action,
+                'data': {'action': action, 'bids': bids, 'asks': asks, 'checksum': checksum}}
+
+    def test_partial_and_update(self):
+        cache = OrderBookCache()
+        bids, asks = [[1078.8, 2.0], [1078.7, 1.5]], [[1078.9, 1.0], [1079.0, 3.0]]
+        self.assertTrue(cache.on_message(self.book_message('partial', bids, asks, book_checksum(bids, asks))))
+        self.assertEqual(cache.quote('ETH-PERP'), (1078.8, 1078.9))
+
+        # best ask taken out, new bid inside the old one
+        bids, asks = [[1078.85, 1.0], [1078.8, 2.0], [1078.7, 1.5]], [[1079.0, 3.0]]
+        self.assertTrue(cache.on_message(self.book_message('update', [[1078.85, 1.0]], [[1078.9, 0]],
+                                                           book_checksum(bids, asks))))
+        self.assertEqual(cache.quote('ETH-PERP'), (1078.85, 1079.0))
+
+    def test_bad_checksum_refuses_to_quote(self):
+        cache = OrderBookCache()
+        bids, asks = [[1078.8, 2.0]], [[1078.9, 1.0]]
+        cache.on_message(self.book_message('partial', bids, asks, book_checksum(bids, asks)))
+        self.assertFalse(cache.on_message(self.book_message('update', [[1078.85, 1.0]], [], 0)))
+        self.assertEqual(cache.checksum_failures, 1)
+        with self.assertRaises(StaleQuoteError):
+            cache.quote('ETH-PERP')
+
+    def test_stale_book_refuses_to_quote(self):
+        cache = OrderBookCache()
+        bids, asks = [[1078.8, 2.0]], [[1078.9, 1.0]]
+        cache.on_message(self.book_message('partial', bids, asks, book_checksum(bids, asks)))
+        time.sleep(.02)
+        self.assertGreater(cache.age('ETH-PERP'), .02)
+        with self.assertRaises(StaleQuoteError):
+            cache.quote('ETH-PERP', max_age=.01)
+        with self.assertRaises(StaleQuoteError):
+            cache.quote('ETH/USD')
+
+
+class TestOrderBookStreamWithLocalExchange(unittest.TestCase):
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+        self.exchange.set_book("ETH/USD", [[1078.4, 5.0], [1078.3, 2.0]], [[1078.9, 4.0]])
+        self.exchange.set_book("ETH-PERP", [[1078.8, 5.0]], [[1078.9, 4.0], [1079.0, 1.0]])
+        self.ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url)
+        self.market_stream = FtxWebsocketClient(endpoint=self.exchange.ws_url, markets=["ETH/USD", "ETH-PERP"]).start()
+        self.trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, book_cache=self.market_stream.books)
+        wait_until(lambda: len([book for book in self.market_stream.books.books.values() if book.synced]) == 2)
+
+    def tearDown(self):
+        self.market_stream.stop()
+        self.exchange.stop()
+
+    def test_quotes_come_from_cache(self):
+        self.assertEqual(self.trade.get_spot_quote(), (1078.4, 1078.9))
+        self.assertEqual(self.trade.get_perp_quote(), (1078.8, 1078.9))
+        self.assertEqual(self.exchange.requests, [])
+
+        self.exchange.update_book("ETH-PERP", asks=[[1078.9, 0]])
+        wait_until(lambda: self.trade.get_perp_quote() == (1078.8, 1079.0))
+        self.assertEqual(self.exchange.requests, [])
+
+    def test_resyncs_after_bad_checksum(self):
+        self.exchange.update_book("ETH/USD", bids=[[1078.5, 1.0]], bad_checksum=True)
+        wait_until(lambda: self.market_stream.books.checksum_failures == 1)
+        wait_until(lambda: self.market_stream.books.books["ETH/USD"].synced)
+        self.assertEqual(self.market_stream.books.quote("ETH/USD"), (1078.5, 1078.9))
+
+    def test_stale_book_falls_back_to_rest(self):
+        self.trade.max_quote_age = 0
+        self.assertEqual(self.trade.get_spot_quote(), (1078.4, 1078.9))
+        self.assertEqual(self.exchange.requests[-1][:2], ('GET', '/api/markets/ETH/USD'))
+
+
+class TestRateStore(unittest.TestCase):
+    def setUp(self):
+        self.ftx_client = MockFTXClient()
+        self.now = 3600 * 1000 + 1800
+        self.rate_store = RateStore(self.ftx_client, clock=lambda: self.now)
+
+    def test_shared_between_trades(self):
+        eth_trade = DeltaNeutralTrade("ETH", self.ftx_client, 10, rate_store=self.rate_store)
+        other_eth_trade = DeltaNeutralTrade("ETH", self.ftx_client, 5, rate_store=self.rate_store)
+
+        self.assertEqual(eth_trade.get_spot_borrow_rate(), .001)
+        self.assertEqual(eth_trade.get_spot_lending_rate(), .002)
+        self.assertTrue(other_eth_trade.check_spot_vs_perp())
+
+        # one download of each list served all four lookups
+        self.assertEqual(self.ftx_client.rate_requests, 2)
+        self.assertEqual(self.rate_store.stats()['hits'], 3)
+        self.assertEqual(self.rate_store.stats()['misses'], 1)
+
+    def test_expires_on_the_hour(self):
+        self.assertEqual(self.rate_store.borrow_rate("ETH"), .001)
+        self.ftx_client.set_borrow_rates(.001, .004)
+
+        self.now += 1799
+        self.assertEqual(self.rate_store.borrow_rate("ETH"), .001)
+        self.now += 1
+        self.assertEqual(self.rate_store.borrow_rate("ETH"), .004)
+        self.assertEqual(self.ftx_client.rate_requests, 4)
+
+
+class TestAsyncRateStoreWithLocalExchange(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_lookups_share_one_refresh(self):
+        with LocalFtxExchange() as exchange:
+            exchange.borrow_rates.append({'coin': 'BTC', 'previous': .0005, 'estimate': .0006})
+            exchange.lending_rates.append({'coin': 'BTC', 'previous': .0003, 'estimate': .0004})
+            ftx_client = AsyncFtxClient(api_key='key', api_secret='secret', endpoint=exchange.url)
+            rate_store = RateStore(ftx_client)
+
+            rates = await asyncio.gather(rate_store.borrow_rate_async("ETH"), rate_store.lending_rate_async("ETH"),
+                                         rate_store.borrow_rate_async("BTC"), rate_store.lending_rate_async("BTC"))
+
+            self.assertEqual(rates, [.001, .002, .0006, .0004])
+            self.assertEqual(sorted(request[1] for request in exchange.requests),
+                             ['/api/spot_margin/borrow_rates', '/api/spot_margin/lending_rates'])
+            await ftx_client.close()
+
+
+class TestCarryScanner(unittest.IsolatedAsyncioTestCase):
+    def test_rank_carry(self):
+        coins, borrow, lend, funding = align_rates(
+            [{'coin': 'ETH', 'estimate': .001}, {'coin': 'BTC', 'estimate': .0001}, {'coin': 'SOL', 'estimate': .002}],
+            [{'coin': 'ETH', 'estimate': .002}, {'coin': 'BTC', 'estimate': .0001}],
+            {'ETH': .003, 'BTC': -.008, 'SOL': .01})
+
+        # SOL has no lending rate so it can't be traded
+        self.assertEqual(list(coins), ['BTC', 'ETH'])
+
+        table = rank_carry(coins, borrow, lend, funding)
+        self.assertEqual(list(table['coin']), ['ETH', 'BTC'])
+        self.assertAlmostEqual(table['best_carry'][0], .005)
+        self.assertTrue(table['long_spot'].all())
+
+        # negative funding makes BTC the best carry once shorting spot is allowed
+        table = rank_carry(coins, borrow, lend, funding, allow_short_spot=True)
+        self.assertEqual(list(table['coin']), ['BTC', 'ETH'])
+        self.assertAlmostEqual(table['best_carry'][0], .0079)
+        self.assertFalse(table['long_spot'][0])
+
+    async def test_scan_with_local_exchange(self):
+        with LocalFtxExchange() as exchange:
+            exchange.borrow_rates.append({'coin': 'BTC', 'previous': .0001, 'estimate': .0001})
+            exchange.lending_rates.append({'coin': 'BTC', 'previous': .0001, 'estimate': .0001})
+            exchange.futures['BTC-PERP'] = {'name': 'BTC-PERP', 'underlying': 'BTC', 'type': 'perpetual'}
+            exchange.futures['BTC-0930'] = {'name': 'BTC-0930', 'underlying': 'BTC', 'type': 'future'}
+            exchange.future_stats['BTC-PERP'] = {'nextFundingRate': .004}
+            ftx_client = AsyncFtxClient(api_key='key', api_secret='secret', endpoint=exchange.url)
+
+            table = await CarryScanner(ftx_client).scan()
+
+            self.assertEqual(list(table['coin']), ['ETH', 'BTC'])
+            self.assertAlmostEqual(table['best_carry'][1], .0041)
+            # dated futures aren't asked for funding stats
+            self.assertNotIn('/api/futures/BTC-0930/stats', [request[1] for request in exchange.requests])
+            await ftx_client.close()
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+    def test_request_priority(self):
+        self.assertEqual(request_priority('DELETE', 'orders/12'), CANCEL)
+        self.assertEqual(request_priority('POST', 'orders', {'type': 'market'}), CANCEL)
+        self.assertEqual(request_priority('POST', 'orders', {'type': 'limit'}), PLACE)
+        self.assertEqual(request_priority('POST', 'orders/12/modify', {'price': 1}), PLACE)
+        self.assertEqual(request_priority('GET', 'orders'), DATA)
+        self.assertEqual(request_priority('GET', 'markets/ETH/USD'), DATA)
+
+    def test_cancel_jumps_queued_requests(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        limiter.acquire(DATA)
+        sent = []
+
+        def request(name, priority):
+            limiter.acquire(priority)
+            sent.append(name)
+
+        threads = [threading.Thread(target=request, args=('data' + str(i), DATA)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+            time.sleep(.005)
+        threads.append(threading.Thread(target=request, args=('cancel', CANCEL)))
+        threads[-1].start()
+        for thread in threads:
+            thread.join()
+
+        # queued behind the bucket, the cancel still goes out next
+        self.assertEqual(sent, ['cancel', 'data0', 'data1', 'data2'])
+        stats = limiter.stats()
+        self.assertEqual(stats['data']['max_queued'], 3)
+        self.assertEqual(stats['data']['queued'], 0)
+        self.assertEqual(stats['data']['requests'], 4)
+        self.assertGreater(stats['data']['max_wait'], .1)
+        self.assertLess(stats['cancel']['max_wait'], .1)
+
+    async def test_async_priority_order(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        await limiter.acquire_async(DATA)
+        sent = []
+
+        async def request(name, priority):
+            await limiter.acquire_async(priority)
+            sent.append(name)
+
+        await asyncio.gather(request('data', DATA), request('place', PLACE), request('cancel', CANCEL))
+        self.assertEqual(sent, ['cancel', 'place', 'data'])
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        await limiter.acquire_async(DATA)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(limiter.acquire_async(CANCEL), .01)
+        await asyncio.wait_for(limiter.acquire_async(DATA), 1)
+        self.assertEqual(limiter.stats()['cancel']['queued'], 0)
+
+    def test_paces_client_requests(self):
+        with LocalFtxExchange() as exchange:
+            ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=exchange.url,
+                                   rate_limiter=RateLimiter(rate=100, burst=5))
+            start = time.monotonic()
+            for _ in range(15):
+                ftx_client.get_single_market("ETH/USD")
+            # 5 straight away, 10 more at 100/s
+            self.assertGreater(time.monotonic() - start, .09)
+            self.assertEqual(ftx_client.rate_limiter.stats()['data']['requests'], 15)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_endpoint_name(self):
+        self.assertEqual(endpoint_name('GET', 'markets/ETH/USD'), 'GET markets/{market}')
+        self.assertEqual(endpoint_name('GET', 'markets/ETH-PERP'), 'GET markets/{market}')
+        self.assertEqual(endpoint_name('GET', 'futures/ETH-PERP/stats'), 'GET futures/{market}/stats')
+        self.assertEqual(endpoint_name('DELETE', 'orders/1234'), 'DELETE orders/{id}')
+        self.assertEqual(endpoint_name('POST', 'orders/1234/modify'), 'POST orders/{id}/modify')
+        self.assertEqual(endpoint_name('GET', 'fills?orderId=5'), 'GET fills')
+
+    def test_histogram(self):
+        histogram = LatencyHistogram()
+        for ms in range(1, 101):
+            histogram.record(ms / 1000)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['mean_ms'], 50.5)
+        self.assertEqual(summary['max_ms'], 100)
+        # buckets double, so percentiles are within a factor of 2
+        self.assertTrue(50 <= summary['p50_ms'] <= 100)
+        self.assertTrue(90 <= summary['p99_ms'] <= 100)
+        self.assertIsNone(LatencyHistogram().percentile(50))
+
+    def test_client_and_trade_stages_share_metrics(self):
+        with LocalFtxExchange() as exchange:
+            ftx_client = FtxClient(api_key='key', api_secret='secret', endpoint=exchange.url)
+            trade = DeltaNeutralTrade("ETH", ftx_client, 10)
+            trade.long_spot = True
+            trade.initiate_trade(True)
+            for order in (trade.long_order, trade.short_order):
+                ftx_client.cancel_order(order['id'])
+
+        self.assertIs(trade.metrics, ftx_client.metrics)
+        summary = ftx_client.metrics.summary()
+        self.assertEqual(summary['requests']['GET markets/{market}']['total']['count'], 1)
+        self.assertEqual(summary['requests']['POST orders']['total']['count'], 2)
+        self.assertEqual(set(summary['requests']['DELETE orders/{id}']), {'queue', 'sign', 'network', 'decode', 'total'})
+        self.assertEqual(summary['stages']['quote']['count'], 1)
+        self.assertEqual(summary['stages']['place']['count'], 1)
+        self.assertIn('DELETE orders/{id}', ftx_client.metrics.format_summary())
+
+
+class NoWaitExitTrade(AsyncDeltaNeutralTrade):
+    async def wait_for_exit_condition(self):
+        pass
+
+
+class TestPortfolioWithLocalExchange(unittest.IsolatedAsyncioTestCase):
+    underliers = ["ETH", "BTC", "SOL", "AVAX", "DOT", "LINK", "UNI", "AAVE"]
+
+    def setUp(self):
+        self.exchange = LocalFtxExchange().start()
+        for coin in self.underliers[1:]:
+            self.exchange.list_underlier(coin)
+
+    def tearDown(self):
+        self.exchange.stop()
+
+    def gets(self, path):
+        return len([request for request in self.exchange.requests
+                    if request[0] == 'GET' and request[1].split('?')[0] == path])
+
+    async def test_market_order_trades_share_one_client(self):
+        async with AsyncFtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url) as ftx_client:
+            portfolio = Portfolio(ftx_client, {coin: 1 for coin in self.underliers}, market_orders=True,
+                                  trade_class=NoWaitExitTrade)
+            pnl = await portfolio.run()
+
+        self.assertEqual(portfolio.errors, {})
+        self.assertEqual(sorted(pnl), sorted(self.underliers))
+        # every trade timed its stages into the client's metrics
+        self.assertEqual(ftx_client.metrics.stage_histogram('fill_update').count, 2 * len(self.underliers))
+        # bought spot at the ask and sold it at the bid, sold the perp at the bid and bought it at the ask
+        self.assertAlmostEqual(pnl["SOL"], (1078.4 - 1078.9) + (1078.8 - 1078.9))
+        # one rates download for all of them
+        self.assertEqual(self.gets('/api/spot_margin/borrow_rates'), 1)
+
+    async def test_maker_trades_share_one_poller(self):
+        def fill_sell_orders():
+            # take out every resting sell order, the buy leg is then finished at market
+            while not done.is_set():
+                for order in list(self.exchange.orders.values()):
+                    if order['status'] == 'open' and order['type'] == 'limit' and order['side'] == 'sell':
+                        self.exchange.fill_order(order['id'])
+                time.sleep(.02)
+
+        done = threading.Event()
+        filler = threading.Thread(target=fill_sell_orders)
+        filler.start()
+        try:
+            async with AsyncFtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url) as ftx_client:
+                portfolio = Portfolio(ftx_client, {coin: 1 for coin in self.underliers}, poll_interval=.05,
+                                      trade_class=NoWaitExitTrade)
+                pnl = await portfolio.run()
+        finally:
+            done.set()
+            filler.join()
+
+        self.assertEqual(portfolio.errors, {})
+        self.assertEqual(sorted(pnl), sorted(self.underliers))
+        # past the catch-up poll each monitor makes, open orders are polled once for everybody
+        self.assertLessEqual(self.gets('/api/orders'),
+                             portfolio.order_feed.polls + 2 * len(self.underliers))
+
+    async def test_chased_legs_are_followed_through_the_poller(self):
+        def fill_orders():
+            # every resting sell fills straight away, buys only once they are chased to the touch
+            while not done.is_set():
+                for order in list(self.exchange.orders.values()):
+                    if order['status'] != 'open' or order['type'] != 'limit':
+                        continue
+                    quote = self.exchange.markets.get(order['market']) or self.exchange.futures[order['market']]
+                    if order['side'] == 'sell' or order['price'] == quote['bid']:
+                        self.exchange.fill_order(order['id'])
+                time.sleep(.02)
+
+        underliers = self.underliers[:3]
+        done = threading.Event()
+        filler = threading.Thread(target=fill_orders)
+        filler.start()
+        try:
+            async with AsyncFtxClient(api_key='key', api_secret='secret', endpoint=self.exchange.url) as ftx_client:
+                portfolio = Portfolio(ftx_client, {coin: 1 for coin in underliers}, poll_interval=.05,
+                                      trade_class=NoWaitExitTrade,
+                                      trade_kwargs={'hedge_mode': 'chase', 'chase_deadline': 5})
+                pnl = await portfolio.run()
+        finally:
+            done.set()
+            filler.join()
+
+        self.assertEqual(portfolio.errors, {})
+        self.assertEqual(sorted(pnl), sorted(underliers))
+        for trade in portfolio.trades.values():
+            # the amended buy filled at the touch, nothing was taken at the deadline
+            self.assertEqual((trade.hedge_stats['amends'], trade.hedge_stats['taker_size']), (1, 0))
+            self.assertLess(trade.hedge_stats['seconds'], 2)
+            self.assertEqual((trade.long_close_fill['size'], trade.short_close_fill['size']), (1, 1))
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(.005)
 
 
 class MockFTXClient:
@@ -151,15 +1684,24 @@ class MockFTXClient:
         self.perp_ask = 1078.9
         self.order = [{'id': 0, 'remainingSize': 10}, {'id': 1, 'remainingSize': 10}]
         self.order_status = [{'id': 0, 'filledSize': 10, 'remainingSize': 0, 'avgFillPrice': 1078.4},{'id': 1, 'filledSize': 10, 'remainingSize': 0, 'avgFillPrice': 1078.5}]
-        self.fills = [{'price': 1078.4, 'fee': .05, 'size':10}, {'price': 1078.9, 'fee': .1, 'size':10}]
+        self.fills = [{'id': 0, 'orderId': 0, 'market': "ETH/USD", 'price': 1078.4, 'fee': .05, 'size':10},
+                      {'id': 1, 'orderId': 1, 'market': "ETH-PERP", 'price': 1078.9, 'fee': .1, 'size':10}]
+        self.next_fill_id = 2
+        self.latency = 0
+        self.rejected_market = None
+        self.placed = []
+        self.cancelled = []
+        self.rate_requests = 0
 
     def get_borrow_rates(self):
+        self.rate_requests += 1
         return [{'coin':'ETH', 'previous':self.borrow_rate_prev, 'estimate':self.borrow_rate_est}]
     def set_borrow_rates(self, prev, est):
         self.borrow_rate_prev = prev
         self.borrow_rate_est = est
 
     def get_lending_rates(self):
+        self.rate_requests += 1
         return [{'coin':'ETH', 'previous':self.lending_rate_prev, 'estimate':self.lending_rate_est}]
     def set_lending_rates(self, prev, est):
         self.lending_rate_prev = prev
@@ -182,7 +1724,16 @@ class MockFTXClient:
         self.perp_bid = bid
         self.perp_ask = ask
 
+    def set_latency(self, latency):
+        self.latency = latency
+    def set_rejected_market(self, market):
+        self.rejected_market = market
+
     def place_order(self, market, side, price, size, type, post_only=False):
+        time.sleep(self.latency)
+        if market == self.rejected_market:
+            raise Exception("Order rejected")
+        self.placed.append((market, side, price, size, type))
         if side == "buy":
             return self.order[0]
         else:
@@ -197,19 +1748,46 @@ class MockFTXClient:
         order_2_dict = None if id2 is None else {'id': id2, 'filledSize': filledSize2, 'remainingSize': remainingSize2, 'avgFillPrice': avgFillPrice2}
         self.order_status = [order_1_dict, order_2_dict]
 
-    def get_fills(self, market):
-        if market == "ETH/USD":
-            return [self.fills[0], {'orderId':999}]
-        else:
-            return [self.fills[1], {'orderId':999}]
+    def get_fills(self, market, order_id=None):
+        return [fill for fill in self.fills if fill['market'] == market]
     def set_fills(self,id1, price1, fee1, size1, id2, price2, fee2, size2):
-        self.fills = [{'orderId': id1, 'price': price1, 'fee': fee1, 'size':size1}, {'orderId': id2,'price': price2, 'fee': fee2, 'size':size2}]
+        self.fills = [{'id': self.next_fill_id, 'orderId': id1, 'market': "ETH/USD", 'price': price1, 'fee': fee1, 'size':size1},
+                      {'id': self.next_fill_id + 1, 'orderId': id2, 'market': "ETH-PERP", 'price': price2, 'fee': fee2, 'size':size2}]
+        self.next_fill_id += 2
     
     def modify_order(self, existing_order_id, price):
         return self.get_order_status(existing_order_id)
     
     def cancel_order(self, existing_order_id):
+        self.cancelled.append(existing_order_id)
         return None
 
+class TestImports(unittest.TestCase):
+
+    def test_importing_main_is_quiet_and_light(self):
+        # a fresh interpreter, this one has everything loaded already
+        code = ("import sys, main, cli; "
+                "print(sorted(m for m in ('requests', 'aiohttp', 'numpy', 'dotenv', 'audioop', 'xmlrpc') "
+                "if m in sys.modules))")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout, "[]\n")
+        self.assertEqual(result.stderr, "")
+
+    def test_entry_point_modules_load_settings_and_sdks_when_run(self):
+        code = ("import sys, scanner, portfolio, main_pybit; "
+                "print(sorted(m for m in ('requests', 'dotenv', 'pybit') if m in sys.modules))")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout, "[]\n")
+
+    def test_cli_arguments(self):
+        args = cli.parse_args(['--underlier', 'BTC', '--size', '.001', '--mode', 'chase', '--adaptive-quotes'])
+        self.assertEqual((args.underlier, args.size, args.mode, args.adaptive_quotes), ('BTC', .001, 'chase', True))
+        self.assertEqual(cli.parse_args([]).mode, 'compare')
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file